@@ -0,0 +1,193 @@
+"""图像处理热点路径的基准测试
+
+在合成的笔记本照片上分别计时读取（JPEG解码）、页面检测、备选分割、预处理和上传编码，
+输出每张图片各阶段的延迟与内存峰值，并可与保存的基线比较。完全离线、仅使用CPU。
+
+用法（在项目根目录下）：
+    python -m benchmarks.bench_image_processing                    # 12MP/48MP，1页和3页
+    python -m benchmarks.bench_image_processing --quick            # 快速冒烟测试
+    python -m benchmarks.bench_image_processing --save-baseline    # 保存为基线
+    python -m benchmarks.bench_image_processing --pages 1 2 3 4 --repeat 5
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import statistics
+import tracemalloc
+from typing import Dict, List, Callable, Any
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.synthetic import RESOLUTIONS, make_notebook_photo
+from processors.image_processor import ImageProcessor
+from processors.ocr_processor import OCRProcessor
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+STAGES = ('read', 'detect', 'fallback', 'preprocess', 'encode')
+# 小于该绝对差值（秒）的变慢视为测量噪声
+MIN_DELTA_SECONDS = 0.005
+
+
+def measure(func: Callable[[], Any]):
+    """执行func，返回 (结果, 耗时秒数, 新增内存峰值MB)"""
+    tracemalloc.reset_peak()
+    base = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] - base
+    return result, elapsed, max(peak, 0) / 1024 / 1024
+
+
+def run_case(resolution: str, pages: int, repeat: int, seed: int, profile: str = None) -> Dict[str, Dict[str, float]]:
+    """对一种分辨率/页数组合运行基准测试"""
+    photo = make_notebook_photo(RESOLUTIONS[resolution], pages=pages, seed=seed)
+    success, encoded = cv2.imencode('.jpg', photo, [int(cv2.IMWRITE_JPEG_QUALITY), 92])
+    if not success:
+        raise RuntimeError("合成图片编码失败")
+    del photo
+
+    # 仅用于调用上传编码，不会发起网络请求
+    ocr = OCRProcessor(api_key='benchmark', base_url='http://localhost')
+
+    timings = {stage: [] for stage in STAGES}
+    peaks = {stage: 0.0 for stage in STAGES}
+
+    def record(stage, elapsed, peak):
+        timings[stage].append(elapsed)
+        peaks[stage] = max(peaks[stage], peak)
+
+    for _ in range(repeat):
+        image, elapsed, peak = measure(lambda: cv2.imdecode(encoded, cv2.IMREAD_COLOR))
+        record('read', elapsed, peak)
+
+        detected, elapsed, peak = measure(lambda image=image: ImageProcessor.detect_pages(image))
+        record('detect', elapsed, peak)
+
+        _, elapsed, peak = measure(lambda image=image: ImageProcessor._fallback_page_detection(image))
+        record('fallback', elapsed, peak)
+
+        # 预处理与编码按每张图片的全部页面累计
+        preprocess_time = encode_time = 0.0
+        preprocess_peak = encode_peak = 0.0
+        for page in detected:
+            processed, elapsed, peak = measure(lambda page=page: ImageProcessor.preprocess_image(page, profile))
+            preprocess_time += elapsed
+            preprocess_peak = max(preprocess_peak, peak)
+            _, elapsed, peak = measure(lambda processed=processed: ocr.prepare_upload(processed))
+            encode_time += elapsed
+            encode_peak = max(encode_peak, peak)
+        record('preprocess', preprocess_time, preprocess_peak)
+        record('encode', encode_time, encode_peak)
+        # 释放本轮的图片，下一轮的内存峰值不受影响
+        del image, detected
+
+    return {
+        stage: {
+            'median_s': statistics.median(values),
+            'min_s': min(values),
+            'peak_mb': peaks[stage],
+        }
+        for stage, values in timings.items()
+    }
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """与基线比较，返回变慢超过容差的条目"""
+    regressions = []
+    for case, stages in results['cases'].items():
+        for stage, stats in stages.items():
+            base = baseline.get('cases', {}).get(case, {}).get(stage)
+            if not base or base['median_s'] <= 0:
+                continue
+            ratio = stats['median_s'] / base['median_s']
+            stats['baseline_median_s'] = base['median_s']
+            stats['ratio'] = ratio
+            if ratio > 1 + tolerance and stats['median_s'] - base['median_s'] > MIN_DELTA_SECONDS:
+                regressions.append(f"{case} {stage}: {base['median_s']:.3f}s -> {stats['median_s']:.3f}s ({ratio:.2f}x)")
+    return regressions
+
+
+def print_table(results: Dict[str, Any]):
+    header = f"{'case':<20}{'stage':<12}{'median(s)':>11}{'min(s)':>10}{'peak(MB)':>10}{'vs base':>9}"
+    print(header)
+    print('-' * len(header))
+    for case, stages in results['cases'].items():
+        for stage, stats in stages.items():
+            ratio = f"{stats['ratio']:.2f}x" if 'ratio' in stats else '-'
+            print(f"{case:<20}{stage:<12}{stats['median_s']:>11.3f}{stats['min_s']:>10.3f}"
+                  f"{stats['peak_mb']:>10.1f}{ratio:>9}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="NoteOCR 图像处理基准测试")
+    parser.add_argument('--resolutions', nargs='+', default=['12MP', '48MP'], choices=sorted(RESOLUTIONS))
+    parser.add_argument('--pages', nargs='+', type=int, default=[1, 3], choices=[1, 2, 3, 4])
+    parser.add_argument('--repeat', type=int, default=3, help="每种组合的重复次数")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--profile', choices=ImageProcessor.PREPROCESS_PROFILES,
+                        default=ImageProcessor.PREPROCESS_PROFILE, help="预处理档位")
+    parser.add_argument('--quick', action='store_true', help="只运行3MP/3页、重复1次的快速测试")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help="基线文件路径")
+    parser.add_argument('--save-baseline', action='store_true', help="将本次结果保存为基线")
+    parser.add_argument('--tolerance', type=float, default=0.10, help="判定为变慢的相对容差")
+    parser.add_argument('--output', help="将结果写入JSON文件")
+    args = parser.parse_args(argv)
+
+    if args.quick:
+        args.resolutions, args.pages, args.repeat = ['3MP'], [3], 1
+
+    # 与生产环境的进程池工作进程保持一致
+    cv2.setNumThreads(1)
+    tracemalloc.start()
+
+    results = {
+        'meta': {
+            'python': platform.python_version(),
+            'opencv': cv2.__version__,
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'cpu_count': os.cpu_count(),
+            'repeat': args.repeat,
+            'seed': args.seed,
+            'profile': args.profile,
+        },
+        'cases': {},
+    }
+    for resolution in args.resolutions:
+        for pages in args.pages:
+            case = f"{resolution}-{pages}p-{args.profile}"
+            print(f"运行 {case} ...", file=sys.stderr)
+            results['cases'][case] = run_case(resolution, pages, args.repeat, args.seed, args.profile)
+
+    regressions = []
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+
+    print_table(results)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"基线已保存到 {args.baseline}")
+
+    if regressions:
+        print("\n以下阶段比基线变慢：")
+        for line in regressions:
+            print(f"  {line}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,88 @@
+import math
+from typing import Tuple
+
+import cv2
+import numpy as np
+
+# 常见手机照片分辨率（宽, 高）
+RESOLUTIONS = {
+    '3MP': (2000, 1500),
+    '12MP': (4000, 3000),
+    '48MP': (8000, 6000),
+}
+
+
+def _draw_page(page: np.ndarray, rng: np.random.Generator):
+    """在页面上绘制横线和模拟手写的笔画"""
+    height, width = page.shape[:2]
+    line_gap = max(height // 28, 12)
+    thickness = max(height // 600, 1)
+    for y in range(line_gap * 2, height - line_gap, line_gap):
+        cv2.line(page, (width // 20, y), (width - width // 20, y), (205, 190, 170), thickness)
+
+        # 每行随机若干“字”：由短折线组成的笔画
+        x = width // 15
+        while x < width - width // 10 and rng.random() > 0.03:
+            char_width = int(line_gap * rng.uniform(0.5, 0.9))
+            points = np.column_stack([
+                x + rng.integers(0, char_width, 5),
+                y - rng.integers(2, int(line_gap * 0.8), 5),
+            ]).astype(np.int32)
+            cv2.polylines(page, [points], False, (40, 40, 60), thickness + 1, cv2.LINE_AA)
+            x += char_width + int(line_gap * rng.uniform(0.1, 0.5))
+
+
+def make_notebook_photo(resolution: Tuple[int, int], pages: int = 3, skew_degrees: float = 3.0,
+                        noise_sigma: float = 6.0, seed: int = 0) -> np.ndarray:
+    """生成一张模拟的笔记本摊开照片
+
+    Args:
+        resolution: 图片尺寸（宽, 高）
+        pages: 并排的页面数（1-4）
+        skew_degrees: 页面的最大随机倾斜角度
+        noise_sigma: 高斯噪声的标准差
+        seed: 随机种子，相同参数生成的图片完全一致
+    """
+    rng = np.random.default_rng(seed)
+    width, height = resolution
+
+    # 桌面背景：带渐变的深色
+    gradient = np.linspace(60, 110, width, dtype=np.float32)
+    image = np.empty((height, width, 3), dtype=np.uint8)
+    image[:, :, 0] = gradient * 0.8
+    image[:, :, 1] = gradient * 0.9
+    image[:, :, 2] = gradient
+
+    margin_x = width // 30
+    page_width = (width - margin_x * (pages + 1)) // pages
+    page_height = int(height * 0.88)
+    top = (height - page_height) // 2
+
+    for i in range(pages):
+        page = np.full((page_height, page_width, 3), (238, 242, 245), dtype=np.uint8)
+        _draw_page(page, rng)
+
+        # 带随机倾斜的透视变换，把页面贴到背景上
+        left = margin_x + i * (page_width + margin_x)
+        angle = math.radians(rng.uniform(-skew_degrees, skew_degrees))
+        cx, cy = left + page_width / 2, top + page_height / 2
+        corners = np.array([[0, 0], [page_width, 0], [page_width, page_height], [0, page_height]], np.float32)
+        offsets = corners - [page_width / 2, page_height / 2]
+        rotated = np.column_stack([
+            offsets[:, 0] * math.cos(angle) - offsets[:, 1] * math.sin(angle) + cx,
+            offsets[:, 0] * math.sin(angle) + offsets[:, 1] * math.cos(angle) + cy,
+        ]).astype(np.float32)
+        matrix = cv2.getPerspectiveTransform(corners, rotated)
+        mask = np.full((page_height, page_width), 255, np.uint8)
+        warped = cv2.warpPerspective(page, matrix, (width, height))
+        warped_mask = cv2.warpPerspective(mask, matrix, (width, height))
+        np.copyto(image, warped, where=warped_mask[:, :, None] > 0)
+
+    # 光照不均与传感器噪声
+    yy = np.linspace(-1, 1, height, dtype=np.float32)[:, None]
+    xx = np.linspace(-1, 1, width, dtype=np.float32)[None, :]
+    vignette = 1.0 - 0.18 * (xx ** 2 + yy ** 2)
+    noisy = image.astype(np.float32) * vignette[:, :, None]
+    if noise_sigma > 0:
+        noisy += rng.normal(0, noise_sigma, noisy.shape).astype(np.float32)
+    return np.clip(noisy, 0, 255).astype(np.uint8)
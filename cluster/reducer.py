@@ -0,0 +1,50 @@
+import os
+import json
+import logging
+from typing import Dict
+
+from cluster.work_queue import WorkQueue, DONE, FAILED
+from utils.journal import RunJournal
+from utils.markdown_output import MarkdownOutput
+
+
+def reduce_shards(queue: WorkQueue, output: MarkdownOutput, input_dir: str, shard_dir: str) -> Dict[str, int]:
+    """按入队顺序把已完成的分片合并到Markdown输出
+
+    只合并从头开始连续完成的部分：遇到仍在排队或处理中的图片即停止，
+    保证追加写入的输出与单机运行的顺序一致；失败的图片跳过。
+    已输出且之后未修改的图片不会重复写入，可以在工作进程运行期间反复执行。
+
+    Returns:
+        merged（本次合并）、skipped（失败或已修改而跳过）、waiting（尚未完成）的图片数
+    """
+    result = {'merged': 0, 'skipped': 0, 'waiting': 0}
+    items = queue.items()
+    for index, item in enumerate(items):
+        if item['status'] == FAILED:
+            logging.warning(f"{item['path']} 处理失败，未合并: {item['error']}")
+            result['skipped'] += 1
+            continue
+        if item['status'] != DONE:
+            result['waiting'] = len(items) - index
+            break
+
+        image_path = os.path.join(input_dir, item['path'])
+        if output.is_done(image_path):
+            continue
+        with open(os.path.join(shard_dir, item['shard']), 'r', encoding='utf-8') as f:
+            shard = json.load(f)
+        try:
+            modified = shard['signature'] != RunJournal.file_signature(image_path)
+        except OSError:
+            modified = True
+        if modified:
+            logging.warning(f"{item['path']} 在处理后被修改或删除，重新入队后再合并")
+            result['skipped'] += 1
+            continue
+
+        for page in shard['pages']:
+            output.write({'filename': page['filename'], 'text': page['text'], 'source': image_path})
+        output.finish_image(image_path)
+        result['merged'] += 1
+    return result
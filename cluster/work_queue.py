@@ -0,0 +1,238 @@
+import os
+import time
+import sqlite3
+import threading
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+
+from utils.metrics import metrics
+
+# 图片状态
+PENDING = 'pending'
+LEASED = 'leased'
+DONE = 'done'
+FAILED = 'failed'
+
+
+@dataclass
+class WorkItem:
+    """一张被领取的图片"""
+    path: str          # 相对输入目录的路径，各节点按自己的输入目录解析
+    seq: int           # 入队顺序，合并输出时按此排序
+    attempt: int       # 第几次领取，同时作为租约的令牌
+    signature: str
+
+
+class WorkQueue:
+    """多个工作进程共享的图片队列（SQLite）
+
+    工作进程以租约方式领取图片：领取时记录租约到期时间，处理期间定期续约，
+    完成时只有仍持有该租约（attempt 一致）的进程才能提交结果。
+    进程崩溃后租约到期，图片自动回到可领取状态，由其他进程重新处理；
+    同一张图片被领取 max_attempts 次仍未完成时标记为失败。
+
+    数据库放在各节点都能访问的位置即可在多台机器之间共享，
+    领取在 BEGIN IMMEDIATE 事务中完成，同一张图片同一时刻只会被一个进程持有。
+    """
+
+    def __init__(self, db_path: str, lease_seconds: float = 300, max_attempts: int = 3,
+                 busy_timeout: float = 30, clock: Callable[[], float] = time.time):
+        """初始化
+
+        Args:
+            db_path: SQLite数据库路径
+            lease_seconds: 租约时长（秒），超过该时间未续约的图片可被其他进程领取
+            max_attempts: 每张图片最多领取的次数
+            busy_timeout: 等待其他进程释放数据库锁的最长时间（秒）
+            clock: 返回当前时间戳的函数，租约到期时间按它计算
+        """
+        self.db_path = db_path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.clock = clock
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        # 事务由代码显式控制
+        self._conn = sqlite3.connect(db_path, timeout=busy_timeout, isolation_level=None,
+                                     check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS items (
+                path TEXT PRIMARY KEY,
+                seq INTEGER NOT NULL,
+                signature TEXT NOT NULL,
+                status TEXT NOT NULL,
+                worker TEXT,
+                attempt INTEGER NOT NULL DEFAULT 0,
+                lease_until REAL,
+                shard TEXT,
+                error TEXT,
+                updated_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_items_status ON items (status, seq)')
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _transaction(self, func):
+        """在写事务中执行 func(conn)"""
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                result = func(self._conn)
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+            self._conn.execute('COMMIT')
+            return result
+
+    def enqueue(self, items: Dict[str, str]) -> int:
+        """按给定顺序加入图片
+
+        Args:
+            items: 相对路径 -> 文件签名；已在队列中且签名未变的图片保持原状态，
+                签名变化的图片重新排队
+
+        Returns:
+            新加入或重新排队的图片数
+        """
+        def run(conn):
+            now = self.clock()
+            seq = conn.execute('SELECT COALESCE(MAX(seq), 0) FROM items').fetchone()[0]
+            added = 0
+            for path, signature in items.items():
+                row = conn.execute('SELECT signature FROM items WHERE path = ?', (path,)).fetchone()
+                if row is None:
+                    seq += 1
+                    conn.execute(
+                        'INSERT INTO items (path, seq, signature, status, updated_at) VALUES (?, ?, ?, ?, ?)',
+                        (path, seq, signature, PENDING, now)
+                    )
+                elif row[0] != signature:
+                    conn.execute(
+                        'UPDATE items SET signature = ?, status = ?, worker = NULL, attempt = 0, '
+                        'lease_until = NULL, shard = NULL, error = NULL, updated_at = ? WHERE path = ?',
+                        (signature, PENDING, now, path)
+                    )
+                else:
+                    continue
+                added += 1
+            return added
+
+        return self._transaction(run)
+
+    def claim(self, worker: str, limit: int) -> List[WorkItem]:
+        """领取最多limit张可处理的图片：未领取的图片，以及租约已过期的图片"""
+        def run(conn):
+            now = self.clock()
+            # 多次领取仍未完成的图片不再重试
+            conn.execute(
+                'UPDATE items SET status = ?, error = ?, updated_at = ? '
+                'WHERE status = ? AND lease_until < ? AND attempt >= ?',
+                (FAILED, "租约多次过期", now, LEASED, now, self.max_attempts)
+            )
+            rows = conn.execute(
+                'SELECT path, seq, signature, status, attempt FROM items '
+                'WHERE status = ? OR (status = ? AND lease_until < ?) ORDER BY seq LIMIT ?',
+                (PENDING, LEASED, now, limit)
+            ).fetchall()
+            claimed = []
+            for path, seq, signature, status, attempt in rows:
+                if status == LEASED:
+                    metrics.increment('cluster.reclaimed')
+                conn.execute(
+                    'UPDATE items SET status = ?, worker = ?, attempt = ?, lease_until = ?, updated_at = ? '
+                    'WHERE path = ?',
+                    (LEASED, worker, attempt + 1, now + self.lease_seconds, now, path)
+                )
+                claimed.append(WorkItem(path, seq, attempt + 1, signature))
+            return claimed
+
+        items = self._transaction(run)
+        metrics.increment('cluster.claimed', len(items))
+        return items
+
+    def renew(self, items: List[WorkItem]) -> int:
+        """为仍持有的租约续期，返回成功续期的数量"""
+        def run(conn):
+            until = self.clock() + self.lease_seconds
+            return sum(
+                conn.execute(
+                    'UPDATE items SET lease_until = ? WHERE path = ? AND attempt = ? AND status = ?',
+                    (until, item.path, item.attempt, LEASED)
+                ).rowcount
+                for item in items
+            )
+
+        return self._transaction(run)
+
+    def complete(self, item: WorkItem, shard: str) -> bool:
+        """提交结果，租约已失效（被其他进程重新领取）时返回False"""
+        def run(conn):
+            return conn.execute(
+                'UPDATE items SET status = ?, shard = ?, lease_until = NULL, error = NULL, updated_at = ? '
+                'WHERE path = ? AND attempt = ? AND status = ?',
+                (DONE, shard, self.clock(), item.path, item.attempt, LEASED)
+            ).rowcount == 1
+
+        return self._transaction(run)
+
+    def fail(self, item: WorkItem, error: str) -> bool:
+        """处理失败：未达到最大次数时重新排队，否则标记为失败；租约已失效时返回False"""
+        status = FAILED if item.attempt >= self.max_attempts else PENDING
+
+        def run(conn):
+            return conn.execute(
+                'UPDATE items SET status = ?, worker = NULL, lease_until = NULL, error = ?, updated_at = ? '
+                'WHERE path = ? AND attempt = ? AND status = ?',
+                (status, error, self.clock(), item.path, item.attempt, LEASED)
+            ).rowcount == 1
+
+        return self._transaction(run)
+
+    def release(self, items: List[WorkItem]):
+        """放弃尚未处理的图片，立即退回队列且不计入领取次数"""
+        def run(conn):
+            for item in items:
+                conn.execute(
+                    'UPDATE items SET status = ?, worker = NULL, attempt = attempt - 1, lease_until = NULL, '
+                    'updated_at = ? WHERE path = ? AND attempt = ? AND status = ?',
+                    (PENDING, self.clock(), item.path, item.attempt, LEASED)
+                )
+
+        self._transaction(run)
+
+    def reset_failed(self) -> int:
+        """将失败的图片重新排队"""
+        def run(conn):
+            return conn.execute(
+                'UPDATE items SET status = ?, attempt = 0, error = NULL, updated_at = ? WHERE status = ?',
+                (PENDING, self.clock(), FAILED)
+            ).rowcount
+
+        return self._transaction(run)
+
+    def items(self) -> List[Dict[str, Optional[str]]]:
+        """按入队顺序返回所有图片的状态"""
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT path, seq, status, worker, attempt, shard, error FROM items ORDER BY seq'
+            ).fetchall()
+        keys = ('path', 'seq', 'status', 'worker', 'attempt', 'shard', 'error')
+        return [dict(zip(keys, row)) for row in rows]
+
+    def stats(self) -> Dict[str, int]:
+        """各状态的图片数；租约已过期的图片计入 expired"""
+        with self._lock:
+            rows = self._conn.execute('SELECT status, COUNT(*) FROM items GROUP BY status').fetchall()
+            expired = self._conn.execute(
+                'SELECT COUNT(*) FROM items WHERE status = ? AND lease_until < ?', (LEASED, self.clock())
+            ).fetchone()[0]
+        counts = {PENDING: 0, LEASED: 0, DONE: 0, FAILED: 0}
+        counts.update(dict(rows))
+        counts['expired'] = expired
+        return counts
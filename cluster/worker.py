@@ -0,0 +1,178 @@
+import os
+import json
+import time
+import socket
+import signal
+import asyncio
+import hashlib
+import logging
+from typing import Dict, List, Optional
+
+from config import config
+from cluster.work_queue import WorkQueue, WorkItem, PENDING, LEASED
+from pipeline.async_engine import AsyncEngine
+from utils.metrics import metrics
+
+
+class ShardWorker:
+    """从共享队列领取图片的工作进程
+
+    每个工作进程运行一条常驻的 AsyncEngine 流水线，每次领取 claim_size 张图片作为一批处理，
+    处理期间由心跳协程为这一批续约。每张图片的页面结果写成一个分片文件（JSON），
+    仍持有租约时才提交到队列，租约已被其他进程接手时丢弃分片；分片由 reduce_shards 按入队顺序合并。
+    队列中没有可领取的图片、但其他进程仍持有租约时继续等待，以便接手崩溃进程过期的租约。
+    """
+
+    def __init__(self, note_ocr, queue: WorkQueue, input_dir: str, shard_dir: str, worker_id: str,
+                 claim_size: int = 4, poll_interval: float = 5):
+        """初始化
+
+        Args:
+            note_ocr: NoteOCR实例，提供处理器与缓存
+            queue: 共享的图片队列
+            input_dir: 本节点的输入目录，队列中的相对路径按此解析
+            shard_dir: 分片目录，需要合并输出的节点能够访问
+            worker_id: 工作进程标识
+            claim_size: 每批领取的图片数
+            poll_interval: 没有可领取的图片时的等待间隔（秒）
+        """
+        self.note_ocr = note_ocr
+        self.queue = queue
+        self.input_dir = input_dir
+        self.shard_dir = shard_dir
+        self.worker_id = worker_id
+        self.claim_size = max(claim_size, 1)
+        self.poll_interval = poll_interval
+        self.images = 0
+        self.failed = 0
+
+    @staticmethod
+    def shard_name(item: WorkItem) -> str:
+        """分片文件名：同一张图片的每次领取写入不同的文件，过期租约的结果不会覆盖新结果"""
+        digest = hashlib.sha1(item.path.encode('utf-8')).hexdigest()[:16]
+        return f"{digest}-{item.attempt}.json"
+
+    def _write_shard(self, item: WorkItem, pages: List[Dict[str, str]]) -> str:
+        """写入分片文件（临时文件+重命名），返回文件名"""
+        name = self.shard_name(item)
+        path = os.path.join(self.shard_dir, name)
+        tmp = f"{path}.{self.worker_id}.tmp"
+        shard = {'path': item.path, 'signature': item.signature, 'worker': self.worker_id,
+                 'attempt': item.attempt, 'pages': pages}
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(shard, f, ensure_ascii=False)
+        os.replace(tmp, path)
+        return name
+
+    def _finish_item(self, item: WorkItem, pages: List[Dict[str, str]], failed: int):
+        """提交一张图片的结果；全部为空白页的图片以空分片完成，不计为失败"""
+        if failed:
+            self.failed += 1
+            error = f"{failed} 个页面处理失败"
+            self.queue.fail(item, error)
+            logging.warning(f"{item.path}: {error}")
+            return
+
+        name = self._write_shard(item, pages)
+        if self.queue.complete(item, name):
+            self.images += 1
+            metrics.increment('cluster.completed')
+            return
+        # 租约已过期并被其他进程接手，以对方的结果为准
+        os.remove(os.path.join(self.shard_dir, name))
+        metrics.increment('cluster.lease_lost')
+        logging.warning(f"{item.path} 的租约已失效，丢弃本次结果")
+
+    async def _heartbeat(self, items: List[WorkItem]):
+        """定期为正在处理的图片续约"""
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.queue.lease_seconds / 3)
+            try:
+                await loop.run_in_executor(None, self.queue.renew, items)
+            except Exception as e:
+                logging.error(f"续约失败: {str(e)}")
+
+    async def _run_batch(self, engine: AsyncEngine, items: List[WorkItem]):
+        by_path: Dict[str, WorkItem] = {}
+        for item in items:
+            image_path = os.path.join(self.input_dir, item.path)
+            if os.path.exists(image_path):
+                by_path[image_path] = item
+            else:
+                self.queue.fail(item, "本节点上找不到该图片")
+                logging.error(f"找不到图片: {image_path}")
+        if not by_path:
+            return
+
+        pages: Dict[str, List[Dict[str, str]]] = {path: [] for path in by_path}
+        pending = dict(by_path)
+
+        def on_result(content: Dict[str, str]):
+            pages[content['source']].append({'filename': content['filename'], 'text': content['text']})
+
+        def on_image_done(image_path: str, failed: int):
+            self._finish_item(pending.pop(image_path), pages.pop(image_path), failed)
+
+        started = time.perf_counter()
+        heartbeat = asyncio.ensure_future(self._heartbeat(list(by_path.values())))
+        try:
+            await engine.process_files(list(by_path), on_result, on_image_done)
+        except Exception as e:
+            logging.error(f"处理图片时出错: {str(e)}")
+            for item in pending.values():
+                self.queue.fail(item, str(e))
+            pending.clear()
+        finally:
+            heartbeat.cancel()
+            # 被强制中断时，尚未完成的图片立即退回队列
+            if pending:
+                self.queue.release(list(pending.values()))
+        logging.info(f"完成 {len(by_path)} 张图片，耗时 {time.perf_counter() - started:.1f} 秒")
+
+    async def run(self):
+        """领取并处理图片，直到队列处理完毕或收到SIGINT/SIGTERM"""
+        loop = asyncio.get_running_loop()
+        stop = asyncio.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop.set)
+            except (NotImplementedError, RuntimeError):
+                pass
+
+        os.makedirs(self.shard_dir, exist_ok=True)
+        async with AsyncEngine(self.note_ocr) as engine:
+            logging.info(f"工作进程 {self.worker_id} 已启动")
+            while not stop.is_set():
+                items = await loop.run_in_executor(None, self.queue.claim, self.worker_id, self.claim_size)
+                if items:
+                    await self._run_batch(engine, items)
+                    continue
+                stats = self.queue.stats()
+                if not stats[PENDING] and not stats[LEASED]:
+                    break
+                # 其他进程仍持有租约：等待其完成，或租约过期后接手
+                try:
+                    await asyncio.wait_for(stop.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+        logging.info(f"工作进程 {self.worker_id} 退出：完成 {self.images} 张图片，失败 {self.failed} 张")
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def run_worker(note_ocr, queue: WorkQueue, worker_id: Optional[str] = None):
+    """按配置运行工作进程，阻塞直到队列处理完毕或收到SIGINT/SIGTERM"""
+    cluster_config = config.CLUSTER_CONFIG
+    worker = ShardWorker(
+        note_ocr,
+        queue,
+        input_dir=config.INPUT_DIR,
+        shard_dir=cluster_config['SHARD_DIR'],
+        worker_id=worker_id or cluster_config['WORKER_ID'] or default_worker_id(),
+        claim_size=cluster_config['CLAIM_SIZE'],
+        poll_interval=cluster_config['POLL_INTERVAL']
+    )
+    asyncio.run(worker.run())
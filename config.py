@@ -23,13 +23,61 @@ class Config:
         'MODEL': os.getenv('DASHSCOPE_MODEL'),
     }
     
+    # OCR后端配置
+    OCR_BACKEND_CONFIG = {
+        # remote: 远程视觉模型；tesseract: 本地Tesseract；fake: 模拟识别（基准测试、离线运行）；
+        # routed: 简单的印刷体页面交给Tesseract，其余页面及低置信度结果交给远程模型
+        'BACKENDS': ('remote', 'tesseract', 'fake', 'routed'),
+        'BACKEND': os.getenv('OCR_BACKEND', 'remote').lower(),
+        'TESSERACT_LANG': os.getenv('TESSERACT_LANG', 'chi_sim+eng'),
+        'TESSERACT_CONFIG': os.getenv('TESSERACT_CONFIG', '--psm 6'),
+        'FAKE_LATENCY_MS': float(os.getenv('FAKE_OCR_LATENCY_MS', '0')),
+        # 路由规则：满足全部条件的页面先交给本地后端
+        'ROUTE_MAX_NOISE': float(os.getenv('OCR_ROUTE_MAX_NOISE', '3.0')),
+        'ROUTE_MIN_LINE_GAP': float(os.getenv('OCR_ROUTE_MIN_LINE_GAP', '0.15')),
+        'ROUTE_MAX_HEIGHT_CV': float(os.getenv('OCR_ROUTE_MAX_HEIGHT_CV', '0.8')),
+        # 本地识别置信度（0-100）低于该值时改用远程模型
+        'ROUTE_MIN_CONFIDENCE': float(os.getenv('OCR_ROUTE_MIN_CONFIDENCE', '80')),
+    }
+
     # 文本处理API配置
     TEXT_API = {
         'KEY': os.getenv('DEEPSEEK_API_KEY'),
         'BASE_URL': os.getenv('DEEPSEEK_API_BASE_URL'),
         'MODEL': os.getenv('DEEPSEEK_MODEL'),
+        # 轻量优化使用的较便宜模型，不设置则与MODEL相同
+        'LIGHT_MODEL': os.getenv('DEEPSEEK_LIGHT_MODEL'),
+    }
+
+    # 流式输出配置：OCR与单页文本优化以流式方式接收，部分结果实时交给进度显示和HTTP服务
+    STREAM_CONFIG = {
+        'ENABLED': os.getenv('STREAM_ENABLED', 'true').lower() == 'true',
+        # 两次部分结果回调之间的最短间隔（秒）
+        'PARTIAL_INTERVAL': float(os.getenv('STREAM_PARTIAL_INTERVAL', '0.5')),
+    }
+
+    # 文本优化分流配置：根据OCR文本的长度、字符类别和结构决定跳过、轻量或完整优化
+    TEXT_TRIAGE_CONFIG = {
+        'ENABLED': os.getenv('TEXT_TRIAGE_ENABLED', 'true').lower() == 'true',
+        'MIN_CHARS': int(os.getenv('TEXT_TRIAGE_MIN_CHARS', '20')),
+        'SHORT_CHARS': int(os.getenv('TEXT_TRIAGE_SHORT_CHARS', '80')),
+        'CLEAN_NOISE_RATIO': float(os.getenv('TEXT_TRIAGE_CLEAN_NOISE_RATIO', '0.02')),
+        'FULL_NOISE_RATIO': float(os.getenv('TEXT_TRIAGE_FULL_NOISE_RATIO', '0.08')),
+        'CLEAN_STRUCTURE_RATIO': float(os.getenv('TEXT_TRIAGE_CLEAN_STRUCTURE_RATIO', '0.3')),
+        'MAX_BROKEN_RATIO': float(os.getenv('TEXT_TRIAGE_MAX_BROKEN_RATIO', '0.2')),
     }
     
+    # OCR上传配置：上传前在客户端缩放并压缩页面
+    UPLOAD_CONFIG = {
+        'MAX_PIXELS': int(os.getenv('UPLOAD_MAX_PIXELS', str(28 * 28 * 1280))),
+        'FORMAT': os.getenv('UPLOAD_FORMAT', 'jpeg').lower(),
+        'QUALITY': int(os.getenv('UPLOAD_QUALITY', '90')),
+        'MIN_QUALITY': int(os.getenv('UPLOAD_MIN_QUALITY', '60')),
+        'TARGET_KB': int(os.getenv('UPLOAD_TARGET_KB', '400')),
+        'GRAYSCALE': os.getenv('UPLOAD_GRAYSCALE', 'auto').lower(),
+        'SATURATION_THRESHOLD': float(os.getenv('UPLOAD_SATURATION_THRESHOLD', '20')),
+    }
+
     # 图像处理配置
     IMAGE_CONFIG = {
         'MIN_PAGE_AREA_RATIO': float(os.getenv('MIN_PAGE_AREA_RATIO', '0.15')),
@@ -37,6 +85,25 @@ class Config:
         'MIN_ASPECT_RATIO': float(os.getenv('MIN_ASPECT_RATIO', '0.5')),
         'MAX_ASPECT_RATIO': float(os.getenv('MAX_ASPECT_RATIO', '1.5')),
         'MIN_IMAGE_SIZE': int(os.getenv('MIN_IMAGE_SIZE', '1000')),
+        # 页面检测在长边不超过该值的缩略图上进行，0表示使用原图
+        'DETECT_MAX_SIDE': int(os.getenv('DETECT_MAX_SIDE', '1600')),
+        # 预处理档位：fast / balanced / quality / auto
+        'PREPROCESS_PROFILE': os.getenv('PREPROCESS_PROFILE', 'auto'),
+        # 解码后图片的目标像素数，远大于该值的图片按1/2、1/4、1/8缩小解码，0表示按原尺寸解码
+        'DECODE_MAX_PIXELS': int(os.getenv('DECODE_MAX_PIXELS', '12000000')),
+        # 同时存活的已解码图片占用的内存上限（MB），0表示不限制
+        'MEMORY_BUDGET_MB': int(os.getenv('MEMORY_BUDGET_MB', '1024')),
+    }
+
+    # PDF与多页TIFF文档配置
+    DOCUMENT_CONFIG = {
+        # 是否处理输入目录中的PDF和多页TIFF
+        'ENABLED': os.getenv('DOCUMENT_ENABLED', 'true').lower() == 'true',
+        # 每页渲染后的目标像素数，PDF按此选择渲染DPI
+        'RENDER_MAX_PIXELS': int(os.getenv('DOCUMENT_RENDER_MAX_PIXELS', '4000000')),
+        'MAX_DPI': int(os.getenv('DOCUMENT_MAX_DPI', '300')),
+        # 页面检测：auto / always / never
+        'DETECT_PAGES': os.getenv('DOCUMENT_DETECT_PAGES', 'auto'),
     }
     
     # OCR配置
@@ -44,8 +111,135 @@ class Config:
     RETRY_DELAY = int(os.getenv('RETRY_DELAY', '2'))
     
     # 并发配置
-    MAX_WORKERS = int(os.getenv('MAX_WORKERS', '4'))
-    API_RATE_LIMIT = int(os.getenv('API_RATE_LIMIT', '1'))
+    API_RATE_LIMIT = float(os.getenv('API_RATE_LIMIT', '1'))
+    # 图像处理进程数，0表示在主进程的线程池中处理
+    CPU_WORKERS = int(os.getenv('CPU_WORKERS', str(os.cpu_count() or 1)))
+
+    # 异步引擎配置
+    ASYNC_CONFIG = {
+        'OCR_CONCURRENCY': int(os.getenv('OCR_CONCURRENCY', '16')),
+        'TEXT_CONCURRENCY': int(os.getenv('TEXT_CONCURRENCY', '16')),
+        'QUEUE_SIZE': int(os.getenv('PIPELINE_QUEUE_SIZE', '8')),
+        'HTTP_MAX_CONNECTIONS': int(os.getenv('HTTP_MAX_CONNECTIONS', '100')),
+        'HTTP_MAX_KEEPALIVE': int(os.getenv('HTTP_MAX_KEEPALIVE', '50')),
+        'HTTP_KEEPALIVE_EXPIRY': float(os.getenv('HTTP_KEEPALIVE_EXPIRY', '30')),
+        'HTTP_TIMEOUT': float(os.getenv('HTTP_TIMEOUT', '120')),
+    }
+
+    # 限流与熔断配置（速率单位：次/秒，0表示不限流）
+    RATE_LIMIT_CONFIG = {
+        'OCR_RATE_LIMIT': float(os.getenv('OCR_RATE_LIMIT', str(API_RATE_LIMIT))),
+        'TEXT_RATE_LIMIT': float(os.getenv('TEXT_RATE_LIMIT', str(API_RATE_LIMIT))),
+        'MAX_RETRY_DELAY': float(os.getenv('MAX_RETRY_DELAY', '60')),
+        'CIRCUIT_FAILURE_THRESHOLD': int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', '5')),
+        'CIRCUIT_RESET_TIMEOUT': float(os.getenv('CIRCUIT_RESET_TIMEOUT', '30')),
+    }
+
+    # 文本优化批处理配置：将多页OCR文本按token预算合并为一次请求
+    TEXT_BATCH_CONFIG = {
+        'ENABLED': os.getenv('TEXT_BATCH_ENABLED', 'false').lower() == 'true',
+        'TOKEN_BUDGET': int(os.getenv('TEXT_BATCH_TOKEN_BUDGET', '3000')),
+        'MAX_PAGES': int(os.getenv('TEXT_BATCH_MAX_PAGES', '8')),
+        'MAX_OUTPUT_TOKENS': int(os.getenv('TEXT_BATCH_MAX_OUTPUT_TOKENS', '8000')),
+        'LINGER': float(os.getenv('TEXT_BATCH_LINGER', '0.5')),
+    }
+
+    # 结果缓存配置
+    CACHE_CONFIG = {
+        'ENABLED': os.getenv('CACHE_ENABLED', 'true').lower() == 'true',
+        'PATH': os.path.join(OUTPUT_DIR, os.getenv('CACHE_FILE', '.cache/results.db')),
+        'MAX_SIZE_MB': float(os.getenv('CACHE_MAX_SIZE_MB', '1024')),
+        'MAX_AGE_DAYS': float(os.getenv('CACHE_MAX_AGE_DAYS', '30')),
+    }
+
+    # 检查点日志配置
+    JOURNAL_CONFIG = {
+        'ENABLED': os.getenv('JOURNAL_ENABLED', 'true').lower() == 'true',
+        'PATH': os.path.join(OUTPUT_DIR, os.getenv('JOURNAL_FILE', '.journal/run.jsonl')),
+    }
+
+    # Markdown输出配置
+    OUTPUT_CONFIG = {
+        # 输出布局：single（全部写入notes.md）/ per_source（每张图片一个文件）/ per_day（按日期分文件）
+        'LAYOUT': os.getenv('OUTPUT_LAYOUT', 'single'),
+        # 是否只追加新增或修改过的图片，为false时每次运行重新生成全部输出
+        'APPEND': os.getenv('OUTPUT_APPEND', 'true').lower() == 'true',
+        'INDEX': os.getenv('OUTPUT_INDEX', 'true').lower() == 'true',
+        'INDEX_INTERVAL': float(os.getenv('OUTPUT_INDEX_INTERVAL', '5')),
+    }
+
+    # 全文索引配置
+    SEARCH_CONFIG = {
+        'ENABLED': os.getenv('SEARCH_ENABLED', 'true').lower() == 'true',
+        'PATH': os.path.join(OUTPUT_DIR, os.getenv('SEARCH_FILE', '.search/notes.db')),
+        # 默认返回的最大页面数
+        'LIMIT': int(os.getenv('SEARCH_LIMIT', '20')),
+    }
+
+    # 守护模式配置
+    WATCH_CONFIG = {
+        # 没有文件系统事件时的目录扫描间隔（秒）
+        'POLL_INTERVAL': float(os.getenv('WATCH_POLL_INTERVAL', '2')),
+        # 文件停止变化多久后视为写入完成（秒）
+        'DEBOUNCE': float(os.getenv('WATCH_DEBOUNCE', '2')),
+    }
+
+    # HTTP服务配置（python main.py --serve）
+    SERVICE_CONFIG = {
+        'HOST': os.getenv('SERVICE_HOST', '127.0.0.1'),
+        'PORT': int(os.getenv('SERVICE_PORT', '8000')),
+        # 每批交给流水线并发处理的最大任务数
+        'BATCH_SIZE': int(os.getenv('SERVICE_BATCH_SIZE', '4')),
+        # 同时运行的最大批数，一个慢任务不会挡住其他客户端的下一批
+        'MAX_BATCHES': int(os.getenv('SERVICE_MAX_BATCHES', '2')),
+        # 最大排队任务数，以及单个客户端的最大排队任务数
+        'QUEUE_SIZE': int(os.getenv('SERVICE_QUEUE_SIZE', '64')),
+        'CLIENT_QUEUE_SIZE': int(os.getenv('SERVICE_CLIENT_QUEUE_SIZE', '8')),
+        # 单张上传图片的大小上限（MB）
+        'MAX_UPLOAD_MB': float(os.getenv('SERVICE_MAX_UPLOAD_MB', '30')),
+        # 单个HTTP请求的读写超时及长轮询的最长等待时间（秒）
+        'REQUEST_TIMEOUT': float(os.getenv('SERVICE_REQUEST_TIMEOUT', '30')),
+        # 任务从提交到完成的最长时间（秒）
+        'JOB_TIMEOUT': float(os.getenv('SERVICE_JOB_TIMEOUT', '600')),
+        # 已结束任务的结果保留时间（秒）
+        'RESULT_TTL': float(os.getenv('SERVICE_RESULT_TTL', '3600')),
+    }
+
+    # 近似重复页面检测配置
+    DEDUP_CONFIG = {
+        'ENABLED': os.getenv('DEDUP_ENABLED', 'true').lower() == 'true',
+        # 视为重复页面的最大汉明距离（页面哈希共256位）
+        'MAX_DISTANCE': int(os.getenv('DEDUP_MAX_DISTANCE', '48')),
+        # reuse: 重复页面输出原页面的文本；mark: 只输出指向原页面的标记
+        'ACTION': os.getenv('DEDUP_ACTION', 'reuse'),
+        # 页面哈希与结果的持久化索引（启用缓存时使用）
+        'PATH': os.path.join(OUTPUT_DIR, os.getenv('DEDUP_FILE', '.cache/pages.db')),
+    }
+
+    # 多节点分布式处理配置
+    CLUSTER_CONFIG = {
+        # 共享队列数据库与分片目录，多台机器运行时需放在各节点都能访问的位置
+        'QUEUE_PATH': os.path.join(OUTPUT_DIR, os.getenv('CLUSTER_QUEUE_FILE', '.cluster/queue.db')),
+        'SHARD_DIR': os.path.join(OUTPUT_DIR, os.getenv('CLUSTER_SHARD_DIR', '.cluster/shards')),
+        # 租约时长（秒），工作进程每隔三分之一租约时长续约一次
+        'LEASE_SECONDS': float(os.getenv('CLUSTER_LEASE_SECONDS', '300')),
+        # 每批领取的图片数
+        'CLAIM_SIZE': int(os.getenv('CLUSTER_CLAIM_SIZE', '4')),
+        # 每张图片最多领取的次数
+        'MAX_ATTEMPTS': int(os.getenv('CLUSTER_MAX_ATTEMPTS', '3')),
+        # 没有可领取的图片时的等待间隔（秒）
+        'POLL_INTERVAL': float(os.getenv('CLUSTER_POLL_INTERVAL', '5')),
+        # 工作进程标识，默认为 主机名-进程号
+        'WORKER_ID': os.getenv('CLUSTER_WORKER_ID', ''),
+    }
+
+    # 性能指标配置
+    METRICS_CONFIG = {
+        'REPORT_DIR': os.path.join(OUTPUT_DIR, os.getenv('METRICS_REPORT_DIR', 'reports')),
+        'PORT': int(os.getenv('METRICS_PORT', '0')),
+        # /metrics 接口的监听地址，需要从其他机器抓取时设为 0.0.0.0
+        'HOST': os.getenv('METRICS_HOST', '127.0.0.1'),
+    }
 
     def __post_init__(self):
         """配置后处理"""
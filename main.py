@@ -1,158 +1,485 @@
 import os
 import logging
 from pathlib import Path
-from typing import List, Dict, Optional, Tuple
-import concurrent.futures
+from typing import List, Dict, Optional, Tuple, Any
 from tqdm import tqdm
-import cv2
 import time
+import argparse
+import asyncio
+import signal
 from dotenv import load_dotenv
 
 from processors.image_processor import ImageProcessor
 from processors.ocr_processor import OCRProcessor
+from processors.ocr_backends import OCRBackend, TesseractOCRBackend, FakeOCRBackend, RoutedOCRBackend
 from processors.text_processor import TextProcessor
+from processors.text_classifier import EnhancementClassifier, LIGHT, FULL
 from utils.file_handler import FileHandler
+from utils.markdown_output import MarkdownOutput
+from utils.document_source import DOCUMENT_EXTENSIONS
+from utils.cache import ResultCache
+from utils.page_index import PageHashIndex
+from utils.search_index import NoteSearchIndex
+from utils.journal import RunJournal
+from utils.rate_limiter import ApiGuard
+from utils.metrics import metrics
+from utils.watcher import DirectoryWatcher
+from pipeline.async_engine import AsyncEngine, STAGE_NAMES
+from service.server import serve
+from cluster.work_queue import WorkQueue
+from cluster.worker import run_worker
+from cluster.reducer import reduce_shards
 from config import config
 
 class NoteOCR:
-    def __init__(self):
-        """初始化NoteOCR"""
+    def __init__(self, use_cache: bool = True, refresh_cache: bool = False, resume: bool = True,
+                 preprocess_profile: Optional[str] = None, output_layout: Optional[str] = None,
+                 rebuild_output: bool = False, ocr_backend: Optional[str] = None):
+        """初始化NoteOCR
+
+        Args:
+            use_cache: 是否启用结果缓存
+            refresh_cache: 是否忽略已有缓存并重新识别
+            resume: 是否从上次中断的检查点继续处理
+            preprocess_profile: 预处理档位，默认使用配置中的 PREPROCESS_PROFILE
+            output_layout: Markdown输出布局，默认使用配置中的 OUTPUT_LAYOUT
+            rebuild_output: 是否重新生成全部输出，而不是只追加新增的图片
+            ocr_backend: OCR后端，默认使用配置中的 OCR_BACKEND
+        """
         # 加载环境变量
         load_dotenv()
         
         # 初始化处理器
-        self.ocr_processor = OCRProcessor(
-            api_key=config.OCR_API['KEY'],
-            base_url=config.OCR_API['BASE_URL']
-        )
+        self.ocr_processor = self.create_ocr_backend(ocr_backend or config.OCR_BACKEND_CONFIG['BACKEND'])
         
         self.text_processor = TextProcessor(
             api_key=config.TEXT_API['KEY'],
             base_url=config.TEXT_API['BASE_URL'],
-            model=config.TEXT_API['MODEL']
+            model=config.TEXT_API['MODEL'],
+            guard=ApiGuard.from_config('TextAPI', config.RATE_LIMIT_CONFIG['TEXT_RATE_LIMIT'], config),
+            light_model=config.TEXT_API['LIGHT_MODEL'],
+            stream=config.STREAM_CONFIG['ENABLED'],
+            partial_interval=config.STREAM_CONFIG['PARTIAL_INTERVAL']
         )
+        self.text_classifier = None
+        if config.TEXT_TRIAGE_CONFIG['ENABLED']:
+            triage = config.TEXT_TRIAGE_CONFIG
+            self.text_classifier = EnhancementClassifier(
+                min_chars=triage['MIN_CHARS'],
+                short_chars=triage['SHORT_CHARS'],
+                clean_noise_ratio=triage['CLEAN_NOISE_RATIO'],
+                full_noise_ratio=triage['FULL_NOISE_RATIO'],
+                clean_structure_ratio=triage['CLEAN_STRUCTURE_RATIO'],
+                max_broken_ratio=triage['MAX_BROKEN_RATIO']
+            )
         
         self.file_handler = FileHandler()
-        self.image_processor = ImageProcessor()
 
-    def process_single_page(self, page_image: cv2.Mat, filename: str, page_num: int, total_pages: int) -> Optional[Dict[str, str]]:
-        """处理单个页面"""
-        try:
-            # 预处理图片
-            processed_image = self.image_processor.preprocess_image(page_image)
-            
-            # OCR识别
-            raw_text = self.ocr_processor.process_image(processed_image)
-            if raw_text:
-                # 使用文本处理器优化内容
-                enhanced_text = self.text_processor.format_and_enhance(raw_text)
-                
-                page_info = f"{filename} (Page {page_num}/{total_pages})"
-                return {
-                    'filename': page_info,
-                    'text': enhanced_text
-                }
-            
-            return None
-        except Exception as e:
-            logging.error(f"处理页面时出错 {filename} Page {page_num}: {str(e)}")
-            return None
+        self.cache = ResultCache(
+            config.CACHE_CONFIG['PATH'],
+            max_size_mb=config.CACHE_CONFIG['MAX_SIZE_MB'],
+            max_age_days=config.CACHE_CONFIG['MAX_AGE_DAYS'],
+            enabled=use_cache and config.CACHE_CONFIG['ENABLED'],
+            refresh=refresh_cache
+        )
+        self.resume = resume
+        self.preprocess_profile = preprocess_profile or config.IMAGE_CONFIG['PREPROCESS_PROFILE']
+        if self.preprocess_profile not in ImageProcessor.PREPROCESS_PROFILES:
+            raise ValueError(f"未知的预处理档位: {self.preprocess_profile}")
+        self.output_layout = output_layout or config.OUTPUT_CONFIG['LAYOUT']
+        self.append_output = config.OUTPUT_CONFIG['APPEND'] and not rebuild_output
 
-    def process_single_image(self, image_path: str) -> List[Dict[str, str]]:
-        """处理单张图片"""
-        try:
-            # 获取文件名（不带扩展名）作为标题
-            filename = Path(image_path).stem
-            
-            # 读取图片
-            image = cv2.imread(str(image_path))
-            if image is None:
-                raise ValueError(f"无法读取图片: {image_path}")
-            
-            # 检测并分割页面
-            pages = self.image_processor.detect_pages(image)
-            logging.info(f"检测到 {len(pages)} 个页面")
-            
-            text_contents = []
-            
-            # 使用线程池并发处理页面
-            with concurrent.futures.ThreadPoolExecutor(max_workers=config.MAX_WORKERS) as executor:
-                # 提交所有页面处理任务
-                futures = []
-                for i, page_image in enumerate(pages):
-                    future = executor.submit(
-                        self.process_single_page,
-                        page_image,
-                        filename,
-                        i + 1,
-                        len(pages)
-                    )
-                    futures.append(future)
-                
-                # 按顺序获取结果
-                for future in futures:
-                    try:
-                        result = future.result()
-                        if result:
-                            text_contents.append(result)
-                    except Exception as e:
-                        logging.error(f"处理页面时出错: {str(e)}")
-            
-            return text_contents
-        except Exception as e:
-            logging.error(f"处理图片时出错 {image_path}: {str(e)}")
-            return []
+        self.page_index = None
+        if config.DEDUP_CONFIG['ENABLED']:
+            if config.DEDUP_CONFIG['ACTION'] not in ('reuse', 'mark'):
+                raise ValueError(f"未知的重复页面处理方式: {config.DEDUP_CONFIG['ACTION']}")
+            self.page_index = PageHashIndex(
+                max_distance=config.DEDUP_CONFIG['MAX_DISTANCE'],
+                db_path=config.DEDUP_CONFIG['PATH'] if self.cache.enabled else None,
+                scope=self.dedup_scope(),
+                refresh=refresh_cache
+            )
+
+    @staticmethod
+    def create_ocr_backend(name: str) -> OCRBackend:
+        """按名称创建OCR后端"""
+        backend_config = config.OCR_BACKEND_CONFIG
+        if name not in backend_config['BACKENDS']:
+            raise ValueError(f"未知的OCR后端: {name}")
+        if name == 'fake':
+            return FakeOCRBackend(latency_ms=backend_config['FAKE_LATENCY_MS'])
+        if name == 'tesseract':
+            return TesseractOCRBackend(backend_config['TESSERACT_LANG'], backend_config['TESSERACT_CONFIG'])
+
+        remote = OCRProcessor(
+            api_key=config.OCR_API['KEY'],
+            base_url=config.OCR_API['BASE_URL'],
+            guard=ApiGuard.from_config('DashScope', config.RATE_LIMIT_CONFIG['OCR_RATE_LIMIT'], config),
+            upload_config=config.UPLOAD_CONFIG,
+            model=config.OCR_API['MODEL'],
+            stream=config.STREAM_CONFIG['ENABLED'],
+            partial_interval=config.STREAM_CONFIG['PARTIAL_INTERVAL']
+        )
+        if name == 'remote':
+            return remote
+        return RoutedOCRBackend(
+            TesseractOCRBackend(backend_config['TESSERACT_LANG'], backend_config['TESSERACT_CONFIG']),
+            remote,
+            max_noise=backend_config['ROUTE_MAX_NOISE'],
+            min_line_gap=backend_config['ROUTE_MIN_LINE_GAP'],
+            max_height_cv=backend_config['ROUTE_MAX_HEIGHT_CV'],
+            min_confidence=backend_config['ROUTE_MIN_CONFIDENCE']
+        )
+
+    def preprocess_cache_key(self, page_digest: str) -> str:
+        """预处理结果的缓存键（不同档位的预处理结果不同）"""
+        return self.cache.make_key(page_digest, {'profile': self.preprocess_profile})
+
+    def ocr_cache_key(self, processed_digest: str) -> str:
+        """OCR结果的缓存键"""
+        return self.cache.make_key(processed_digest, self.ocr_processor.cache_params())
+
+    def dedup_scope(self) -> str:
+        """影响页面最终文本的参数，持久化的去重结果只在参数相同时复用"""
+        return ResultCache.make_key('pages', {
+            'profile': self.preprocess_profile,
+            'ocr': self.ocr_processor.cache_params(),
+            'text': self.text_processor.cache_params(LIGHT, self.batch_max_tokens()),
+            'triage': self.text_classifier.params() if self.text_classifier else None,
+        })
+
+    def enhance_mode(self, raw_text: str) -> str:
+        """判断OCR文本的优化方式（SKIP / LIGHT / FULL），未启用分流时总是完整优化"""
+        mode = self.text_classifier.classify(raw_text) if self.text_classifier else FULL
+        metrics.increment(f'enhance.mode_{mode}')
+        return mode
+
+    @staticmethod
+    def batch_max_tokens() -> Optional[int]:
+        """启用多页合并优化时合并请求的输出上限，未启用时为None"""
+        if config.TEXT_BATCH_CONFIG['ENABLED']:
+            return config.TEXT_BATCH_CONFIG['MAX_OUTPUT_TOKENS']
+        return None
+
+    def enhance_cache_key(self, raw_text: str, mode: str = FULL, batch_max_tokens: Optional[int] = None) -> str:
+        """文本优化结果的缓存键，batch_max_tokens 为多页合并优化的输出上限"""
+        return self.cache.make_key(self.cache.text_digest(raw_text),
+                                   self.text_processor.cache_params(mode, batch_max_tokens))
+
+    @staticmethod
+    def input_extensions() -> List[str]:
+        """输入目录中处理的文件格式：图片，以及启用时的PDF和多页TIFF"""
+        extensions = list(config.IMAGE_EXTENSIONS)
+        if config.DOCUMENT_CONFIG['ENABLED']:
+            extensions.extend(ext for ext in DOCUMENT_EXTENSIONS if ext not in extensions)
+        return extensions
+
+    @staticmethod
+    def list_input_images() -> List[Path]:
+        """按文件名排序列出输入目录中的图片和文档"""
+        image_files = []
+        for ext in NoteOCR.input_extensions():
+            image_files.extend(Path(config.INPUT_DIR).glob(f"*{ext}"))
+        return sorted(image_files)
 
     def process_directory(self):
         """处理整个目录的图片"""
         # 获取所有图片文件
-        image_files = []
-        for ext in config.IMAGE_EXTENSIONS:
-            image_files.extend(Path(config.INPUT_DIR).glob(f"*{ext}"))
-        image_files = sorted(image_files)
+        image_files = self.list_input_images()
         
         if not image_files:
             logging.warning(f"在目录 {config.INPUT_DIR} 中没有找到图片文件")
             return
         
-        text_contents = []
-        
-        # 使用线程池并发处理图片
-        with concurrent.futures.ThreadPoolExecutor(max_workers=config.MAX_WORKERS) as executor:
-            # 提交所有任务
-            future_to_image = {
-                executor.submit(self.process_single_image, str(image_path)): image_path
-                for image_path in image_files
-            }
-            
-            # 使用tqdm显示进度
-            with tqdm(total=len(image_files), desc="处理图片") as pbar:
-                # 获取结果
-                for future in concurrent.futures.as_completed(future_to_image):
-                    image_path = future_to_image[future]
-                    try:
-                        results = future.result()
-                        if results:
-                            text_contents.extend(results)
-                    except Exception as e:
-                        logging.error(f"处理图片时出错 {image_path}: {str(e)}")
-                    finally:
-                        pbar.update(1)
-        
-        if text_contents:
-            try:
-                # 处理OCR结果
-                output_base_path = os.path.join(config.OUTPUT_DIR, 'notes')
-                markdown_path = self.file_handler.process_to_markdown(text_contents, output_base_path)
-                
-                logging.info("文件处理完成！")
-                logging.info(f"Markdown文件：{markdown_path}")
-            except Exception as e:
-                logging.error(f"保存文件时出错: {str(e)}")
+        metrics.reset()
+        output = self.create_output()
+        # 追加模式下跳过已输出且未修改的图片
+        pending = [path for path in image_files if not output.is_done(str(path))]
+        if len(pending) < len(image_files):
+            logging.info(f"跳过 {len(image_files) - len(pending)} 张已输出的图片")
+        if not pending:
+            logging.info("没有新的图片需要处理")
+            return
+        image_files = pending
+
+        journal = None
+        if config.JOURNAL_CONFIG['ENABLED']:
+            journal = RunJournal(config.JOURNAL_CONFIG['PATH'], resume=self.resume)
+
+        def on_image_done(image_path: str, failed_pages: int):
+            output.finish_image(image_path, failed_pages)
+            pbar.update(1)
+
+        def on_partial(partial: Dict[str, Any]):
+            stage = STAGE_NAMES[partial['stage']]
+            pbar.set_postfix_str(f"{partial['filename']} {stage} {len(partial['text'])} 字")
+
+        try:
+            # 使用流水线处理所有图片，结果按顺序逐页交给后台线程写入Markdown
+            with output, tqdm(total=len(image_files), desc="处理图片") as pbar:
+                written, failed = asyncio.run(self._process_files_async(
+                    image_files, output.write, on_image_done, journal, on_partial
+                ))
+        except Exception as e:
+            logging.error(f"保存文件时出错: {str(e)}")
+            return
+        finally:
+            if journal:
+                journal.close()
+            logging.info(self.ocr_processor.upload_summary())
+            if self.cache.enabled:
+                logging.info(f"缓存命中 {self.cache.hits} 次，未命中 {self.cache.misses} 次")
+                self.cache.evict()
+            self.write_run_report()
+
+        if journal:
+            if failed:
+                logging.warning(f"{failed} 个页面处理失败，重新运行将只处理这些页面")
+            else:
+                journal.finish()
+
+        if written:
+            logging.info("文件处理完成！")
+            logging.info(f"Markdown输出目录：{config.OUTPUT_DIR}")
+        elif not failed:
+            logging.warning("所有页面都没有识别出文字")
         else:
             logging.error("没有成功处理任何图片")
 
-def main():
+    def create_output(self) -> MarkdownOutput:
+        """按配置创建Markdown输出"""
+        return MarkdownOutput(
+            config.OUTPUT_DIR,
+            layout=self.output_layout,
+            append=self.append_output,
+            index=config.OUTPUT_CONFIG['INDEX'],
+            index_interval=config.OUTPUT_CONFIG['INDEX_INTERVAL'],
+            search_index=self.create_search_index()
+        )
+
+    @staticmethod
+    def create_search_index() -> Optional[NoteSearchIndex]:
+        """按配置打开全文索引，未启用时返回None"""
+        if not config.SEARCH_CONFIG['ENABLED']:
+            return None
+        return NoteSearchIndex(config.SEARCH_CONFIG['PATH'])
+
+    @staticmethod
+    def search_notes(query: str, limit: Optional[int] = None):
+        """在全文索引中查询笔记并打印匹配的页面"""
+        search_index = NoteOCR.create_search_index()
+        if search_index is None:
+            logging.error("全文索引未启用（SEARCH_ENABLED=false）")
+            return
+        try:
+            started = time.perf_counter()
+            hits = search_index.search(query, limit or config.SEARCH_CONFIG['LIMIT'])
+            elapsed = (time.perf_counter() - started) * 1000
+        finally:
+            search_index.close()
+        for hit in hits:
+            print(f"{hit.title}  [{hit.file}]")
+            print(f"    {hit.snippet}")
+        print(f"找到 {len(hits)} 个页面，耗时 {elapsed:.1f} 毫秒")
+
+    def reindex_notes(self):
+        """由已输出的Markdown文件重建全文索引"""
+        output = self.create_output()
+        search_index = output.search_index
+        if search_index is None:
+            logging.error("全文索引未启用（SEARCH_ENABLED=false）")
+            return
+        try:
+            search_index.clear()
+            images = 0
+            for source, rel_path, pages in output.iter_written_pages():
+                search_index.replace_source(source, rel_path, pages)
+                images += 1
+            logging.info(f"全文索引已重建：{images} 张图片，{len(search_index)} 个页面")
+        finally:
+            search_index.close()
+
+    def watch_directory(self):
+        """守护模式：持续监视输入目录，新图片写入完成后立即送入常驻的流水线处理"""
+        metrics.reset()
+        try:
+            asyncio.run(self._watch_async())
+        except KeyboardInterrupt:
+            logging.info("已强制退出守护模式")
+        finally:
+            logging.info(self.ocr_processor.upload_summary())
+            if self.cache.enabled:
+                logging.info(f"缓存命中 {self.cache.hits} 次，未命中 {self.cache.misses} 次")
+                self.cache.evict()
+            self.write_run_report()
+
+    def serve(self, port: Optional[int] = None):
+        """以HTTP服务方式运行，所有请求共享同一组处理器、连接池和缓存"""
+        metrics.reset()
+        try:
+            serve(self, port=port)
+        finally:
+            logging.info(self.ocr_processor.upload_summary())
+            if self.cache.enabled:
+                logging.info(f"缓存命中 {self.cache.hits} 次，未命中 {self.cache.misses} 次")
+                self.cache.evict()
+            self.write_run_report()
+
+    @staticmethod
+    def create_work_queue() -> WorkQueue:
+        """按配置打开多节点共享的图片队列"""
+        cluster_config = config.CLUSTER_CONFIG
+        return WorkQueue(
+            cluster_config['QUEUE_PATH'],
+            lease_seconds=cluster_config['LEASE_SECONDS'],
+            max_attempts=cluster_config['MAX_ATTEMPTS']
+        )
+
+    def enqueue_directory(self, retry_failed: bool = False):
+        """把输入目录中的图片加入共享队列，已输出且未修改的图片不再加入"""
+        output = self.create_output()
+        items = {
+            os.path.relpath(path, config.INPUT_DIR): RunJournal.file_signature(str(path))
+            for path in self.list_input_images() if not output.is_done(str(path))
+        }
+        queue = self.create_work_queue()
+        try:
+            added = queue.enqueue(items)
+            if retry_failed:
+                added += queue.reset_failed()
+            logging.info(f"加入队列 {added} 张图片，队列状态：{queue.stats()}")
+        finally:
+            queue.close()
+
+    def run_worker(self, worker_id: Optional[str] = None):
+        """作为工作进程从共享队列领取图片处理，结果写入分片"""
+        metrics.reset()
+        queue = self.create_work_queue()
+        try:
+            run_worker(self, queue, worker_id)
+        finally:
+            queue.close()
+            logging.info(self.ocr_processor.upload_summary())
+            if self.cache.enabled:
+                logging.info(f"缓存命中 {self.cache.hits} 次，未命中 {self.cache.misses} 次")
+                self.cache.evict()
+            self.write_run_report()
+
+    def reduce_output(self):
+        """把各工作进程的分片按入队顺序合并为Markdown输出"""
+        queue = self.create_work_queue()
+        try:
+            with self.create_output() as output:
+                result = reduce_shards(queue, output, config.INPUT_DIR, config.CLUSTER_CONFIG['SHARD_DIR'])
+            logging.info(f"合并 {result['merged']} 张图片，跳过 {result['skipped']} 张，"
+                         f"{result['waiting']} 张尚未完成")
+        finally:
+            queue.close()
+
+    async def _watch_async(self):
+        """在同一个事件循环中保持HTTP连接池、进程池、缓存和检查点，逐批处理新图片"""
+        loop = asyncio.get_running_loop()
+        stop = asyncio.Event()
+
+        def request_stop():
+            if stop.is_set():
+                # 再次中断时恢复默认处理，允许强制退出
+                loop.remove_signal_handler(signal.SIGINT)
+                return
+            logging.info("正在停止守护模式，当前批次处理完成后退出（再次按 Ctrl-C 强制退出）")
+            stop.set()
+
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, request_stop)
+            except (NotImplementedError, RuntimeError):
+                # Windows不支持add_signal_handler，Ctrl-C直接中断
+                pass
+
+        watcher = DirectoryWatcher(
+            config.INPUT_DIR,
+            self.input_extensions(),
+            poll_interval=config.WATCH_CONFIG['POLL_INTERVAL'],
+            debounce=config.WATCH_CONFIG['DEBOUNCE']
+        )
+        journal = None
+        if config.JOURNAL_CONFIG['ENABLED']:
+            journal = RunJournal(config.JOURNAL_CONFIG['PATH'], resume=self.resume)
+
+        try:
+            with self.create_output() as output:
+                async with AsyncEngine(self, journal=journal) as engine:
+                    logging.info(f"守护模式已启动，监视目录: {config.INPUT_DIR}")
+                    async for batch in watcher.batches(stop):
+                        pending = [path for path in batch if not output.is_done(path)]
+                        if not pending:
+                            continue
+                        started = time.perf_counter()
+                        failed_before = engine.failed_pages
+                        written = await engine.process_files(pending, output.write, output.finish_image)
+                        failed = engine.failed_pages - failed_before
+                        logging.info(
+                            f"处理 {len(pending)} 张新图片：{written} 个页面完成，{failed} 个页面失败，"
+                            f"耗时 {time.perf_counter() - started:.1f} 秒"
+                        )
+                        # 没有未完成的页面时清空检查点，避免常驻运行时日志无限增长；
+                        # 有失败页面时保留，重新启动后由检查点补齐
+                        if journal and not engine.failed_pages:
+                            journal.finish()
+                            journal = RunJournal(config.JOURNAL_CONFIG['PATH'], resume=False)
+                            engine.journal = journal
+        finally:
+            if journal:
+                journal.close()
+
+    def write_run_report(self):
+        """输出本次运行的性能报告"""
+        try:
+            report_path = metrics.write_report(config.METRICS_CONFIG['REPORT_DIR'])
+            logging.info("各阶段耗时统计：\n" + metrics.summary_table())
+            logging.info(f"性能报告：{report_path}")
+        except Exception as e:
+            logging.error(f"保存性能报告时出错: {str(e)}")
+
+    async def _process_files_async(self, image_files: List[Path], on_result, on_image_done,
+                                   journal: Optional[RunJournal] = None, on_partial=None) -> Tuple[int, int]:
+        """在单一事件循环中以流水线方式处理所有图片，返回 (成功页面数, 失败页面数)"""
+        async with AsyncEngine(self, journal=journal) as engine:
+            written = await engine.process_files(image_files, on_result, on_image_done, on_partial)
+            return written, engine.failed_pages
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description="NoteOCR - 智能笔记处理系统")
+    parser.add_argument('--no-cache', action='store_true', help="禁用结果缓存")
+    parser.add_argument('--refresh', action='store_true', help="忽略已有缓存，重新识别并更新缓存")
+    parser.add_argument('--no-resume', action='store_true', help="忽略上次中断的检查点，从头开始处理")
+    parser.add_argument('--metrics-port', type=int, default=config.METRICS_CONFIG['PORT'],
+                        help="在指定端口提供Prometheus格式的 /metrics 接口（0表示不启用）")
+    parser.add_argument('--metrics-host', default=config.METRICS_CONFIG['HOST'],
+                        help="/metrics 接口的监听地址（默认使用 METRICS_HOST 配置）")
+    parser.add_argument('--profile', choices=ImageProcessor.PREPROCESS_PROFILES,
+                        help="预处理档位（默认使用 PREPROCESS_PROFILE 配置）")
+    parser.add_argument('--ocr-backend', choices=config.OCR_BACKEND_CONFIG['BACKENDS'],
+                        help="OCR后端（默认使用 OCR_BACKEND 配置）")
+    parser.add_argument('--layout', choices=MarkdownOutput.LAYOUTS,
+                        help="Markdown输出布局（默认使用 OUTPUT_LAYOUT 配置）")
+    parser.add_argument('--rebuild', action='store_true', help="重新生成全部Markdown输出，而不是只追加新增的图片")
+    parser.add_argument('--watch', action='store_true', help="守护模式：持续监视输入目录并处理新增的图片")
+    parser.add_argument('--serve', action='store_true', help="以HTTP服务方式运行，通过接口提交图片并获取结果")
+    parser.add_argument('--port', type=int, help="HTTP服务端口（默认使用 SERVICE_PORT 配置）")
+    parser.add_argument('--enqueue', action='store_true', help="把输入目录中的图片加入多节点共享队列")
+    parser.add_argument('--retry-failed', action='store_true', help="与 --enqueue 一起使用，将失败的图片重新排队")
+    parser.add_argument('--worker', action='store_true', help="作为工作进程从共享队列领取图片处理")
+    parser.add_argument('--worker-id', help="工作进程标识（默认使用 CLUSTER_WORKER_ID 配置或 主机名-进程号）")
+    parser.add_argument('--reduce', action='store_true', help="把工作进程的分片按顺序合并为Markdown输出")
+    parser.add_argument('--search', metavar='QUERY', help="在全文索引中查询已输出的笔记，多个关键词以空格分隔")
+    parser.add_argument('--limit', type=int, help="与 --search 一起使用，返回的最大页面数（默认使用 SEARCH_LIMIT 配置）")
+    parser.add_argument('--reindex', action='store_true', help="由已输出的Markdown文件重建全文索引")
+    return parser.parse_args(argv)
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
     try:
         # 配置日志
         logging.basicConfig(
@@ -160,14 +487,43 @@ def main():
             format='%(asctime)s - %(levelname)s - %(message)s'
         )
         
+        # 查询只读取全文索引，不需要输入目录和API配置
+        if args.search is not None:
+            NoteOCR.search_notes(args.search, args.limit)
+            return
+
         # 检查输入目录
         if not os.path.isdir(config.INPUT_DIR):
             logging.error(f"输入目录不存在: {config.INPUT_DIR}")
             return
         
+        if args.metrics_port:
+            metrics.start_http_server(args.metrics_port, args.metrics_host)
+        
         # 创建NoteOCR实例并处理目录
-        ocr = NoteOCR()
-        ocr.process_directory()
+        ocr = NoteOCR(
+            use_cache=not args.no_cache,
+            refresh_cache=args.refresh,
+            resume=not args.no_resume,
+            preprocess_profile=args.profile,
+            output_layout=args.layout,
+            rebuild_output=args.rebuild,
+            ocr_backend=args.ocr_backend
+        )
+        if args.enqueue:
+            ocr.enqueue_directory(args.retry_failed)
+        elif args.worker:
+            ocr.run_worker(args.worker_id)
+        elif args.reduce:
+            ocr.reduce_output()
+        elif args.reindex:
+            ocr.reindex_notes()
+        elif args.serve:
+            ocr.serve(args.port)
+        elif args.watch:
+            ocr.watch_directory()
+        else:
+            ocr.process_directory()
     except Exception as e:
         logging.error(f"程序执行出错: {str(e)}")
 
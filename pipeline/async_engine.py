@@ -0,0 +1,747 @@
+import time
+import asyncio
+import logging
+from pathlib import Path
+from dataclasses import dataclass
+from typing import List, Dict, Set, Optional, Callable, Any
+
+import httpx
+
+from config import config
+from pipeline.cpu_pool import CPUPool
+from pipeline.memory_budget import MemoryBudget, ImageLease
+from processors.image_processor import ImageProcessor
+from processors.text_classifier import SKIP, FULL
+from utils.image_source import ImageSource
+from utils.document_source import DocumentSource, is_document
+from utils.journal import RunJournal
+from utils.metrics import metrics
+from utils.page_index import IndexedPage
+from utils.streaming import PartialCallback
+
+# 阶段结束标记
+_DONE = object()
+
+# 阶段名称（用于指标）及其日志中的显示名称
+STAGE_NAMES = {
+    'preprocess': '预处理',
+    'encode': '编码',
+    'ocr': 'OCR',
+    'enhance': '文本优化',
+}
+
+
+@dataclass
+class PageTask:
+    """在各阶段之间传递的页面任务"""
+    image_index: int
+    page_index: int
+    total_pages: int
+    filename: str
+    image_path: str = ''
+    page: Any = None
+    page_digest: Optional[str] = None
+    processed: Any = None
+    ocr_key: str = ''
+    ocr_payload: Any = None
+    raw_text: Optional[str] = None
+    text: Optional[str] = None
+    enhance_mode: str = FULL
+    enqueued_at: float = 0.0
+    lease: Optional[ImageLease] = None
+    # 加入去重索引的页面，以及近似重复时对应的原页面
+    indexed: Optional[IndexedPage] = None
+    duplicate_of: Optional[IndexedPage] = None
+    # 文档页面的标题（文档的页面数在全部渲染前未知，按文档页码编号）
+    label: str = ''
+    # text 为空字符串表示没有识别出文字的页面（跳过），为None表示处理失败
+
+    @property
+    def page_info(self) -> str:
+        if self.label:
+            return f"{self.filename} ({self.label})"
+        return f"{self.filename} (Page {self.page_index + 1}/{self.total_pages})"
+
+    def release(self):
+        """释放页面占用的图像内存，并归还该页面在内存额度中的份额"""
+        for image in (self.page, self.processed):
+            if image is not None:
+                image.release()
+        self.page = None
+        self.processed = None
+        if self.lease is not None:
+            self.lease.release_page()
+            self.lease = None
+
+
+@dataclass
+class ImageMarker:
+    """通知写入阶段某张图片包含的页面数
+
+    文档逐页渲染期间发送 final 为False的标记，total_pages 为目前已知的页面数，
+    写入阶段收到最终的标记后才结束这份文档。
+    failed 为读取失败（没有页面可以输出）时计入该图片的失败数，
+    以免与全部为空白页的图片一样被当作已完成。
+    """
+    image_index: int
+    image_path: str
+    total_pages: int
+    final: bool = True
+    failed: int = 0
+
+
+class AsyncEngine:
+    """基于单一事件循环的流式处理引擎
+
+    处理流程被拆分为以有界队列连接的阶段：
+    读取+页面检测 -> 预处理 -> 编码 -> OCR -> 文本优化 -> 写入。
+    队列满时上游阶段会等待，避免解码后的图片在慢速的API阶段前堆积；
+    写入阶段按输入顺序重排结果，前序页面完成后立即输出。
+    """
+
+    def __init__(self, note_ocr, ocr_concurrency: Optional[int] = None,
+                 text_concurrency: Optional[int] = None, queue_size: Optional[int] = None,
+                 journal: Optional[RunJournal] = None):
+        """初始化异步引擎
+
+        Args:
+            note_ocr: 提供处理器和缓存的NoteOCR实例
+            ocr_concurrency: 同时进行的OCR请求数上限
+            text_concurrency: 同时进行的文本优化请求数上限
+            queue_size: 阶段间队列的容量
+            journal: 检查点日志，提供时跳过已完成的页面并记录各阶段进度
+        """
+        self.note_ocr = note_ocr
+        self.ocr_processor = note_ocr.ocr_processor
+        self.text_processor = note_ocr.text_processor
+        self.cache = note_ocr.cache
+
+        self.ocr_concurrency = ocr_concurrency or config.ASYNC_CONFIG['OCR_CONCURRENCY']
+        self.text_concurrency = text_concurrency or config.ASYNC_CONFIG['TEXT_CONCURRENCY']
+        self.queue_size = queue_size or config.ASYNC_CONFIG['QUEUE_SIZE']
+        self.cpu_concurrency = max(config.CPU_WORKERS, 1)
+        self.journal = journal
+        self.failed_pages = 0
+        self.decode_max_pixels = config.IMAGE_CONFIG['DECODE_MAX_PIXELS']
+        self.memory_budget = MemoryBudget(config.IMAGE_CONFIG['MEMORY_BUDGET_MB'] * 1024 * 1024)
+        self.document_config = config.DOCUMENT_CONFIG
+        self.page_index = note_ocr.page_index
+        self.dedup_action = config.DEDUP_CONFIG['ACTION']
+        # 本引擎加入去重索引、尚未得到结果的页面
+        self.indexed_pages = set()
+        # 图片路径 -> 去重分组，只在同一分组的页面之间去重；为None时不分组
+        self.dedup_groups: Optional[Dict[str, str]] = None
+        # 已取消的图片，以及各图片正在执行的阶段处理
+        self.cancelled: Set[str] = set()
+        self._handlers: Dict[str, Set[asyncio.Task]] = {}
+
+        self.http_client = None
+        self.cpu = None
+        self.on_partial = None
+
+    @staticmethod
+    def create_http_client() -> httpx.AsyncClient:
+        """创建共享的HTTP连接池"""
+        limits = httpx.Limits(
+            max_connections=config.ASYNC_CONFIG['HTTP_MAX_CONNECTIONS'],
+            max_keepalive_connections=config.ASYNC_CONFIG['HTTP_MAX_KEEPALIVE'],
+            keepalive_expiry=config.ASYNC_CONFIG['HTTP_KEEPALIVE_EXPIRY']
+        )
+        timeout = httpx.Timeout(config.ASYNC_CONFIG['HTTP_TIMEOUT'], connect=10.0)
+        return httpx.AsyncClient(limits=limits, timeout=timeout)
+
+    async def __aenter__(self):
+        self.http_client = self.create_http_client()
+        self.ocr_processor.bind_async_client(self.http_client)
+        self.text_processor.bind_async_client(self.http_client)
+        self.cpu = CPUPool(
+            config.CPU_WORKERS,
+            detect_max_side=config.IMAGE_CONFIG['DETECT_MAX_SIDE'],
+            preprocess_profile=self.note_ocr.preprocess_profile
+        )
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.http_client.aclose()
+        self.cpu.shutdown()
+        self.http_client = None
+        self.cpu = None
+
+    def fork(self) -> 'AsyncEngine':
+        """创建共享HTTP连接池、图像处理进程池和内存额度的引擎
+
+        每个引擎同一时间只能运行一次 process_files；在同一个事件循环中并发处理多批图片时，
+        每批使用一个分叉出的引擎。API的总并发仍受共享的连接池和限流器约束。
+        只能在本引擎的 async with 块内使用，分叉出的引擎不需要单独关闭。
+        """
+        engine = AsyncEngine(self.note_ocr, self.ocr_concurrency, self.text_concurrency,
+                             self.queue_size, self.journal)
+        engine.http_client = self.http_client
+        engine.cpu = self.cpu
+        engine.memory_budget = self.memory_budget
+        return engine
+
+    def cancel(self, image_path: str):
+        """取消一张图片：正在执行的阶段处理立即中止，尚未处理的页面不再调用API，均按失败输出"""
+        if image_path in self.cancelled:
+            return
+        self.cancelled.add(image_path)
+        handlers = self._handlers.get(image_path, ())
+        for handler in handlers:
+            handler.cancel()
+        metrics.increment('images.cancelled')
+        logging.info(f"已取消 {Path(image_path).name}（{len(handlers)} 个页面正在处理）")
+
+    async def _drop(self, task: PageTask):
+        """已取消图片的页面：释放内存并按失败送往写入阶段"""
+        task.release()
+        task.text = None
+        await self.write_queue.put(task)
+
+    @staticmethod
+    async def _put(queue: asyncio.Queue, task: PageTask):
+        """放入阶段队列，并记录入队时间用于统计排队等待"""
+        task.enqueued_at = time.perf_counter()
+        await queue.put(task)
+
+    async def _run_stage(self, stage: str, inbox: asyncio.Queue, outbox: asyncio.Queue,
+                         handler: Callable, workers: int):
+        """以workers个协程消费inbox，全部结束后向outbox传递结束标记
+
+        handler处理失败或所属图片被取消时，页面以空结果直接送往写入阶段，保证输出顺序不被阻塞。
+        handler在单独的任务中执行，cancel() 可以中止某张图片正在进行的请求。
+        """
+        async def worker():
+            while True:
+                item = await inbox.get()
+                if item is _DONE:
+                    # 放回结束标记，让同阶段的其他协程也能退出
+                    await inbox.put(_DONE)
+                    return
+                metrics.observe(f"queue_wait.{stage}", time.perf_counter() - item.enqueued_at)
+                if item.image_path in self.cancelled:
+                    await self._drop(item)
+                    continue
+                running = asyncio.ensure_future(handler(item))
+                handlers = self._handlers.setdefault(item.image_path, set())
+                handlers.add(running)
+                try:
+                    await asyncio.wait({running})
+                except asyncio.CancelledError:
+                    running.cancel()
+                    raise
+                finally:
+                    handlers.discard(running)
+                    if not handlers:
+                        self._handlers.pop(item.image_path, None)
+                if running.cancelled():
+                    await self._drop(item)
+                elif running.exception() is not None:
+                    logging.error(f"{STAGE_NAMES[stage]}阶段处理出错 {item.page_info}: {str(running.exception())}")
+                    await self._drop(item)
+
+        await asyncio.gather(*[worker() for _ in range(workers)])
+        await outbox.put(_DONE)
+
+    async def _detect_stage(self, image_files: List[str]):
+        """读取图片并分割页面"""
+        pending = iter(enumerate(image_files))
+
+        async def worker():
+            for image_index, image_path in pending:
+                image_path = str(image_path)
+                filename = Path(image_path).stem
+                if image_path in self.cancelled:
+                    await self.write_queue.put(ImageMarker(image_index, image_path, 0, failed=1))
+                    continue
+                state = self.journal.image_state(image_path) if self.journal else None
+
+                # 所有页面都已完成时无需重新读取图片
+                if RunJournal.is_complete(state):
+                    total_pages = state['total_pages']
+                    labels = state.get('labels') or [''] * total_pages
+                    await self.write_queue.put(ImageMarker(image_index, image_path, total_pages))
+                    for page_index in range(total_pages):
+                        await self.write_queue.put(PageTask(
+                            image_index, page_index, total_pages, filename, image_path,
+                            text=state['pages'][page_index]['text'], label=labels[page_index]
+                        ))
+                    continue
+
+                if is_document(image_path):
+                    await self._load_document(image_index, image_path, filename, state)
+                    continue
+
+                # 按解码后的预计大小申请内存额度，额度不足时等待前面的图片释放页面
+                source = ImageSource(image_path, self.decode_max_pixels)
+                estimated = await self.cpu.run_thread(source.estimated_bytes)
+                reserved = await self.memory_budget.acquire(
+                    estimated if estimated is not None else self.memory_budget.limit
+                )
+                lease = ImageLease(self.memory_budget, reserved)
+                try:
+                    pages = await self.cpu.load_pages(source)
+                except Exception as e:
+                    logging.error(f"处理图片时出错 {image_path}: {str(e)}")
+                    self.failed_pages += 1
+                    metrics.increment('images.failed')
+                    lease.set_pages(0)
+                    await self.write_queue.put(ImageMarker(image_index, image_path, 0, failed=1))
+                    continue
+                lease.set_pages(len(pages))
+                logging.info(f"检测到 {len(pages)} 个页面")
+
+                if self.journal and pages:
+                    if state is None or state['total_pages'] != len(pages):
+                        self.journal.record_detected(image_path, len(pages))
+                        state = None
+
+                await self.write_queue.put(ImageMarker(image_index, image_path, len(pages)))
+                for page_index, page in enumerate(pages):
+                    task = PageTask(image_index, page_index, len(pages), filename, image_path, page=page, lease=lease)
+                    await self._route_page(task, state)
+
+        await asyncio.gather(*[worker() for _ in range(self.cpu_concurrency)])
+        await self.preprocess_queue.put(_DONE)
+
+    async def _route_page(self, task: PageTask, state: Optional[Dict[str, Any]]):
+        """检查点中已完成的阶段直接复用，其余页面送入预处理"""
+        done = state['pages'].get(task.page_index, {}) if state else {}
+        if 'text' in done:
+            task.release()
+            task.text = done['text']
+            await self.write_queue.put(task)
+        elif done.get('raw_text'):
+            task.release()
+            task.raw_text = done['raw_text']
+            await self._put(self.enhance_queue, task)
+        else:
+            await self._put(self.preprocess_queue, task)
+
+    async def _load_document(self, image_index: int, image_path: str, filename: str,
+                             state: Optional[Dict[str, Any]]):
+        """逐页渲染PDF、多页TIFF等文档并送入流水线
+
+        每次只渲染一页，按这一页的大小申请内存额度，页面送入预处理队列后再渲染下一页，
+        队列满时渲染随之暂停，内存占用与文档页数无关，也不产生中间文件。
+        每渲染一页向写入阶段通知目前的页面数，全部完成后发送最终的页面数。
+        """
+        document = DocumentSource(image_path, self.document_config['RENDER_MAX_PIXELS'],
+                                  self.document_config['MAX_DPI'])
+        try:
+            sheets = await self.cpu.run_thread(document.sheets)
+        except Exception as e:
+            logging.error(f"处理文档时出错 {image_path}: {str(e)}")
+            self.failed_pages += 1
+            metrics.increment('images.failed')
+            await self.write_queue.put(ImageMarker(image_index, image_path, 0, failed=1))
+            return
+        logging.info(f"{filename} 共 {len(sheets)} 页")
+        if self.journal and state is None:
+            self.journal.record_detected(image_path, None)
+
+        labels = []
+        for sheet in sheets:
+            if image_path in self.cancelled:
+                # 取消后不再渲染之后的页面
+                await self.write_queue.put(ImageMarker(image_index, image_path, len(labels), failed=1))
+                return
+            reserved = await self.memory_budget.acquire(sheet.estimated_bytes())
+            lease = ImageLease(self.memory_budget, reserved)
+            try:
+                pages = await self.cpu.load_pages(sheet, self.document_config['DETECT_PAGES'])
+            except Exception as e:
+                logging.error(f"处理文档页面时出错 {filename} 第 {sheet.index + 1} 页: {str(e)}")
+                pages = []
+            lease.set_pages(len(pages))
+            metrics.increment('document.sheets')
+
+            sheet_label = f"Page {sheet.index + 1}/{len(sheets)}"
+            if len(pages) > 1:
+                sheet_labels = [f"{sheet_label}, {k + 1}/{len(pages)}" for k in range(len(pages))]
+            else:
+                sheet_labels = [sheet_label]
+            first = len(labels)
+            labels.extend(sheet_labels)
+            await self.write_queue.put(ImageMarker(image_index, image_path, len(labels), final=False))
+
+            if not pages:
+                # 渲染失败的一页以空结果输出，计为失败页面
+                await self.write_queue.put(PageTask(image_index, first, 0, filename, image_path,
+                                                    label=sheet_label))
+                continue
+            for offset, page in enumerate(pages):
+                task = PageTask(image_index, first + offset, 0, filename, image_path, page=page, lease=lease,
+                                label=sheet_labels[offset])
+                await self._route_page(task, state)
+
+        if self.journal and labels:
+            if state is None or state['total_pages'] != len(labels) or state.get('labels') != labels:
+                self.journal.record_detected(image_path, len(labels), labels)
+        await self.write_queue.put(ImageMarker(image_index, image_path, len(labels)))
+
+    async def _deduplicate(self, task: PageTask) -> bool:
+        """在去重索引中查找近似重复的页面
+
+        重复的页面不再预处理和识别，直接送往写入阶段，由写入阶段在原页面完成后复用其结果；
+        否则把页面加入索引，供之后重复拍摄的页面复用。
+
+        Returns:
+            页面是否为重复页面
+        """
+        page_hash = await self.cpu.run_thread(ImageProcessor.page_hash, task.page.array)
+        if page_hash is None:
+            return False
+        group = self.dedup_groups.get(task.image_path) if self.dedup_groups is not None else None
+        original = self.page_index.lookup(page_hash, group)
+        if original is None:
+            task.indexed = self.page_index.add(page_hash, task.page_info, task.image_path, group)
+            self.indexed_pages.add(task.indexed)
+            return False
+        logging.info(f"{task.page_info} 与 {original.page_info} 重复，复用已有结果")
+        metrics.increment('dedup.pages')
+        task.duplicate_of = original
+        task.release()
+        await self.write_queue.put(task)
+        return True
+
+    def _duplicate_text(self, task: PageTask) -> Optional[str]:
+        """重复页面的输出：原页面的文本，或指向原页面的标记"""
+        original = task.duplicate_of
+        if not original.text:
+            return original.text
+        if self.dedup_action == 'mark':
+            return f"> 与 {original.page_info} 重复，内容见该页"
+        return original.text
+
+    async def _preprocess(self, task: PageTask):
+        """查询缓存并预处理页面；已缓存OCR结果的页面直接进入文本优化阶段"""
+        if self.page_index is not None and await self._deduplicate(task):
+            return
+
+        if self.cache.enabled:
+            page_digest = await self.cpu.run_thread(self.cache.image_digest, task.page.array)
+            task.page_digest = self.note_ocr.preprocess_cache_key(page_digest)
+            processed_digest = self.cache.get('preprocess', task.page_digest)
+            if processed_digest:
+                raw_text = self.cache.get('ocr', self.note_ocr.ocr_cache_key(processed_digest))
+                if raw_text is not None:
+                    task.raw_text = raw_text
+                    task.release()
+                    await self._finish_ocr(task)
+                    return
+
+        task.processed = await self.cpu.preprocess(task.page)
+        task.page.release()
+        task.page = None
+
+        processed_digest = ''
+        if self.cache.enabled:
+            processed_digest = await self.cpu.run_thread(self.cache.image_digest, task.processed.array)
+            self.cache.set('preprocess', task.page_digest, processed_digest)
+        task.ocr_key = self.note_ocr.ocr_cache_key(processed_digest)
+
+        raw_text = self.cache.get('ocr', task.ocr_key)
+        if raw_text is not None:
+            task.raw_text = raw_text
+            task.release()
+            await self._finish_ocr(task)
+            return
+
+        await self._put(self.encode_queue, task)
+
+    async def _encode(self, task: PageTask):
+        """将预处理后的页面编码为OCR请求"""
+        try:
+            task.ocr_payload = await self.cpu.run_thread(self.ocr_processor.prepare, task.processed.array)
+        finally:
+            task.release()
+        await self._put(self.ocr_queue, task)
+
+    def _partial(self, task: PageTask, stage: str) -> Optional[PartialCallback]:
+        """把流式接收到的部分结果连同页面信息转交给进度回调"""
+        if self.on_partial is None:
+            return None
+
+        def forward(text: str):
+            self.on_partial({'source': task.image_path, 'filename': task.page_info,
+                             'page': task.page_index, 'stage': stage, 'text': text})
+        return forward
+
+    async def _recognize(self, task: PageTask):
+        """调用OCR API，结果写入缓存（包括没有识别出文字的空结果，之后不再重复请求）"""
+        task.raw_text = await self.ocr_processor.arecognize(task.ocr_payload, self._partial(task, 'ocr'))
+        task.ocr_payload = None
+        self.cache.set('ocr', task.ocr_key, task.raw_text)
+        await self._finish_ocr(task, record=True)
+
+    async def _finish_ocr(self, task: PageTask, record: bool = False):
+        """OCR完成：没有识别出文字的页面（如空白页）以空文本输出，不计为失败，其余送入文本优化
+
+        Args:
+            record: 是否把OCR文本写入检查点（命中缓存时不需要）
+        """
+        if not task.raw_text.strip():
+            task.text = ''
+            if self.journal:
+                self.journal.record_enhanced(task.image_path, task.page_index, '')
+            await self.write_queue.put(task)
+            return
+        if self.journal and record:
+            self.journal.record_ocr(task.image_path, task.page_index, task.raw_text)
+        await self._put(self.enhance_queue, task)
+
+    def _enhance_key(self, task: PageTask) -> str:
+        """文本优化结果的缓存键；启用多页合并时按合并提示词与输出上限区分"""
+        return self.note_ocr.enhance_cache_key(task.raw_text, task.enhance_mode, self.note_ocr.batch_max_tokens())
+
+    async def _finish_enhance(self, task: PageTask, enhanced_text: Optional[str], from_cache: bool = False):
+        """记录优化结果并送往写入阶段
+
+        优化失败（enhanced_text为None）的页面按失败处理：不写入缓存和检查点，
+        图片暂不输出，重新运行时从检查点中的OCR文本重新优化。
+        """
+        if enhanced_text is None:
+            task.text = None
+            await self.write_queue.put(task)
+            return
+        if not from_cache and enhanced_text and enhanced_text != task.raw_text:
+            self.cache.set('enhance', self._enhance_key(task), enhanced_text)
+        task.text = enhanced_text
+        if self.journal and enhanced_text:
+            self.journal.record_enhanced(task.image_path, task.page_index, enhanced_text)
+        await self.write_queue.put(task)
+
+    async def _enhance(self, task: PageTask):
+        """调用文本优化API，优先使用缓存；不需要优化的页面直接输出OCR文本"""
+        task.enhance_mode = self.note_ocr.enhance_mode(task.raw_text)
+        if task.enhance_mode == SKIP:
+            await self._finish_enhance(task, task.raw_text)
+            return
+        enhanced_text = self.cache.get('enhance', self._enhance_key(task))
+        if enhanced_text is not None:
+            await self._finish_enhance(task, enhanced_text, from_cache=True)
+            return
+        enhanced_text = await self.text_processor.aformat_and_enhance(
+            task.raw_text, task.enhance_mode, self._partial(task, 'enhance')
+        )
+        await self._finish_enhance(task, enhanced_text)
+
+    async def _enhance_batch(self, batch: List[PageTask]):
+        """将多个页面合并为一次文本优化请求"""
+        try:
+            texts = await self.text_processor.aformat_and_enhance_batch(
+                [task.raw_text for task in batch],
+                max_tokens=config.TEXT_BATCH_CONFIG['MAX_OUTPUT_TOKENS']
+            )
+            for task, enhanced_text in zip(batch, texts):
+                await self._finish_enhance(task, enhanced_text)
+        except Exception as e:
+            logging.error(f"文本优化阶段处理出错: {str(e)}")
+            for task in batch:
+                if task.text is None:
+                    await self.write_queue.put(task)
+
+    async def _enhance_batch_stage(self):
+        """按token预算把待优化的页面打包成批次，并发发送"""
+        loop = asyncio.get_running_loop()
+        budget = config.TEXT_BATCH_CONFIG['TOKEN_BUDGET']
+        max_pages = config.TEXT_BATCH_CONFIG['MAX_PAGES']
+        linger = config.TEXT_BATCH_CONFIG['LINGER']
+        slots = asyncio.Semaphore(self.text_concurrency)
+        running = set()
+        carry = None
+        finished = False
+
+        async def run_batch(batch):
+            try:
+                await self._enhance_batch(batch)
+            finally:
+                slots.release()
+
+        async def next_item(wait: bool):
+            """取下一个需要调用API的页面，命中缓存或不需要优化的页面直接输出
+
+            合并请求统一做完整优化，分流只用于跳过不需要优化的页面。
+            """
+            while True:
+                if wait:
+                    item = await self.enhance_queue.get()
+                else:
+                    item = self.enhance_queue.get_nowait()
+                if item is _DONE:
+                    return item
+                metrics.observe("queue_wait.enhance", time.perf_counter() - item.enqueued_at)
+                if item.image_path in self.cancelled:
+                    await self._drop(item)
+                    continue
+                if self.note_ocr.enhance_mode(item.raw_text) == SKIP:
+                    await self._finish_enhance(item, item.raw_text)
+                    continue
+                enhanced_text = self.cache.get('enhance', self._enhance_key(item))
+                if enhanced_text is None:
+                    return item
+                await self._finish_enhance(item, enhanced_text, from_cache=True)
+
+        while not finished or carry is not None:
+            first = carry if carry is not None else await next_item(wait=True)
+            carry = None
+            if first is _DONE:
+                break
+
+            batch = [first]
+            tokens = self.text_processor.estimate_tokens(first.raw_text)
+            deadline = loop.time() + linger
+            while len(batch) < max_pages:
+                try:
+                    item = await next_item(wait=False)
+                except asyncio.QueueEmpty:
+                    if loop.time() >= deadline:
+                        break
+                    await asyncio.sleep(min(0.05, linger))
+                    continue
+                if item is _DONE:
+                    finished = True
+                    break
+                item_tokens = self.text_processor.estimate_tokens(item.raw_text)
+                if tokens + item_tokens > budget:
+                    carry = item
+                    break
+                batch.append(item)
+                tokens += item_tokens
+
+            await slots.acquire()
+            task = asyncio.create_task(run_batch(batch))
+            running.add(task)
+            task.add_done_callback(running.discard)
+
+        if running:
+            await asyncio.gather(*running)
+        await self.write_queue.put(_DONE)
+
+    async def _write_stage(self, on_result: Callable[[Dict[str, str]], None],
+                           on_image_done: Optional[Callable[[str, int], None]]) -> int:
+        """按输入顺序重排并输出结果"""
+        expected = {}
+        image_paths = {}
+        # 仍在逐页渲染、页面数尚未确定的文档
+        open_documents = set()
+        buffered = {}
+        # 读取失败的图片 -> 失败数
+        load_failed = {}
+        image_failed = 0
+        next_image = 0
+        next_page = 0
+        written = 0
+
+        while True:
+            item = await self.write_queue.get()
+            if item is _DONE:
+                break
+            if isinstance(item, ImageMarker):
+                expected[item.image_index] = item.total_pages
+                image_paths[item.image_index] = item.image_path
+                if item.failed:
+                    load_failed[item.image_index] = item.failed
+                if item.final:
+                    open_documents.discard(item.image_index)
+                else:
+                    open_documents.add(item.image_index)
+            else:
+                buffered[(item.image_index, item.page_index)] = item
+                if item.indexed is not None:
+                    self.page_index.resolve(item.indexed, item.text)
+                    self.indexed_pages.discard(item.indexed)
+
+            # 输出所有前序已完成的页面
+            while next_image in expected:
+                if next_page >= expected[next_image]:
+                    if next_image in open_documents:
+                        break
+                    image_failed += load_failed.pop(next_image, 0)
+                    if on_image_done:
+                        on_image_done(image_paths.pop(next_image), image_failed)
+                    del expected[next_image]
+                    image_failed = 0
+                    next_image += 1
+                    next_page = 0
+                    continue
+                task = buffered.get((next_image, next_page))
+                if task is None:
+                    break
+                if task.duplicate_of is not None:
+                    # 原页面可能排在后面，完成后会经过写入阶段，届时再输出
+                    if not task.duplicate_of.done:
+                        break
+                    task.text = self._duplicate_text(task)
+                    if self.journal and task.text is not None:
+                        self.journal.record_enhanced(task.image_path, task.page_index, task.text)
+                del buffered[(next_image, next_page)]
+                if task.text:
+                    on_result({'filename': task.page_info, 'text': task.text, 'source': task.image_path})
+                    written += 1
+                    metrics.increment('pages.written')
+                    if self.journal:
+                        self.journal.record_written(task.image_path, task.page_index)
+                elif task.text == '':
+                    # 空白页面直接跳过，图片照常完成
+                    logging.info(f"{task.page_info} 没有识别出文字，已跳过")
+                    metrics.increment('pages.blank')
+                else:
+                    self.failed_pages += 1
+                    image_failed += 1
+                    metrics.increment('pages.failed')
+                next_page += 1
+
+        return written
+
+    async def process_files(self, image_files: List[str], on_result: Callable[[Dict[str, str]], None],
+                            on_image_done: Optional[Callable[[str, int], None]] = None,
+                            on_partial: Optional[Callable[[Dict[str, Any]], None]] = None,
+                            dedup_groups: Optional[Dict[str, str]] = None) -> int:
+        """以流水线方式处理多张图片
+
+        Args:
+            image_files: 图片路径列表
+            on_result: 每个页面结果按输入顺序就绪时的回调
+            on_image_done: 每张图片的全部页面输出后的回调，参数为 (图片路径, 失败页面数)
+            on_partial: 流式接收OCR和文本优化结果时的进度回调，参数包含
+                source、filename、page、stage（ocr / enhance）与目前为止的 text
+            dedup_groups: 图片路径 -> 去重分组（如客户端），提供时只在同一分组的页面之间去重，
+                且不复用、不持久化未分组的页面
+
+        Returns:
+            成功输出的页面数
+        """
+        self.on_partial = on_partial
+        self.dedup_groups = dedup_groups
+        self.cancelled = set()
+        self.preprocess_queue = asyncio.Queue(self.queue_size)
+        self.encode_queue = asyncio.Queue(self.queue_size)
+        self.ocr_queue = asyncio.Queue(self.queue_size)
+        self.enhance_queue = asyncio.Queue(self.queue_size)
+        # 写入队列不设上限：写入阶段从不阻塞，且失败的页面需要随时能够送达
+        self.write_queue = asyncio.Queue()
+
+        stages = [
+            self._detect_stage(image_files),
+            self._run_stage("preprocess", self.preprocess_queue, self.encode_queue,
+                            self._preprocess, self.cpu_concurrency),
+            self._run_stage("encode", self.encode_queue, self.ocr_queue,
+                            self._encode, self.cpu.thread_workers),
+            self._run_stage("ocr", self.ocr_queue, self.enhance_queue,
+                            self._recognize, self.ocr_concurrency),
+        ]
+        if config.TEXT_BATCH_CONFIG['ENABLED']:
+            stages.append(self._enhance_batch_stage())
+        else:
+            stages.append(self._run_stage("enhance", self.enhance_queue, self.write_queue,
+                                          self._enhance, self.text_concurrency))
+        try:
+            results = await asyncio.gather(self._write_stage(on_result, on_image_done), *stages)
+        finally:
+            # 处理被中断时，未完成的页面按失败处理，之后的重复页面不会一直等待
+            for page in self.indexed_pages:
+                self.page_index.resolve(page, None)
+            self.indexed_pages.clear()
+        return results[0]
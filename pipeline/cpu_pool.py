@@ -0,0 +1,210 @@
+import os
+import asyncio
+import logging
+import multiprocessing
+import concurrent.futures
+from multiprocessing import shared_memory
+from typing import List, Tuple, Optional
+
+import cv2
+import numpy as np
+
+from processors.image_processor import ImageProcessor
+from utils.image_source import ImageSource
+from utils.metrics import metrics
+
+# 共享内存图片描述符：(共享内存名称, 形状, dtype)
+ImageDescriptor = Tuple[str, Tuple[int, ...], str]
+
+
+class SharedImage:
+    """存放在共享内存中的图片，进程间只传递描述符而不复制像素"""
+
+    def __init__(self, shm: shared_memory.SharedMemory, shape: Tuple[int, ...], dtype: str):
+        self.shm = shm
+        self.array = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+
+    @classmethod
+    def create(cls, array: np.ndarray) -> 'SharedImage':
+        """创建共享内存并写入图片"""
+        shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        image = cls(shm, array.shape, array.dtype.str)
+        image.array[...] = array
+        return image
+
+    @classmethod
+    def attach(cls, descriptor: ImageDescriptor) -> 'SharedImage':
+        """根据描述符连接已有的共享内存"""
+        name, shape, dtype = descriptor
+        return cls(shared_memory.SharedMemory(name=name), shape, dtype)
+
+    @property
+    def descriptor(self) -> ImageDescriptor:
+        return (self.shm.name, self.array.shape, self.array.dtype.str)
+
+    def close(self):
+        """断开当前进程与共享内存的连接"""
+        self.array = None
+        self.shm.close()
+
+    def release(self):
+        """断开连接并释放共享内存"""
+        self.close()
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+class LocalImage:
+    """进程内图片，与SharedImage提供相同的接口"""
+
+    def __init__(self, array: np.ndarray):
+        self.array = array
+
+    def release(self):
+        self.array = None
+
+
+def _init_worker():
+    """工作进程初始化：避免OpenCV内部线程与进程池争抢CPU，并导出性能指标"""
+    cv2.setNumThreads(1)
+    metrics.enable_export()
+
+
+def _split_pages(image: np.ndarray, detect_max_side: Optional[int], detect: str) -> List[np.ndarray]:
+    """分割页面；detect 为 never，或为 auto 且图片是单页扫描件时，整张图片作为一个页面"""
+    if detect == 'never' or (detect == 'auto' and ImageProcessor.is_scanned_page(image)):
+        metrics.increment('detect.skipped')
+        return [image]
+    with metrics.timer('detect'):
+        return ImageProcessor.detect_pages(image, detect_max_side)
+
+
+def _load_pages_worker(source: ImageSource, detect_max_side: Optional[int] = None,
+                       detect: str = 'always') -> Tuple[List[ImageDescriptor], List[tuple]]:
+    """在工作进程中解码图片（或渲染文档的一页）并分割页面，页面写入共享内存
+
+    Returns:
+        (页面描述符列表, 工作进程中新增的性能指标样本)
+    """
+    try:
+        with metrics.timer('read'):
+            image = source.read()
+    except Exception:
+        metrics.drain()
+        raise
+
+    descriptors = []
+    try:
+        pages = _split_pages(image, detect_max_side, detect)
+        for page in pages:
+            shared = SharedImage.create(page)
+            descriptors.append(shared.descriptor)
+            shared.close()
+    except Exception:
+        for descriptor in descriptors:
+            SharedImage.attach(descriptor).release()
+        metrics.drain()
+        raise
+    return descriptors, metrics.drain()
+
+
+def _preprocess_worker(descriptor: ImageDescriptor, profile: Optional[str] = None) -> Tuple[ImageDescriptor, List[tuple]]:
+    """在工作进程中预处理共享内存中的页面，结果写入新的共享内存"""
+    page = SharedImage.attach(descriptor)
+    try:
+        with metrics.timer('preprocess'):
+            processed = ImageProcessor.preprocess_image(page.array, profile)
+    finally:
+        page.close()
+
+    shared = SharedImage.create(processed)
+    result = shared.descriptor
+    shared.close()
+    return result, metrics.drain()
+
+
+class CPUPool:
+    """CPU密集型图像处理阶段（页面检测、预处理）的执行池
+
+    workers > 0 时使用独立的进程池，页面通过共享内存在进程间传递；
+    workers == 0 时退化为进程内线程池。
+    """
+
+    def __init__(self, workers: Optional[int] = None, detect_max_side: Optional[int] = None,
+                 preprocess_profile: Optional[str] = None):
+        """初始化
+
+        Args:
+            workers: 进程数，0表示使用进程内线程池
+            detect_max_side: 页面检测缩略图的最大边长，默认使用 ImageProcessor.DETECT_MAX_SIDE
+            preprocess_profile: 预处理档位，默认使用 ImageProcessor.PREPROCESS_PROFILE
+        """
+        self.workers = os.cpu_count() if workers is None else workers
+        self.detect_max_side = detect_max_side
+        self.preprocess_profile = preprocess_profile
+        self.use_processes = self.workers > 0
+        self.thread_workers = max(self.workers, 4)
+        self.thread_executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.thread_workers
+        )
+        self.process_executor = None
+        if self.use_processes:
+            self.process_executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker
+            )
+            logging.info(f"图像处理进程池已启动，进程数: {self.workers}")
+
+    @staticmethod
+    def _timed(stage: str, func, *args):
+        with metrics.timer(stage):
+            return func(*args)
+
+    async def run_thread(self, func, *args):
+        """在线程池中执行轻量任务（哈希、编码等）"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.thread_executor, func, *args)
+
+    async def load_pages(self, source: ImageSource, detect: str = 'always') -> List:
+        """解码图片并分割页面
+
+        Args:
+            source: ImageSource，或提供相同接口的 DocumentSheet
+            detect: always: 检测并分割页面；never: 整张图片作为一个页面；
+                auto: 单页扫描件不做页面检测
+        """
+        if not self.use_processes:
+            image = await self.run_thread(self._timed, 'read', source.read)
+            pages = await self.run_thread(_split_pages, image, self.detect_max_side, detect)
+            return [LocalImage(page) for page in pages]
+
+        loop = asyncio.get_running_loop()
+        descriptors, samples = await loop.run_in_executor(
+            self.process_executor, _load_pages_worker, source, self.detect_max_side, detect
+        )
+        metrics.merge(samples)
+        return [SharedImage.attach(descriptor) for descriptor in descriptors]
+
+    async def preprocess(self, page):
+        """预处理页面，返回与输入同类型的图片对象"""
+        if not self.use_processes:
+            processed = await self.run_thread(
+                self._timed, 'preprocess', ImageProcessor.preprocess_image, page.array, self.preprocess_profile
+            )
+            return LocalImage(processed)
+
+        loop = asyncio.get_running_loop()
+        descriptor, samples = await loop.run_in_executor(
+            self.process_executor, _preprocess_worker, page.descriptor, self.preprocess_profile
+        )
+        metrics.merge(samples)
+        return SharedImage.attach(descriptor)
+
+    def shutdown(self):
+        """关闭执行池"""
+        if self.process_executor is not None:
+            self.process_executor.shutdown(wait=True)
+        self.thread_executor.shutdown(wait=True)
@@ -0,0 +1,92 @@
+import time
+import asyncio
+from collections import deque
+
+from utils.metrics import metrics
+
+
+class MemoryBudget:
+    """限制同时存活的已解码图片占用的内存
+
+    读取图片前按预计大小申请额度，图片的所有页面释放像素后归还。
+    超过上限的单张图片在没有其他图片占用额度时仍然允许处理，避免永久等待。
+    等待按申请顺序唤醒，只在事件循环线程中使用。
+    """
+
+    def __init__(self, limit_bytes: int):
+        """初始化
+
+        Args:
+            limit_bytes: 额度上限（字节），0表示不限制
+        """
+        self.limit = limit_bytes
+        self.used = 0
+        self._waiters = deque()
+
+    def _fits(self, nbytes: int) -> bool:
+        return self.used == 0 or self.used + nbytes <= self.limit
+
+    async def acquire(self, nbytes: int) -> int:
+        """申请额度，返回实际占用的字节数（用于之后归还）"""
+        if self.limit <= 0:
+            return 0
+        nbytes = min(nbytes, self.limit)
+        if not self._waiters and self._fits(nbytes):
+            self.used += nbytes
+            return nbytes
+
+        started = time.perf_counter()
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append((nbytes, future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # 已分配额度但调用方被取消
+                self.release(nbytes)
+            raise
+        metrics.observe('queue_wait.memory', time.perf_counter() - started)
+        return nbytes
+
+    def release(self, nbytes: int):
+        """归还额度并唤醒等待者"""
+        if not nbytes:
+            return
+        self.used -= nbytes
+        while self._waiters:
+            waiting, future = self._waiters[0]
+            if future.done():
+                self._waiters.popleft()
+                continue
+            if not self._fits(waiting):
+                break
+            self._waiters.popleft()
+            self.used += waiting
+            future.set_result(None)
+
+
+class ImageLease:
+    """一张图片占用的内存额度，所有页面都释放像素后归还"""
+
+    def __init__(self, budget: MemoryBudget, nbytes: int, pages: int = 0):
+        self.budget = budget
+        self.nbytes = nbytes
+        self.pages = pages
+
+    def set_pages(self, pages: int):
+        """设置页面数；没有页面时立即归还"""
+        self.pages = pages
+        if pages <= 0:
+            self.close()
+
+    def release_page(self):
+        """一个页面已释放像素"""
+        self.pages -= 1
+        if self.pages <= 0:
+            self.close()
+
+    def close(self):
+        """归还额度"""
+        if self.nbytes:
+            self.budget.release(self.nbytes)
+            self.nbytes = 0
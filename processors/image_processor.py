@@ -1,29 +1,131 @@
 import cv2
 import numpy as np
 import logging
-from typing import List
+from typing import List, Dict, Optional
 from scipy.signal import find_peaks
 
+from utils.metrics import metrics
+
+
+class ImagePlanes:
+    """图片的派生平面（灰度、LAB、亮度），首次使用时计算，之后复用同一份数据
+
+    派生平面应视为只读，需要修改时由调用方自行复制。
+    """
+
+    def __init__(self, image: np.ndarray):
+        self.image = image
+        self._gray = None
+        self._lab = None
+
+    @property
+    def gray(self) -> np.ndarray:
+        if self._gray is None:
+            if len(self.image.shape) == 2:
+                self._gray = self.image
+            else:
+                self._gray = cv2.cvtColor(self.image, cv2.COLOR_BGR2GRAY)
+        return self._gray
+
+    @property
+    def lab(self) -> np.ndarray:
+        if self._lab is None:
+            self._lab = cv2.cvtColor(self.image, cv2.COLOR_BGR2LAB)
+        return self._lab
+
+
 class ImageProcessor:
+    # 页面检测在长边不超过该值的缩略图上进行，0表示使用原图
+    DETECT_MAX_SIDE = 1600
+    # 版面特征分析使用的缩略图最大边长，以及判定为有文字所需的最少连通域数
+    ANALYSIS_MAX_SIDE = 1000
+    MIN_TEXT_COMPONENTS = 20
+    # 角点在原图上局部细化的搜索半径（像素）
+    REFINE_RADIUS = 8
+    # 感知哈希取 HASH_SIDE x HASH_SIDE 个低频DCT系数（共256位）；墨迹占比低于 HASH_MIN_INK 的页面不计算哈希
+    HASH_SIDE = 16
+    HASH_MIN_INK = 0.005
+    # 图片四周边缘中接近纸张亮度的像素占比达到该值时视为单页扫描件
+    SCAN_BORDER_RATIO = 0.9
+
+    # 预处理档位，见 preprocess_image
+    PREPROCESS_PROFILES = ('fast', 'balanced', 'quality', 'auto')
+    PREPROCESS_PROFILE = 'auto'
+    # auto档位下噪声估计值超过该阈值时才降噪
+    NOISE_THRESHOLD = 2.0
+    NOISE_KERNEL = np.array([[1, -2, 1],
+                             [-2, 4, -2],
+                             [1, -2, 1]], dtype=np.float32)
+    SHARPEN_KERNEL = np.array([[-1,-1,-1],
+                               [-1, 9,-1],
+                               [-1,-1,-1]])
+
+    @staticmethod
+    def _detection_proxy(image: np.ndarray, max_side: int):
+        """生成用于页面检测的缩略图，返回 (缩略图, 缩放比例)"""
+        height, width = image.shape[:2]
+        if max_side <= 0 or max(height, width) <= max_side:
+            return image, 1.0
+        scale = max_side / max(height, width)
+        proxy = cv2.resize(image, (round(width * scale), round(height * scale)), interpolation=cv2.INTER_AREA)
+        return proxy, scale
+
+    @staticmethod
+    def _refine_corners(image: np.ndarray, corners: np.ndarray, radius: int) -> np.ndarray:
+        """在原图角点附近的小窗口内做亚像素级细化，只读取窗口内的像素"""
+        height, width = image.shape[:2]
+        refined = corners.copy()
+        criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 20, 0.1)
+        half = max(radius // 2, 2)
+        for i, (x, y) in enumerate(corners):
+            x0, y0 = max(int(x) - radius, 0), max(int(y) - radius, 0)
+            x1, y1 = min(int(x) + radius + 1, width), min(int(y) + radius + 1, height)
+            # 窗口需要容纳cornerSubPix的搜索区域
+            if x1 - x0 <= 2 * half + 2 or y1 - y0 <= 2 * half + 2:
+                continue
+            window = cv2.cvtColor(image[y0:y1, x0:x1], cv2.COLOR_BGR2GRAY)
+            point = np.array([[[x - x0, y - y0]]], dtype=np.float32)
+            try:
+                cv2.cornerSubPix(window, point, (half, half), (-1, -1), criteria)
+            except cv2.error:
+                continue
+            px, py = point[0, 0]
+            # 偏离过远说明该处不是清晰的角点，保留粗略位置
+            if abs(px - (x - x0)) <= radius and abs(py - (y - y0)) <= radius:
+                refined[i] = (px + x0, py + y0)
+        return refined
+
     @staticmethod
-    def detect_pages(image: np.ndarray) -> List[np.ndarray]:
-        """智能检测并分割图片中的笔记页面"""
+    def detect_pages(image: np.ndarray, max_side: int = None) -> List[np.ndarray]:
+        """智能检测并分割图片中的笔记页面
+
+        先在缩略图上检测页面四边形，再将角点映射回原图并局部细化，
+        只有最后的透视变换使用原图像素，检测耗时基本不随输入分辨率增长。
+
+        Args:
+            image: BGR格式的原图
+            max_side: 检测用缩略图的最大边长，默认使用 DETECT_MAX_SIDE
+        """
         if image is None:
             raise ValueError("无效的图片数据")
 
-        # 获取图片尺寸
-        height, width = image.shape[:2]
+        if max_side is None:
+            max_side = ImageProcessor.DETECT_MAX_SIDE
+        proxy, scale = ImageProcessor._detection_proxy(image, max_side)
+
+        # 获取缩略图尺寸
+        height, width = proxy.shape[:2]
         
         # 预处理步骤
-        # 1. 转换为灰度图
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        # 1. 转换为灰度图（备选方案复用同一灰度平面）
+        planes = ImagePlanes(proxy)
         
         # 2. 自适应直方图均衡化
         clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8))
-        gray = clahe.apply(gray)
+        gray = clahe.apply(planes.gray)
         
-        # 3. 高斯模糊减少噪声
-        gray = cv2.GaussianBlur(gray, (5, 5), 0)
+        # 3. 高斯模糊减少噪声（原地处理）
+        cv2.GaussianBlur(gray, (5, 5), 0, dst=gray)
         
         # 4. Canny边缘检测
         edges = cv2.Canny(gray, 50, 150, apertureSize=3)
@@ -58,19 +160,22 @@ class ImageProcessor:
             # 获取最小外接矩形
             rect = cv2.minAreaRect(contour)
             box = cv2.boxPoints(rect)
-            box = np.int_(box)
             
             # 计算长宽比
-            width_rect = rect[1][0]
-            height_rect = rect[1][1]
+            width_rect = rect[1][0] / scale
+            height_rect = rect[1][1] / scale
             aspect_ratio = max(width_rect, height_rect) / min(width_rect, height_rect)
             
             # 更宽松的长宽比限制
             if aspect_ratio > 2.0 or aspect_ratio < 0.3:
                 continue
             
-            # 获取透视变换的四个顶点
-            src_pts = box.astype("float32")
+            # 将顶点映射回原图并局部细化
+            src_pts = (box / scale).astype("float32")
+            if scale < 1:
+                src_pts = ImageProcessor._refine_corners(
+                    image, src_pts, ImageProcessor.REFINE_RADIUS + int(np.ceil(1 / scale))
+                )
             # 根据矩形的方向确定目标点
             if width_rect < height_rect:
                 dst_pts = np.array([[0, height_rect-1],
@@ -86,17 +191,18 @@ class ImageProcessor:
             # 计算透视变换矩阵
             M = cv2.getPerspectiveTransform(src_pts, dst_pts)
             
-            # 执行透视变换
+            # 执行透视变换（唯一使用原图像素的步骤）
             warped = cv2.warpPerspective(image, M, (int(width_rect), int(height_rect)))
             
             # 获取边界框中心点的x坐标用于排序
-            center_x = np.mean(box[:, 0])
+            center_x = np.mean(src_pts[:, 0])
             page_regions.append((center_x, warped))
         
         # 如果没有检测到页面，使用改进的备选方案
         if not page_regions:
             logging.info("使用备选方案：基于文本密度分析")
-            return ImageProcessor._fallback_page_detection(image)
+            with metrics.timer('detect.fallback'):
+                return ImageProcessor._fallback_page_detection(image, planes)
             
         # 按x坐标从左到右排序
         page_regions.sort(key=lambda x: x[0])
@@ -107,17 +213,26 @@ class ImageProcessor:
         # 如果检测到的页面数量不是3个，使用备选方案
         if len(pages) != 3:
             logging.info("检测到的页面数量不是3个，使用备选方案")
-            return ImageProcessor._fallback_page_detection(image)
+            with metrics.timer('detect.fallback'):
+                return ImageProcessor._fallback_page_detection(image, planes)
         
         return pages
 
     @staticmethod
-    def _fallback_page_detection(image: np.ndarray) -> List[np.ndarray]:
-        """改进的备选方案：基于文本密度分析的页面检测"""
-        height, width = image.shape[:2]
+    def _fallback_page_detection(image: np.ndarray, planes: ImagePlanes = None) -> List[np.ndarray]:
+        """改进的备选方案：基于文本密度分析的页面检测
+
+        Args:
+            image: 原图，按分割点切分
+            planes: 用于分析文本密度的缩略图平面，默认直接使用原图
+        """
+        if planes is None:
+            planes = ImagePlanes(image)
+        height, width = planes.image.shape[:2]
+        scale = width / image.shape[1]
         
-        # 转换为灰度图
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        # 灰度图（与页面检测共用）
+        gray = planes.gray
         
         # 自适应二值化
         binary = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
@@ -140,54 +255,200 @@ class ImageProcessor:
             split_points = [page_width, page_width * 2]
         else:
             split_points = sorted(valleys)
+        # 映射回原图坐标
+        split_points = [int(round(x / scale)) for x in split_points]
         
-        # 分割图像
+        # 分割图像（返回原图的视图，不复制像素，需要时由调用方复制）
         pages = []
         start_x = 0
         for split_x in split_points:
-            pages.append(image[:, start_x:split_x].copy())
+            pages.append(image[:, start_x:split_x])
             start_x = split_x
-        pages.append(image[:, start_x:].copy())
+        pages.append(image[:, start_x:])
         
         return pages
 
     @staticmethod
-    def preprocess_image(image: np.ndarray) -> np.ndarray:
-        """预处理图片以提高OCR效果"""
+    def estimate_noise(image: np.ndarray) -> float:
+        """快速估计图片的噪声标准差
+
+        对灰度图（或亮度平面）做Laplacian差分卷积（Immerkær方法），用中位数代替均值，
+        避免文字笔画等边缘使估计值偏高。
+        """
+        gray = image if len(image.shape) == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        # int16足以容纳卷积结果；取绝对值和求中位数都在同一缓冲区上原地完成
+        response = cv2.filter2D(gray, cv2.CV_16S, ImageProcessor.NOISE_KERNEL).reshape(-1)
+        np.abs(response, out=response)
+        middle = response.size // 2
+        response.partition(middle)
+        return float(response[middle]) / (0.6745 * 6)
+
+    @staticmethod
+    def page_features(image: np.ndarray, max_side: int = None) -> Dict[str, float]:
+        """在缩略图上估计页面的版面特征，供OCR后端路由等决策使用
+
+        Returns:
+            noise: 噪声标准差估计
+            ink_ratio: 墨迹像素占比
+            height_cv: 文字连通域高度的变异系数，印刷体字号统一时较小
+            line_gap_ratio: 文字区域内空白行所占比例，印刷体行距整齐、基线水平时较大
+        """
+        gray = image if len(image.shape) == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        gray, _ = ImageProcessor._detection_proxy(gray, max_side or ImageProcessor.ANALYSIS_MAX_SIDE)
+        features = {'noise': ImageProcessor.estimate_noise(gray), 'ink_ratio': 0.0,
+                    'height_cv': 0.0, 'line_gap_ratio': 1.0}
+
+        _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+        features['ink_ratio'] = cv2.countNonZero(binary) / binary.size
+
+        _, _, stats, _ = cv2.connectedComponentsWithStats(binary, connectivity=8)
+        heights = stats[1:, cv2.CC_STAT_HEIGHT]
+        areas = stats[1:, cv2.CC_STAT_AREA]
+        # 去掉噪点和表格线、页面边缘等过大的连通域
+        heights = heights[(areas >= 4) & (heights >= 3) & (heights <= gray.shape[0] // 5)]
+        if heights.size < ImageProcessor.MIN_TEXT_COMPONENTS:
+            return features
+        features['height_cv'] = float(heights.std() / max(np.median(heights), 1))
+
+        rows = cv2.reduce(binary, 1, cv2.REDUCE_SUM, dtype=cv2.CV_32S).ravel()
+        inked = np.flatnonzero(rows)
+        rows = rows[inked[0]:inked[-1] + 1]
+        features['line_gap_ratio'] = float(np.count_nonzero(rows <= rows.max() * 0.02) / rows.size)
+        return features
+
+    @staticmethod
+    def page_hash(image: np.ndarray) -> Optional[bytes]:
+        """计算页面的感知哈希（pHash），用于识别重复拍摄的页面
+
+        先除以闭运算估计的背景以消除光照不均和纸张颜色的影响，裁剪到文字区域以消除
+        页面边缘检测的差异，再取缩略图DCT的低频系数，高于中位数的系数记为1。
+        轻微的平移、旋转、缩放、重新打光和压缩只改变少量位。
+
+        Returns:
+            32字节的哈希；几乎空白的页面彼此无法区分，返回None
+        """
+        gray = image if len(image.shape) == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        gray, _ = ImageProcessor._detection_proxy(gray, 512)
+        background = cv2.morphologyEx(gray, cv2.MORPH_CLOSE, np.ones((15, 15), np.uint8))
+        gray = cv2.divide(gray, background, scale=255)
+        ink = gray < 160
+        if np.count_nonzero(ink) < ink.size * ImageProcessor.HASH_MIN_INK:
+            return None
+        # 文字区域：墨迹超过1%的行和列，忽略零星的污点
+        rows = np.flatnonzero(np.count_nonzero(ink, axis=1) > ink.shape[1] * 0.01)
+        cols = np.flatnonzero(np.count_nonzero(ink, axis=0) > ink.shape[0] * 0.01)
+        if rows.size < 2 or cols.size < 2:
+            return None
+        gray = gray[rows[0]:rows[-1] + 1, cols[0]:cols[-1] + 1]
+
+        side = ImageProcessor.HASH_SIDE
+        small = cv2.resize(gray, (side * 4, side * 4), interpolation=cv2.INTER_AREA).astype(np.float32)
+        coefficients = cv2.dct(small)[:side, :side].ravel()
+        # 直流分量只反映整体亮度，不参与比较
+        bits = coefficients > np.median(coefficients[1:])
+        bits[0] = False
+        return np.packbits(bits).tobytes()
+
+    @staticmethod
+    def is_scanned_page(image: np.ndarray) -> bool:
+        """判断图片是否为单页扫描件：页面铺满整张图片，四周是纸张而不是桌面等背景
+
+        扫描件不需要页面检测与分割，整张图片即为一个页面。在缩略图上检查四周的边缘条带，
+        绝大部分像素接近纸张亮度（图片中较亮部分的亮度）时视为扫描件。
+        """
+        gray = image if len(image.shape) == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        gray, _ = ImageProcessor._detection_proxy(gray, 256)
+        band = max(min(gray.shape[:2]) // 20, 1)
+        border = np.concatenate([
+            gray[:band].ravel(), gray[-band:].ravel(),
+            gray[:, :band].ravel(), gray[:, -band:].ravel()
+        ])
+        paper = np.percentile(gray, 90)
+        return np.count_nonzero(border >= paper * 0.8) >= border.size * ImageProcessor.SCAN_BORDER_RATIO
+
+    @staticmethod
+    def _ensure_min_height(image: np.ndarray, min_height: int = 1000) -> np.ndarray:
+        """调整大小确保图片不会太小"""
+        height, width = image.shape[:2]
+        if height >= min_height:
+            return image
+        scale = min_height / height
+        return cv2.resize(image, (int(width * scale), min_height), interpolation=cv2.INTER_CUBIC)
+
+    @staticmethod
+    def preprocess_image(image: np.ndarray, profile: str = None) -> np.ndarray:
+        """预处理图片以提高OCR效果
+
+        各步骤尽量在同一块缓冲区上原地完成：BGR直接转换为LAB，只提取亮度平面做
+        降噪和CLAHE后写回，再原地转换为RGB并锐化，避免每一步都分配新的整页数组。
+
+        Args:
+            image: BGR格式的页面图片
+            profile: 预处理档位，默认使用 PREPROCESS_PROFILE
+                - quality: 对彩色图做完整的非局部均值降噪（最慢）
+                - balanced: 只对亮度通道做小窗口降噪
+                - fast: 灰度处理，中值滤波代替降噪
+                - auto: 估计噪声，干净的页面跳过降噪，否则按balanced处理
+        """
+        profile = profile or ImageProcessor.PREPROCESS_PROFILE
+        if profile not in ImageProcessor.PREPROCESS_PROFILES:
+            raise ValueError(f"未知的预处理档位: {profile}")
+
         try:
-            # 转换为RGB格式
+            if profile == 'fast':
+                return ImageProcessor._preprocess_gray(image)
+
             if len(image.shape) == 2:  # 如果是灰度图
                 image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
-            elif image.shape[2] == 3:  # 如果是BGR格式
-                image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-            
-            # 调整大小确保图片不会太小
-            min_height = 1000
-            height, width = image.shape[:2]
-            if height < min_height:
-                scale = min_height / height
-                new_width = int(width * scale)
-                image = cv2.resize(image, (new_width, min_height), interpolation=cv2.INTER_CUBIC)
-            
+            image = ImageProcessor._ensure_min_height(image)
+
+            # 亮度平面：降噪、噪声估计和CLAHE共用
+            planes = ImagePlanes(image)
+            lab = planes.lab
+            l = cv2.extractChannel(lab, 0)
+
+            denoise = profile
+            if profile == 'auto':
+                noise = ImageProcessor.estimate_noise(l)
+                denoise = 'balanced' if noise > ImageProcessor.NOISE_THRESHOLD else None
+                if denoise is None:
+                    metrics.increment('preprocess.denoise_skipped')
+
+            if denoise == 'balanced':
+                # 先对亮度通道降噪，避免锐化放大噪声
+                with metrics.timer('preprocess.denoise'):
+                    l = cv2.fastNlMeansDenoising(l, None, 10, 5, 11)
+
             # 自适应对比度增强
-            lab = cv2.cvtColor(image, cv2.COLOR_RGB2LAB)
-            l, a, b = cv2.split(lab)
             clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8,8))
-            l = clahe.apply(l)
-            lab = cv2.merge((l,a,b))
-            image = cv2.cvtColor(lab, cv2.COLOR_LAB2RGB)
+            clahe.apply(l, dst=l)
+            cv2.insertChannel(l, lab, 0)
+            image = cv2.cvtColor(lab, cv2.COLOR_LAB2RGB, dst=lab)
             
             # 锐化处理
-            kernel = np.array([[-1,-1,-1],
-                             [-1, 9,-1],
-                             [-1,-1,-1]])
-            image = cv2.filter2D(image, -1, kernel)
+            cv2.filter2D(image, -1, ImageProcessor.SHARPEN_KERNEL, dst=image)
             
             # 降噪
-            image = cv2.fastNlMeansDenoisingColored(image, None, 10, 10, 7, 21)
+            if denoise == 'quality':
+                with metrics.timer('preprocess.denoise'):
+                    image = cv2.fastNlMeansDenoisingColored(image, None, 10, 10, 7, 21)
             
             return image
             
         except Exception as e:
             logging.error(f"图片预处理失败: {str(e)}")
             return image
+
+    @staticmethod
+    def _preprocess_gray(image: np.ndarray) -> np.ndarray:
+        """fast档位：只处理灰度图，输出三通道以保持与其他档位一致"""
+        gray = ImagePlanes(image).gray
+        gray = ImageProcessor._ensure_min_height(gray)
+
+        # 中值滤波生成新的缓冲区，之后的步骤都在其上原地完成
+        with metrics.timer('preprocess.denoise'):
+            gray = cv2.medianBlur(gray, 3)
+        clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8,8))
+        clahe.apply(gray, dst=gray)
+        cv2.filter2D(gray, -1, ImageProcessor.SHARPEN_KERNEL, dst=gray)
+        return cv2.cvtColor(gray, cv2.COLOR_GRAY2RGB)
@@ -0,0 +1,264 @@
+import time
+import asyncio
+import hashlib
+import logging
+from abc import ABC, abstractmethod
+from typing import Optional, Dict, Any, List, Tuple
+
+import cv2
+import httpx
+import numpy as np
+
+from processors.image_processor import ImageProcessor
+from utils.metrics import metrics
+from utils.streaming import PartialCallback
+
+try:
+    import pytesseract
+except ImportError:
+    pytesseract = None
+
+
+class OCRBackend(ABC):
+    """OCR后端接口
+
+    识别分为两步：prepare 在线程池中完成缩放、编码等CPU工作，返回的数据不再引用页面像素；
+    arecognize 在事件循环中完成识别，受 OCR_CONCURRENCY 限制。
+    未实现全部抽象方法的后端无法实例化，在创建时而不是处理中途报错。
+    """
+
+    name = 'base'
+
+    def bind_async_client(self, http_client: httpx.AsyncClient):
+        """绑定共享的异步HTTP连接池，本地后端无需连接"""
+
+    @abstractmethod
+    def cache_params(self) -> Dict[str, Any]:
+        """返回影响OCR结果的参数，用于构造缓存键"""
+
+    @abstractmethod
+    def prepare(self, image: np.ndarray) -> Any:
+        """准备识别所需的数据（在线程池中执行）"""
+
+    @abstractmethod
+    async def arecognize(self, payload: Any, on_partial: Optional[PartialCallback] = None) -> str:
+        """识别prepare返回的数据
+
+        识别失败时抛出异常，由流水线把页面计为失败；页面上没有文字时返回空字符串。
+        支持流式输出的后端在接收过程中以目前为止的全部文本调用on_partial。
+        """
+
+    @abstractmethod
+    def process_image(self, image: np.ndarray) -> str:
+        """同步识别单张图片"""
+
+    def upload_summary(self) -> str:
+        """上传数据量统计"""
+        pages = metrics.counter('upload.pages')
+        if not pages:
+            return "未上传任何页面"
+        input_bytes = metrics.counter('upload.input_bytes')
+        sent_bytes = metrics.counter('upload.sent_bytes')
+        saved = 1 - sent_bytes / max(input_bytes, 1)
+        return (f"上传 {pages:.0f} 页，共 {sent_bytes / 1024 / 1024:.2f} MB"
+                f"（原始像素 {input_bytes / 1024 / 1024:.2f} MB，节省 {saved:.1%}）")
+
+
+class LocalOCRBackend(OCRBackend):
+    """在本机CPU上识别的后端，识别在线程中执行，并给出识别置信度"""
+
+    def prepare(self, image: np.ndarray) -> np.ndarray:
+        # 复制为独立的灰度图，页面所在的共享内存随后即被释放
+        if len(image.shape) == 2:
+            return image.copy()
+        return cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+
+    @abstractmethod
+    def _recognize(self, gray: np.ndarray) -> Tuple[str, float]:
+        """识别灰度图，返回 (文本, 置信度0-100)，失败时抛出异常"""
+
+    def recognize(self, gray: np.ndarray) -> Tuple[str, float]:
+        """识别灰度图，返回 (文本, 置信度0-100)"""
+        try:
+            with metrics.timer('ocr.local'):
+                return self._recognize(gray)
+        except Exception as e:
+            logging.error(f"本地OCR处理失败: {str(e)}")
+            return "", 0.0
+
+    async def arecognize(self, payload: np.ndarray, on_partial: Optional[PartialCallback] = None) -> str:
+        loop = asyncio.get_running_loop()
+        with metrics.timer('ocr.local'):
+            text, _ = await loop.run_in_executor(None, self._recognize, payload)
+        return text
+
+    def process_image(self, image: np.ndarray) -> str:
+        return self.recognize(self.prepare(image))[0]
+
+
+class TesseractOCRBackend(LocalOCRBackend):
+    """使用Tesseract的本地OCR后端，适合版面整齐的印刷体页面"""
+
+    name = 'tesseract'
+
+    def __init__(self, lang: str = 'chi_sim+eng', tesseract_config: str = '--psm 6'):
+        """初始化
+
+        Args:
+            lang: Tesseract语言包
+            tesseract_config: 传给Tesseract的额外参数
+        """
+        if pytesseract is None:
+            raise ImportError("使用tesseract后端需要安装pytesseract和Tesseract程序")
+        self.lang = lang
+        self.tesseract_config = tesseract_config
+        self.version = str(pytesseract.get_tesseract_version())
+
+    def cache_params(self) -> Dict[str, Any]:
+        return {'backend': self.name, 'lang': self.lang, 'config': self.tesseract_config,
+                'version': self.version}
+
+    @staticmethod
+    def _join(words: List[str]) -> str:
+        """拼接一行中的词，只在两个西文词之间加空格"""
+        line = ''
+        for word in words:
+            if line and line[-1].isascii() and line[-1].isalnum() and word[0].isascii() and word[0].isalnum():
+                line += ' '
+            line += word
+        return line
+
+    def _recognize(self, gray: np.ndarray) -> Tuple[str, float]:
+        data = pytesseract.image_to_data(gray, lang=self.lang, config=self.tesseract_config,
+                                         output_type=pytesseract.Output.DICT)
+        lines: Dict[Tuple[int, int, int], List[str]] = {}
+        weighted = 0.0
+        chars = 0
+        for i, word in enumerate(data['text']):
+            word = word.strip()
+            confidence = float(data['conf'][i])
+            if not word or confidence < 0:
+                continue
+            key = (data['block_num'][i], data['par_num'][i], data['line_num'][i])
+            lines.setdefault(key, []).append(word)
+            weighted += confidence * len(word)
+            chars += len(word)
+
+        parts = []
+        paragraph = None
+        for key, words in lines.items():
+            # 不同段落之间空一行
+            if paragraph is not None and key[:2] != paragraph:
+                parts.append('')
+            paragraph = key[:2]
+            parts.append(self._join(words))
+        return '\n'.join(parts), (weighted / chars if chars else 0.0)
+
+
+class FakeOCRBackend(LocalOCRBackend):
+    """不做真实识别的后端，用于基准测试和离线运行流水线
+
+    返回由页面内容决定的固定文本，可模拟识别延迟。
+    """
+
+    name = 'fake'
+
+    def __init__(self, latency_ms: float = 0, confidence: float = 100.0):
+        """初始化
+
+        Args:
+            latency_ms: 每页模拟的识别耗时（毫秒）
+            confidence: 返回的识别置信度
+        """
+        self.latency_ms = latency_ms
+        self.confidence = confidence
+
+    def cache_params(self) -> Dict[str, Any]:
+        return {'backend': self.name}
+
+    def _recognize(self, gray: np.ndarray) -> Tuple[str, float]:
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        digest = hashlib.blake2b(np.ascontiguousarray(gray).data, digest_size=8).hexdigest()
+        height, width = gray.shape[:2]
+        return f"### 页面 {digest}\n\n尺寸 {width}x{height}\n\n- 模拟的OCR文本", self.confidence
+
+
+class RoutedOCRBackend(OCRBackend):
+    """按页面难度在本地后端和远程API之间路由
+
+    先在缩略图上估计版面特征，干净、行距整齐的页面交给本地后端，
+    其余页面（通常是手写笔记）直接上传远程API；本地识别置信度过低或结果为空时再升级到远程API。
+    """
+
+    name = 'routed'
+
+    def __init__(self, local: LocalOCRBackend, remote: OCRBackend, max_noise: float = 3.0,
+                 min_line_gap: float = 0.15, max_height_cv: float = 0.8, min_confidence: float = 80.0):
+        """初始化
+
+        Args:
+            local: 处理简单页面的本地后端
+            remote: 处理困难页面的远程后端
+            max_noise: 交给本地后端的页面的最大噪声估计
+            min_line_gap: 交给本地后端的页面文字区域内空白行的最小占比
+            max_height_cv: 交给本地后端的页面文字高度的最大变异系数
+            min_confidence: 本地识别结果的最低置信度，低于该值时升级到远程后端
+        """
+        self.local = local
+        self.remote = remote
+        self.rules = {
+            'max_noise': max_noise,
+            'min_line_gap': min_line_gap,
+            'max_height_cv': max_height_cv,
+            'min_confidence': min_confidence,
+        }
+
+    def bind_async_client(self, http_client: httpx.AsyncClient):
+        self.remote.bind_async_client(http_client)
+
+    def cache_params(self) -> Dict[str, Any]:
+        return {'backend': self.name, 'rules': self.rules,
+                'local': self.local.cache_params(), 'remote': self.remote.cache_params()}
+
+    def is_easy(self, image: np.ndarray) -> bool:
+        """页面是否适合交给本地后端"""
+        features = ImageProcessor.page_features(image)
+        return (features['ink_ratio'] > 0
+                and features['noise'] <= self.rules['max_noise']
+                and features['line_gap_ratio'] >= self.rules['min_line_gap']
+                and features['height_cv'] <= self.rules['max_height_cv'])
+
+    def prepare(self, image: np.ndarray) -> Tuple[str, Any]:
+        with metrics.timer('ocr.route'):
+            easy = self.is_easy(image)
+        if easy:
+            metrics.increment('ocr.routed_local')
+            return 'local', self.local.prepare(image)
+        metrics.increment('ocr.routed_remote')
+        return 'remote', self.remote.prepare(image)
+
+    def _accept(self, text: str, confidence: float) -> bool:
+        if text.strip() and confidence >= self.rules['min_confidence']:
+            return True
+        metrics.increment('ocr.escalated')
+        return False
+
+    async def arecognize(self, payload: Tuple[str, Any], on_partial: Optional[PartialCallback] = None) -> str:
+        route, data = payload
+        if route == 'remote':
+            return await self.remote.arecognize(data, on_partial)
+        loop = asyncio.get_running_loop()
+        text, confidence = await loop.run_in_executor(None, self.local.recognize, data)
+        if self._accept(text, confidence):
+            return text
+        messages = await loop.run_in_executor(None, self.remote.prepare, data)
+        return await self.remote.arecognize(messages, on_partial)
+
+    def process_image(self, image: np.ndarray) -> str:
+        if not self.is_easy(image):
+            return self.remote.process_image(image)
+        text, confidence = self.local.recognize(self.local.prepare(image))
+        if self._accept(text, confidence):
+            return text
+        return self.remote.process_image(image)
@@ -1,54 +1,227 @@
+import math
 import base64
 import logging
-from typing import Optional
-from openai import OpenAI
+from typing import Optional, Dict, Any, List, Tuple
+import httpx
+from openai import OpenAI, AsyncOpenAI
+from processors.ocr_backends import OCRBackend
+from utils.rate_limiter import ApiGuard
+from utils.metrics import metrics
+from utils.streaming import PartialCallback, collect_stream, acollect_stream
 import cv2
 import numpy as np
 from io import BytesIO
 from PIL import Image
 
-class OCRProcessor:
-    def __init__(self, api_key: str, base_url: str = "https://dashscope.aliyuncs.com/compatible-mode/v1"):
+class OCRProcessor(OCRBackend):
+    """通过OpenAI兼容接口调用远程视觉模型的OCR后端"""
+
+    name = 'remote'
+    DEFAULT_MODEL = "qwen-vl-ocr"
+    PROMPT = "Read all the text in the image."
+    MIN_PIXELS = 28 * 28 * 4
+    MAX_PIXELS = 28 * 28 * 1280
+
+    # 上传前的图片压缩配置
+    DEFAULT_UPLOAD_CONFIG = {
+        'MAX_PIXELS': MAX_PIXELS,     # 客户端缩放到的像素上限，与服务端一致
+        'FORMAT': 'jpeg',             # jpeg 或 webp
+        'QUALITY': 90,                # 初始编码质量
+        'MIN_QUALITY': 60,            # 为满足目标大小可降到的最低质量
+        'TARGET_KB': 400,             # 目标上传大小（KB）
+        'GRAYSCALE': 'auto',          # auto / true / false，auto时对低饱和度的页面使用灰度
+        'SATURATION_THRESHOLD': 20,   # auto模式下判定为黑白页面的平均饱和度阈值
+    }
+    MIME_TYPES = {'jpeg': 'image/jpeg', 'webp': 'image/webp'}
+    ENCODE_PARAMS = {'jpeg': ('.jpg', cv2.IMWRITE_JPEG_QUALITY), 'webp': ('.webp', cv2.IMWRITE_WEBP_QUALITY)}
+
+    def __init__(self, api_key: str, base_url: str = "https://dashscope.aliyuncs.com/compatible-mode/v1",
+                 guard: Optional[ApiGuard] = None, upload_config: Optional[Dict[str, Any]] = None,
+                 model: Optional[str] = None, stream: bool = False, partial_interval: float = 0.5):
+        """初始化OCR处理器
+
+        Args:
+            api_key: API密钥
+            base_url: API基础URL
+            model: 模型名称，默认使用 DEFAULT_MODEL
+            stream: 是否以流式方式接收识别结果
+            partial_interval: 流式接收时两次部分结果回调之间的最短间隔（秒）
+            guard: 限流、重试与熔断控制，不指定则直接调用API
+            upload_config: 上传前的缩放与编码配置，缺省项使用DEFAULT_UPLOAD_CONFIG
+        """
+        self.upload_config = {**self.DEFAULT_UPLOAD_CONFIG, **(upload_config or {})}
+        if self.upload_config['FORMAT'] not in self.MIME_TYPES:
+            raise ValueError(f"不支持的上传格式: {self.upload_config['FORMAT']}")
+
+        self.api_key = api_key
+        self.base_url = base_url
+        self.guard = guard
         self.client = OpenAI(
             api_key=api_key,
-            base_url=base_url
+            base_url=base_url,
+            max_retries=self._client_max_retries()
         )
+        self.async_client = None
+        self.model = model or self.DEFAULT_MODEL
+        self.stream = stream
+        self.partial_interval = partial_interval
 
-    def process_image(self, image: np.ndarray) -> str:
-        """处理单张图片并返回OCR结果"""
-        try:
-            # 将OpenCV图片转换为bytes
-            success, buffer = cv2.imencode('.jpg', image, [int(cv2.IMWRITE_JPEG_QUALITY), 100])
+    def bind_async_client(self, http_client: httpx.AsyncClient):
+        """绑定共享的异步HTTP连接池"""
+        self.async_client = AsyncOpenAI(
+            api_key=self.api_key,
+            base_url=self.base_url,
+            http_client=http_client,
+            max_retries=self._client_max_retries()
+        )
+
+    def _client_max_retries(self) -> int:
+        """由ApiGuard负责重试时关闭客户端自带的重试"""
+        return 0 if self.guard else 2
+
+    def cache_params(self) -> Dict[str, Any]:
+        """返回影响OCR结果的参数，用于构造缓存键"""
+        return {
+            'backend': self.name,
+            'model': self.model,
+            'prompt': self.PROMPT,
+            'min_pixels': self.MIN_PIXELS,
+            'max_pixels': self.MAX_PIXELS,
+            'upload': self.upload_config,
+        }
+
+    @staticmethod
+    def _record_usage(completion):
+        """记录token用量"""
+        usage = getattr(completion, 'usage', None)
+        if usage:
+            metrics.increment('ocr.prompt_tokens', usage.prompt_tokens or 0)
+            metrics.increment('ocr.completion_tokens', usage.completion_tokens or 0)
+
+    def _call(self, func):
+        with metrics.timer('ocr'):
+            completion = self.guard.call(func) if self.guard else func()
+        self._record_usage(completion)
+        return completion
+
+    async def _acall(self, func):
+        with metrics.timer('ocr'):
+            completion = await (self.guard.acall(func) if self.guard else func())
+        self._record_usage(completion)
+        return completion
+
+    def _use_grayscale(self, image: np.ndarray) -> bool:
+        """判断页面是否适合以灰度上传（手写笔记通常接近黑白）"""
+        mode = str(self.upload_config['GRAYSCALE']).lower()
+        if len(image.shape) == 2 or mode == 'true':
+            return True
+        if mode != 'auto':
+            return False
+        # 在缩略图上估计平均饱和度
+        thumb = cv2.resize(image, (64, 64), interpolation=cv2.INTER_AREA)
+        saturation = cv2.cvtColor(thumb, cv2.COLOR_RGB2HSV)[:, :, 1]
+        return float(saturation.mean()) < self.upload_config['SATURATION_THRESHOLD']
+
+    def prepare_upload(self, image: np.ndarray) -> Tuple[bytes, str]:
+        """缩放并编码待上传的页面，返回 (编码后的数据, MIME类型)
+
+        先在客户端把图片缩放到模型的像素上限以内，
+        再从初始质量开始逐步降低，直到编码结果不超过目标大小或达到最低质量。
+        """
+        with metrics.timer('encode'):
+            return self._prepare_upload(image)
+
+    def _prepare_upload(self, image: np.ndarray) -> Tuple[bytes, str]:
+        input_bytes = image.nbytes
+
+        # 缩放到像素上限以内
+        height, width = image.shape[:2]
+        max_pixels = self.upload_config['MAX_PIXELS']
+        if height * width > max_pixels:
+            scale = math.sqrt(max_pixels / (height * width))
+            image = cv2.resize(image, (max(int(width * scale), 1), max(int(height * scale), 1)),
+                               interpolation=cv2.INTER_AREA)
+
+        if self._use_grayscale(image) and len(image.shape) == 3:
+            image = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+
+        fmt = self.upload_config['FORMAT']
+        extension, quality_flag = self.ENCODE_PARAMS[fmt]
+        target_bytes = self.upload_config['TARGET_KB'] * 1024
+        quality = self.upload_config['QUALITY']
+        while True:
+            success, buffer = cv2.imencode(extension, image, [int(quality_flag), int(quality)])
             if not success:
                 raise ValueError("图片编码失败")
-            
-            # 转换为base64
-            image_base64 = base64.b64encode(buffer).decode('utf-8')
-            
-            # 准备API请求
-            messages = [{
-                "role": "user",
-                "content": [
-                    {
-                        "type": "image_url",
-                        "image_url": {
-                            "url": f"data:image/jpeg;base64,{image_base64}"
-                        },
-                        "min_pixels": 28 * 28 * 4,
-                        "max_pixels": 28 * 28 * 1280
+            if buffer.nbytes <= target_bytes or quality <= self.upload_config['MIN_QUALITY']:
+                break
+            quality = max(quality - 10, self.upload_config['MIN_QUALITY'])
+
+        metrics.increment('upload.pages')
+        metrics.increment('upload.input_bytes', input_bytes)
+        metrics.increment('upload.sent_bytes', buffer.nbytes)
+        return buffer.tobytes(), self.MIME_TYPES[fmt]
+
+    def build_messages(self, image: np.ndarray) -> List[Dict[str, Any]]:
+        """将图片缩放、编码并构造API请求消息"""
+        data, mime_type = self.prepare_upload(image)
+        
+        # 转换为base64
+        image_base64 = base64.b64encode(data).decode('utf-8')
+        
+        return [{
+            "role": "user",
+            "content": [
+                {
+                    "type": "image_url",
+                    "image_url": {
+                        "url": f"data:{mime_type};base64,{image_base64}"
                     },
-                    {"type": "text", "text": "Read all the text in the image."}
-                ]
-            }]
+                    "min_pixels": self.MIN_PIXELS,
+                    "max_pixels": self.MAX_PIXELS
+                },
+                {"type": "text", "text": self.PROMPT}
+            ]
+        }]
+
+    def prepare(self, image: np.ndarray) -> List[Dict[str, Any]]:
+        return self.build_messages(image)
+
+    def _create(self, messages: List[Dict[str, Any]], on_partial: Optional[PartialCallback] = None):
+        """发送OCR请求；流式接收时边接收边回调部分结果"""
+        if not self.stream:
+            return self.client.chat.completions.create(model=self.model, messages=messages)
+        stream = self.client.chat.completions.create(
+            model=self.model, messages=messages, stream=True, stream_options={'include_usage': True}
+        )
+        return collect_stream(stream, 'ocr', on_partial, self.partial_interval)
+
+    async def _acreate(self, messages: List[Dict[str, Any]], on_partial: Optional[PartialCallback] = None):
+        """异步发送OCR请求，参数同 _create"""
+        if not self.stream:
+            return await self.async_client.chat.completions.create(model=self.model, messages=messages)
+        stream = await self.async_client.chat.completions.create(
+            model=self.model, messages=messages, stream=True, stream_options={'include_usage': True}
+        )
+        return await acollect_stream(stream, 'ocr', on_partial, self.partial_interval)
+
+    def process_image(self, image: np.ndarray, on_partial: Optional[PartialCallback] = None) -> str:
+        """处理单张图片并返回OCR结果"""
+        try:
+            # 准备API请求
+            messages = self.build_messages(image)
             
             # 调用API
-            completion = self.client.chat.completions.create(
-                model="qwen-vl-ocr",
-                messages=messages
-            )
+            completion = self._call(lambda: self._create(messages, on_partial))
             
             return completion.choices[0].message.content
             
         except Exception as e:
             logging.error(f"OCR处理失败: {str(e)}")
             return ""
+
+    async def arecognize(self, messages: List[Dict[str, Any]], on_partial: Optional[PartialCallback] = None) -> str:
+        """异步发送已编码的OCR请求，需先调用bind_async_client；请求失败时抛出异常"""
+        completion = await self._acall(lambda: self._acreate(messages, on_partial))
+        return completion.choices[0].message.content or ""
+
@@ -0,0 +1,105 @@
+import re
+import unicodedata
+from typing import Dict
+
+# 文本优化方式
+SKIP = 'skip'      # 不调用API，直接使用OCR文本
+LIGHT = 'light'    # 使用较便宜的模型和按文本长度收紧的max_tokens
+FULL = 'full'      # 完整的文本优化
+ENHANCE_MODES = (SKIP, LIGHT, FULL)
+
+
+class EnhancementClassifier:
+    """在调用文本优化API之前，用本地启发式规则估计OCR文本需要多少优化
+
+    - 几乎为空或只有一个标题的页面直接跳过
+    - 乱码、异常符号较多的页面做完整优化
+    - 已经是结构清晰的Markdown且没有断行的页面跳过
+    - 其余干净的文本降级为轻量优化
+    """
+
+    STRUCTURE_PATTERN = re.compile(r'^\s*(#{1,6}\s|[-*+]\s|\d+[.)、]\s?|>\s?|\|)')
+    SENTENCE_END = tuple('。！？；：.!?;:)）」』”"')
+    # 视为正常文本的Unicode类别：文字、数字、标点、数学符号、空白
+    NORMAL_CATEGORIES = ('L', 'N', 'P', 'Sm', 'Sc', 'Z')
+
+    def __init__(self, min_chars: int = 20, short_chars: int = 80, clean_noise_ratio: float = 0.02,
+                 full_noise_ratio: float = 0.08, clean_structure_ratio: float = 0.3,
+                 max_broken_ratio: float = 0.2):
+        """初始化
+
+        Args:
+            min_chars: 少于该字符数（不含空白）的页面视为空页，跳过优化
+            short_chars: 不超过两行且少于该字符数的页面视为只有标题，跳过优化
+            clean_noise_ratio: 异常字符占比不超过该值的文本视为干净
+            full_noise_ratio: 异常字符占比达到该值时做完整优化
+            clean_structure_ratio: Markdown结构行（标题、列表、引用、表格）占比达到该值且干净、
+                没有断行的文本跳过优化
+            max_broken_ratio: 视为没有断行时允许的断行占比
+        """
+        self.min_chars = min_chars
+        self.short_chars = short_chars
+        self.clean_noise_ratio = clean_noise_ratio
+        self.full_noise_ratio = full_noise_ratio
+        self.clean_structure_ratio = clean_structure_ratio
+        self.max_broken_ratio = max_broken_ratio
+
+    def params(self) -> Dict[str, float]:
+        return dict(self.__dict__)
+
+    @classmethod
+    def _is_noise(cls, char: str) -> bool:
+        if char == '\ufffd':
+            return True
+        return not unicodedata.category(char).startswith(cls.NORMAL_CATEGORIES)
+
+    def features(self, text: str) -> Dict[str, float]:
+        """计算文本的长度、字符类别占比与结构特征"""
+        lines = [line.strip() for line in text.splitlines()]
+        lines = [line for line in lines if line]
+        chars = sum(len(line) - line.count(' ') - line.count('\t') for line in lines)
+        features = {'chars': chars, 'lines': len(lines), 'cjk_ratio': 0.0, 'noise_ratio': 0.0,
+                    'short_line_ratio': 0.0, 'structure_ratio': 0.0, 'broken_ratio': 0.0}
+        if not chars:
+            return features
+
+        cjk = noise = 0
+        for line in lines:
+            for char in line:
+                if char in ' \t':
+                    continue
+                if '\u3400' <= char <= '\u9fff':
+                    cjk += 1
+                elif self._is_noise(char):
+                    noise += 1
+        # 只有一两个字符的行通常是识别出的污点或边缘杂质
+        short_lines = sum(1 for line in lines if len(line) <= 2 and not line.isdigit())
+        structured = [bool(self.STRUCTURE_PATTERN.match(line)) for line in lines]
+        # 断行：未以句末标点结束、且下一行是正文续行的行，说明段落被OCR按版面折断
+        broken = sum(
+            1 for i in range(len(lines) - 1)
+            if not structured[i] and not structured[i + 1] and not lines[i].endswith(self.SENTENCE_END)
+        )
+
+        features['cjk_ratio'] = cjk / chars
+        features['noise_ratio'] = (noise + short_lines) / chars
+        features['short_line_ratio'] = short_lines / len(lines)
+        features['structure_ratio'] = sum(structured) / len(lines)
+        features['broken_ratio'] = broken / max(len(lines) - 1, 1)
+        return features
+
+    def classify(self, text: str) -> str:
+        """返回文本的优化方式：SKIP / LIGHT / FULL"""
+        features = self.features(text)
+        if features['chars'] < self.min_chars:
+            return SKIP
+        if features['noise_ratio'] >= self.full_noise_ratio:
+            return FULL
+        if features['lines'] <= 2 and features['chars'] < self.short_chars:
+            return SKIP
+        if features['noise_ratio'] > self.clean_noise_ratio:
+            return FULL
+        if (features['structure_ratio'] >= self.clean_structure_ratio
+                and features['broken_ratio'] <= self.max_broken_ratio):
+            return SKIP
+        return LIGHT
@@ -1,9 +1,40 @@
+import re
 import logging
-from typing import Optional
-from openai import OpenAI
+from typing import Optional, Dict, Any, List
+import httpx
+from openai import OpenAI, AsyncOpenAI
+from processors.text_classifier import LIGHT, FULL
+from utils.rate_limiter import ApiGuard
+from utils.metrics import metrics
+from utils.streaming import PartialCallback, collect_stream, acollect_stream
 
 class TextProcessor:
-    def __init__(self, api_key: str = None, base_url: str = None, model: str = "deepseek-chat", temperature: float = 0.3, max_tokens: int = 2000):
+    SYSTEM_PROMPT = "你是一个专业的笔记整理助手。你需要帮助整理和优化OCR识别出的课堂笔记内容，使其更加清晰、结构化，并保持原有的重点标记。请注意，你应该只输出整理后的笔记内容，不要包含任何其他信息。"
+    USER_PROMPT = """请帮我整理以下课堂笔记内容，要求：
+1. 保持原有的结构和格式
+2. 保留所有重点标记
+3. 修正明显的OCR错误（比如不合理的人名、称呼和名词等）
+4. 优化段落和缩进
+5. 确保数学公式和符号的正确性
+
+笔记内容：
+{text}"""
+    BATCH_USER_PROMPT = """请分别整理以下 {count} 页课堂笔记内容，要求：
+1. 保持原有的结构和格式
+2. 保留所有重点标记
+3. 修正明显的OCR错误（比如不合理的人名、称呼和名词等）
+4. 优化段落和缩进
+5. 确保数学公式和符号的正确性
+6. 每页内容之前原样输出该页的分隔行（如 <<<PAGE 1>>>），不要合并、拆分或省略任何一页
+
+{pages}"""
+    PAGE_DELIMITER = "<<<PAGE {index}>>>"
+    PAGE_DELIMITER_PATTERN = re.compile(r'^[ \t]*<<<PAGE (\d+)>>>[ \t]*$', re.MULTILINE)
+    CJK_PATTERN = re.compile(r'[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uff00-\uffef]')
+
+    def __init__(self, api_key: str = None, base_url: str = None, model: str = "deepseek-chat", temperature: float = 0.3, max_tokens: int = 2000,
+                 guard: Optional[ApiGuard] = None, light_model: Optional[str] = None, stream: bool = False,
+                 partial_interval: float = 0.5):
         """初始化文本处理器
         
         Args:
@@ -12,48 +43,245 @@ class TextProcessor:
             model: 使用的模型名称
             temperature: 生成的随机性（0-1）
             max_tokens: 最大生成token数
+            guard: 限流、重试与熔断控制，不指定则直接调用API
+            light_model: 轻量优化使用的模型，不指定则与model相同
+            stream: 是否以流式方式接收单页优化结果
+            partial_interval: 流式接收时两次部分结果回调之间的最短间隔（秒）
         """
         if not api_key:
             raise ValueError("必须提供api_key")
         if not base_url:
             raise ValueError("必须提供base_url")
             
+        self.api_key = api_key
+        self.base_url = base_url
+        self.guard = guard
         self.client = OpenAI(
             api_key=api_key,
-            base_url=base_url
+            base_url=base_url,
+            max_retries=self._client_max_retries()
         )
+        self.async_client = None
         
         self.model = model
+        self.light_model = light_model or model
         self.temperature = temperature
         self.max_tokens = max_tokens
+        self.stream = stream
+        self.partial_interval = partial_interval
 
-    def format_and_enhance(self, text: str) -> str:
-        """格式化和增强OCR的文本内容"""
-        try:
-            # 准备提示词
-            messages = [
-                {"role": "system", "content": "你是一个专业的笔记整理助手。你需要帮助整理和优化OCR识别出的课堂笔记内容，使其更加清晰、结构化，并保持原有的重点标记。请注意，你应该只输出整理后的笔记内容，不要包含任何其他信息。"},
-                {"role": "user", "content": f"""请帮我整理以下课堂笔记内容，要求：
-1. 保持原有的结构和格式
-2. 保留所有重点标记
-3. 修正明显的OCR错误（比如不合理的人名、称呼和名词等）
-4. 优化段落和缩进
-5. 确保数学公式和符号的正确性
+    def cache_params(self, mode: str = FULL, batch_max_tokens: Optional[int] = None) -> Dict[str, Any]:
+        """返回影响文本优化结果的参数，用于构造缓存键
 
-笔记内容：
-{text}"""}
-            ]
+        Args:
+            mode: 优化方式
+            batch_max_tokens: 多页合并优化时合并请求的输出上限，合并请求的结果另外缓存
+        """
+        params = {
+            'model': self.model,
+            'system_prompt': self.SYSTEM_PROMPT,
+            'user_prompt': self.USER_PROMPT,
+            'temperature': self.temperature,
+            'max_tokens': self.max_tokens,
+        }
+        if mode == LIGHT:
+            params.update(mode=mode, model=self.light_model)
+        if batch_max_tokens is not None:
+            params.update(batch_user_prompt=self.BATCH_USER_PROMPT, batch_max_tokens=batch_max_tokens)
+        return params
+
+    def _request_params(self, text: str, mode: str) -> Dict[str, Any]:
+        """按优化方式选择模型与max_tokens
+
+        轻量优化使用light_model，max_tokens收紧为输入文本估算token数的两倍左右。
+        """
+        if mode == LIGHT:
+            return {'model': self.light_model,
+                    'max_tokens': min(self.max_tokens, self.estimate_tokens(text) * 2 + 64)}
+        return {'model': self.model, 'max_tokens': self.max_tokens}
+
+    @staticmethod
+    def _truncated(completion, mode: str) -> bool:
+        """轻量优化的输出被max_tokens截断时需要改用完整优化"""
+        if mode == LIGHT and completion.choices[0].finish_reason == 'length':
+            logging.warning("轻量文本优化的输出被截断，改用完整优化")
+            metrics.increment('enhance.light_truncated')
+            return True
+        return False
+
+    @classmethod
+    def _split_batch_completion(cls, completion, count: int) -> Optional[List[str]]:
+        """拆分合并优化的响应；输出被max_tokens截断时最后一页可能不完整，同样返回None"""
+        if completion.choices[0].finish_reason == 'length':
+            logging.warning(f"合并优化的输出被截断，退回逐页处理（{count} 页）")
+            metrics.increment('enhance.batch_truncated')
+            return None
+        results = cls.split_batch_response(completion.choices[0].message.content, count)
+        if results is None:
+            logging.warning(f"合并优化的响应无法按页拆分，退回逐页处理（{count} 页）")
+        return results
+
+    def bind_async_client(self, http_client: httpx.AsyncClient):
+        """绑定共享的异步HTTP连接池"""
+        self.async_client = AsyncOpenAI(
+            api_key=self.api_key,
+            base_url=self.base_url,
+            http_client=http_client,
+            max_retries=self._client_max_retries()
+        )
+
+    def _client_max_retries(self) -> int:
+        """由ApiGuard负责重试时关闭客户端自带的重试"""
+        return 0 if self.guard else 2
+
+    @staticmethod
+    def _record_usage(completion):
+        """记录token用量"""
+        usage = getattr(completion, 'usage', None)
+        if usage:
+            metrics.increment('enhance.prompt_tokens', usage.prompt_tokens or 0)
+            metrics.increment('enhance.completion_tokens', usage.completion_tokens or 0)
+
+    def _call(self, func):
+        with metrics.timer('enhance'):
+            completion = self.guard.call(func) if self.guard else func()
+        self._record_usage(completion)
+        return completion
+
+    async def _acall(self, func):
+        with metrics.timer('enhance'):
+            completion = await (self.guard.acall(func) if self.guard else func())
+        self._record_usage(completion)
+        return completion
 
+    def _build_messages(self, text: str) -> List[Dict[str, str]]:
+        """构造文本优化的提示词"""
+        return [
+            {"role": "system", "content": self.SYSTEM_PROMPT},
+            {"role": "user", "content": self.USER_PROMPT.format(text=text)}
+        ]
+
+    @classmethod
+    def estimate_tokens(cls, text: str) -> int:
+        """粗略估算文本的token数：中日韩字符按1个token，其余字符按4个字符1个token"""
+        cjk = len(cls.CJK_PATTERN.findall(text))
+        return cjk + (len(text) - cjk) // 4 + 1
+
+    def _build_batch_messages(self, texts: List[str]) -> List[Dict[str, str]]:
+        """构造多页合并优化的提示词"""
+        pages = '\n\n'.join(
+            f"{self.PAGE_DELIMITER.format(index=i + 1)}\n{text}" for i, text in enumerate(texts)
+        )
+        return [
+            {"role": "system", "content": self.SYSTEM_PROMPT},
+            {"role": "user", "content": self.BATCH_USER_PROMPT.format(count=len(texts), pages=pages)}
+        ]
+
+    @classmethod
+    def split_batch_response(cls, content: str, count: int) -> Optional[List[str]]:
+        """按分隔行拆分多页响应，页码不连续或有空页时返回None"""
+        parts = cls.PAGE_DELIMITER_PATTERN.split(content or '')
+        # parts: [分隔行之前的内容, 页码1, 内容1, 页码2, 内容2, ...]
+        indices = [int(index) for index in parts[1::2]]
+        texts = [text.strip() for text in parts[2::2]]
+        if indices != list(range(1, count + 1)) or not all(texts):
+            return None
+        return texts
+
+    def _create(self, text: str, mode: str, on_partial: Optional[PartialCallback] = None):
+        """发送单页优化请求；流式接收时边接收边回调部分结果"""
+        params = dict(messages=self._build_messages(text), temperature=self.temperature,
+                      **self._request_params(text, mode))
+        if not self.stream:
+            return self.client.chat.completions.create(**params)
+        stream = self.client.chat.completions.create(**params, stream=True, stream_options={'include_usage': True})
+        return collect_stream(stream, 'enhance', on_partial, self.partial_interval)
+
+    async def _acreate(self, text: str, mode: str, on_partial: Optional[PartialCallback] = None):
+        """异步发送单页优化请求，参数同 _create"""
+        params = dict(messages=self._build_messages(text), temperature=self.temperature,
+                      **self._request_params(text, mode))
+        if not self.stream:
+            return await self.async_client.chat.completions.create(**params)
+        stream = await self.async_client.chat.completions.create(
+            **params, stream=True, stream_options={'include_usage': True}
+        )
+        return await acollect_stream(stream, 'enhance', on_partial, self.partial_interval)
+
+    def format_and_enhance(self, text: str, mode: str = FULL,
+                           on_partial: Optional[PartialCallback] = None) -> Optional[str]:
+        """格式化和增强OCR的文本内容
+
+        Args:
+            text: OCR文本
+            mode: 优化方式，LIGHT 使用较便宜的模型和更小的max_tokens
+            on_partial: 流式接收时的部分结果回调
+
+        Returns:
+            优化后的文本；处理失败时返回None，由调用方决定重试或按失败处理
+        """
+        try:
             # 调用API
-            completion = self.client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                temperature=self.temperature,
-                max_tokens=self.max_tokens
-            )
+            completion = self._call(lambda: self._create(text, mode, on_partial))
+            if self._truncated(completion, mode):
+                return self.format_and_enhance(text, on_partial=on_partial)
+
+            return completion.choices[0].message.content
+
+        except Exception as e:
+            logging.error(f"文本处理失败: {str(e)}")
+            return None
+
+    async def aformat_and_enhance(self, text: str, mode: str = FULL,
+                                  on_partial: Optional[PartialCallback] = None) -> Optional[str]:
+        """异步格式化和增强OCR的文本内容，需先调用bind_async_client"""
+        try:
+            completion = await self._acall(lambda: self._acreate(text, mode, on_partial))
+            if self._truncated(completion, mode):
+                return await self.aformat_and_enhance(text, on_partial=on_partial)
 
             return completion.choices[0].message.content
 
         except Exception as e:
             logging.error(f"文本处理失败: {str(e)}")
-            return text  # 如果处理失败，返回原文本
+            return None
+
+    def format_and_enhance_batch(self, texts: List[str], max_tokens: Optional[int] = None) -> List[Optional[str]]:
+        """在一次请求中格式化多页OCR文本，拆分失败时退回逐页处理；逐页处理失败的页面为None"""
+        if len(texts) == 1:
+            return [self.format_and_enhance(texts[0])]
+        try:
+            completion = self._call(lambda: self.client.chat.completions.create(
+                model=self.model,
+                messages=self._build_batch_messages(texts),
+                temperature=self.temperature,
+                max_tokens=max_tokens or self.max_tokens * len(texts)
+            ))
+            results = self._split_batch_completion(completion, len(texts))
+            if results is not None:
+                return results
+        except Exception as e:
+            logging.error(f"合并文本处理失败，退回逐页处理: {str(e)}")
+        return [self.format_and_enhance(text) for text in texts]
+
+    async def aformat_and_enhance_batch(self, texts: List[str],
+                                        max_tokens: Optional[int] = None) -> List[Optional[str]]:
+        """异步在一次请求中格式化多页OCR文本，拆分失败时退回逐页处理；逐页处理失败的页面为None
+
+        逐页处理时依次发送请求，占用的并发数与合并请求相同，不超出调用方的并发上限。
+        """
+        if len(texts) == 1:
+            return [await self.aformat_and_enhance(texts[0])]
+        try:
+            completion = await self._acall(lambda: self.async_client.chat.completions.create(
+                model=self.model,
+                messages=self._build_batch_messages(texts),
+                temperature=self.temperature,
+                max_tokens=max_tokens or self.max_tokens * len(texts)
+            ))
+            results = self._split_batch_completion(completion, len(texts))
+            if results is not None:
+                return results
+        except Exception as e:
+            logging.error(f"合并文本处理失败，退回逐页处理: {str(e)}")
+        return [await self.aformat_and_enhance(text) for text in texts]
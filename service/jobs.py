@@ -0,0 +1,253 @@
+import time
+import uuid
+import threading
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Any
+
+# 任务状态
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+TIMEOUT = 'timeout'
+FINISHED_STATES = (DONE, FAILED, TIMEOUT)
+
+
+class QueueFullError(Exception):
+    """排队的任务已达上限，请求被拒绝"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+@dataclass
+class Job:
+    """一次图片识别请求"""
+    id: str
+    client: str
+    image_path: str
+    created_at: float
+    deadline: float
+    status: str = QUEUED
+    entries: List[str] = field(default_factory=list)
+    failed_pages: int = 0
+    error: Optional[str] = None
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    # 正在流式接收的页面：page、stage（ocr / enhance）与目前为止的 text
+    partial: Optional[Dict[str, Any]] = None
+    # 每次状态变化加一，用于长轮询和事件流判断是否有更新
+    version: int = 0
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATES
+
+    @property
+    def markdown(self) -> str:
+        return ''.join(self.entries)
+
+    def to_dict(self, position: Optional[int] = None) -> Dict[str, Any]:
+        data = {
+            'id': self.id,
+            'status': self.status,
+            'pages': len(self.entries),
+            'failed_pages': self.failed_pages,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+        }
+        if position is not None:
+            data['position'] = position
+        if self.partial is not None:
+            data['partial'] = {'page': self.partial['page'], 'stage': self.partial['stage'],
+                               'chars': len(self.partial['text'])}
+        if self.error:
+            data['error'] = self.error
+        return data
+
+
+class JobStore:
+    """线程安全的任务登记表与按客户端公平的排队
+
+    每个客户端一个先进先出队列，出队时在客户端之间轮转，
+    一个客户端一次提交大量图片不会让其他客户端长时间等待。
+    HTTP处理线程提交和查询任务，事件循环线程取出任务并更新进度。
+    """
+
+    def __init__(self, max_queued: int, max_per_client: int, job_timeout: float, result_ttl: float,
+                 clock: Callable[[], float] = time.time):
+        """初始化
+
+        Args:
+            max_queued: 所有客户端合计的最大排队任务数
+            max_per_client: 单个客户端的最大排队任务数
+            job_timeout: 任务从提交到完成的最长时间（秒），超时的任务不再返回结果
+            result_ttl: 已结束的任务保留多久（秒）供客户端取回结果
+            clock: 返回当前时间戳的函数，截止时间和结果保留时间按它计算
+        """
+        self.max_queued = max_queued
+        self.max_per_client = max_per_client
+        self.job_timeout = job_timeout
+        self.result_ttl = result_ttl
+        self.clock = clock
+        self.jobs: Dict[str, Job] = {}
+        self.queues: 'OrderedDict[str, deque]' = OrderedDict()
+        self.queued = 0
+        self.cond = threading.Condition()
+
+    def create(self, client: str, image_path: str) -> Job:
+        """创建任务（尚未入队）"""
+        now = self.clock()
+        return Job(id=uuid.uuid4().hex, client=client, image_path=image_path,
+                   created_at=now, deadline=now + self.job_timeout)
+
+    def check_capacity(self, client: str):
+        """检查是否还能接受该客户端的任务，不能时抛出QueueFullError"""
+        with self.cond:
+            if self.queued >= self.max_queued:
+                raise QueueFullError("服务繁忙，排队任务已满", retry_after=5)
+            queue = self.queues.get(client)
+            if queue is not None and len(queue) >= self.max_per_client:
+                raise QueueFullError("该客户端排队的任务过多", retry_after=2)
+
+    def submit(self, job: Job):
+        """任务入队"""
+        with self.cond:
+            self.check_capacity(job.client)
+            self.jobs[job.id] = job
+            self.queues.setdefault(job.client, deque()).append(job)
+            self.queued += 1
+            self.cond.notify_all()
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self.cond:
+            return self.jobs.get(job_id)
+
+    def position(self, job: Job) -> Optional[int]:
+        """按轮转顺序估计任务前面还有多少个排队的任务"""
+        with self.cond:
+            if job.status != QUEUED:
+                return None
+            queue = self.queues.get(job.client)
+            if queue is None or job not in queue:
+                return None
+            rank = queue.index(job)
+            ahead = rank
+            before = True
+            for client, other in self.queues.items():
+                if client == job.client:
+                    before = False
+                    continue
+                ahead += min(len(other), rank + 1 if before else rank)
+            return ahead
+
+    def take(self, limit: int) -> List[Job]:
+        """按客户端轮转取出最多limit个任务并标记为运行中"""
+        now = self.clock()
+        taken = []
+        with self.cond:
+            while self.queues and len(taken) < limit:
+                client, queue = next(iter(self.queues.items()))
+                job = queue.popleft()
+                self.queued -= 1
+                if queue:
+                    self.queues.move_to_end(client)
+                else:
+                    del self.queues[client]
+                if now >= job.deadline:
+                    self._finish(job, TIMEOUT, "任务排队超时")
+                    continue
+                job.status = RUNNING
+                job.started_at = now
+                job.version += 1
+                taken.append(job)
+            if taken:
+                self.cond.notify_all()
+        return taken
+
+    def add_entry(self, job: Job, entry: str):
+        """追加一个页面的Markdown"""
+        with self.cond:
+            if job.finished:
+                return
+            job.entries.append(entry)
+            job.partial = None
+            job.version += 1
+            self.cond.notify_all()
+
+    def set_partial(self, job: Job, page: int, stage: str, text: str):
+        """更新正在流式接收的页面内容"""
+        with self.cond:
+            if job.finished:
+                return
+            job.partial = {'page': page, 'stage': stage, 'text': text}
+            job.version += 1
+            self.cond.notify_all()
+
+    def finish(self, job: Job, status: str, error: Optional[str] = None, failed_pages: int = 0):
+        """结束任务；已经结束（例如超时）的任务保持原状态"""
+        with self.cond:
+            if job.finished:
+                return
+            job.failed_pages = failed_pages
+            self._finish(job, status, error)
+            self.cond.notify_all()
+
+    def _finish(self, job: Job, status: str, error: Optional[str] = None):
+        job.status = status
+        job.error = error
+        job.finished_at = self.clock()
+        job.partial = None
+        job.version += 1
+        if status != DONE:
+            job.entries = []
+
+    def wait(self, job: Job, version: int, timeout: float) -> bool:
+        """等待任务状态发生变化
+
+        Returns:
+            超时前任务是否有更新
+        """
+        with self.cond:
+            return self.cond.wait_for(lambda: job.version != version, timeout)
+
+    def expire(self) -> List[Job]:
+        """标记超时的任务，并清理保留时间已过的已结束任务
+
+        Returns:
+            本次被标记为超时的排队中任务（调用方负责删除其上传文件）
+        """
+        now = self.clock()
+        expired = []
+        changed = False
+        with self.cond:
+            for job_id, job in list(self.jobs.items()):
+                if job.finished:
+                    if now - job.finished_at >= self.result_ttl:
+                        del self.jobs[job_id]
+                    continue
+                if now < job.deadline:
+                    continue
+                if job.status == QUEUED:
+                    queue = self.queues[job.client]
+                    queue.remove(job)
+                    self.queued -= 1
+                    if not queue:
+                        del self.queues[job.client]
+                    expired.append(job)
+                self._finish(job, TIMEOUT, "任务处理超时")
+                changed = True
+            if changed:
+                self.cond.notify_all()
+        return expired
+
+    def stats(self) -> Dict[str, int]:
+        with self.cond:
+            counts = {QUEUED: 0, RUNNING: 0, DONE: 0, FAILED: 0, TIMEOUT: 0}
+            for job in self.jobs.values():
+                counts[job.status] += 1
+            counts['clients'] = len(self.queues)
+            return counts
@@ -0,0 +1,431 @@
+import os
+import json
+import time
+import shutil
+import signal
+import asyncio
+import logging
+import threading
+from pathlib import Path
+from urllib.parse import urlsplit, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Dict, List, Optional, Any, Tuple
+
+from config import config
+from pipeline.async_engine import AsyncEngine
+from service.jobs import JobStore, Job, QueueFullError, DONE, FAILED, TIMEOUT
+from utils.file_handler import FileHandler
+from utils.metrics import metrics
+from utils.search_index import NoteSearchIndex
+
+
+class NoteOCRService:
+    """以HTTP服务方式运行NoteOCR
+
+    HTTP请求由线程池处理：上传的图片保存到临时目录后进入按客户端公平的任务队列。
+    事件循环中只有一个常驻的 AsyncEngine，HTTP连接池、OCR/文本优化客户端、
+    图像处理进程池和结果缓存在所有请求之间共享；调度协程每次按轮转顺序取出
+    最多 batch_size 个任务作为一批，最多 max_batches 批同时运行，每批使用一个分叉出的引擎，
+    一个慢任务不会挡住其他客户端的下一批。超时的任务立即取消其页面处理，不再消耗API额度。
+    近似重复页面只在同一客户端的任务之间去重，不会把一个客户端的文本返回给另一个客户端。
+    提供全文索引时，/search 接口在已输出的笔记中查询。
+    """
+
+    def __init__(self, note_ocr, host: str = '127.0.0.1', port: int = 8000, batch_size: int = 4,
+                 max_batches: int = 2, max_queued: int = 64, max_per_client: int = 8, max_upload_mb: float = 30,
+                 request_timeout: float = 30, job_timeout: float = 600, result_ttl: float = 3600,
+                 upload_dir: Optional[str] = None, search_index: Optional[NoteSearchIndex] = None,
+                 search_limit: int = 20):
+        """初始化
+
+        Args:
+            note_ocr: NoteOCR实例，提供共享的处理器与缓存
+            host: 监听地址
+            port: 监听端口
+            batch_size: 每批交给流水线的最大任务数
+            max_batches: 同时运行的最大批数
+            max_queued: 最大排队任务数
+            max_per_client: 单个客户端的最大排队任务数
+            max_upload_mb: 单张上传图片的大小上限（MB）
+            request_timeout: 单个HTTP请求的读写超时及长轮询的最长等待时间（秒）
+            job_timeout: 任务从提交到完成的最长时间（秒）
+            result_ttl: 已结束的任务结果保留时间（秒）
+            upload_dir: 上传图片的临时目录
+            search_index: 已输出笔记的全文索引
+            search_limit: /search 默认返回的最大页面数
+        """
+        self.note_ocr = note_ocr
+        self.host = host
+        self.port = port
+        self.batch_size = max(batch_size, 1)
+        self.max_batches = max(max_batches, 1)
+        self.max_upload_bytes = int(max_upload_mb * 1024 * 1024)
+        self.request_timeout = request_timeout
+        self.upload_dir = upload_dir or os.path.join(config.OUTPUT_DIR, '.uploads')
+        self.extensions = tuple(ext.lower() for ext in note_ocr.input_extensions())
+        self.store = JobStore(max_queued, max_per_client, job_timeout, result_ttl)
+        self.search_index = search_index
+        self.search_limit = search_limit
+
+        self.loop = None
+        self.wake = None
+        self.server = None
+        # 运行中的任务ID -> (任务, 处理该任务的引擎)
+        self.running: Dict[str, Tuple[Job, AsyncEngine]] = {}
+
+    def submit(self, client: str, filename: str, data: bytes) -> Job:
+        """保存上传的图片并创建任务（在HTTP处理线程中调用）"""
+        self.store.check_capacity(client)
+        job = self.store.create(client, '')
+        job_dir = os.path.join(self.upload_dir, job.id)
+        os.makedirs(job_dir)
+        # 保留原始文件名，输出的Markdown标题与命令行模式一致
+        job.image_path = os.path.join(job_dir, filename)
+        with open(job.image_path, 'wb') as f:
+            f.write(data)
+        try:
+            self.store.submit(job)
+        except QueueFullError:
+            shutil.rmtree(job_dir, ignore_errors=True)
+            raise
+        metrics.increment('service.jobs_submitted')
+        self.loop.call_soon_threadsafe(self.wake.set)
+        return job
+
+    def _remove_upload(self, job: Job):
+        shutil.rmtree(os.path.dirname(job.image_path), ignore_errors=True)
+
+    async def _dispatch(self, engine: AsyncEngine):
+        """调度协程：有空闲的引擎时按批取出任务，各批并发运行"""
+        idle = asyncio.Queue()
+        for _ in range(self.max_batches):
+            idle.put_nowait(engine.fork())
+        batches = set()
+
+        def done(task: asyncio.Task, lane: AsyncEngine):
+            batches.discard(task)
+            idle.put_nowait(lane)
+
+        try:
+            while True:
+                lane = await idle.get()
+                jobs = []
+                while not jobs:
+                    await self.wake.wait()
+                    self.wake.clear()
+                    jobs = self.store.take(self.batch_size)
+                # 队列中还有任务时，有空闲的引擎后直接取下一批
+                if self.store.queued:
+                    self.wake.set()
+                task = asyncio.ensure_future(self._run_batch(lane, jobs))
+                batches.add(task)
+                task.add_done_callback(lambda task, lane=lane: done(task, lane))
+        finally:
+            for task in batches:
+                task.cancel()
+            await asyncio.gather(*batches, return_exceptions=True)
+
+    async def _run_batch(self, engine: AsyncEngine, jobs: List[Job]):
+        by_path = {job.image_path: job for job in jobs}
+        for job in jobs:
+            self.running[job.id] = (job, engine)
+
+        def on_result(content: Dict[str, str]):
+            self.store.add_entry(by_path[content['source']], FileHandler.format_markdown_entry(content))
+
+        def on_partial(partial: Dict[str, Any]):
+            self.store.set_partial(by_path[partial['source']], partial['page'], partial['stage'], partial['text'])
+
+        def on_image_done(image_path: str, failed: int):
+            job = by_path[image_path]
+            # 全部为空白页的图片照常完成，结果为空
+            if job.entries or not failed:
+                self.store.finish(job, DONE, failed_pages=failed)
+            else:
+                self.store.finish(job, FAILED, "未能识别任何页面", failed_pages=failed)
+
+        started = time.perf_counter()
+        try:
+            # 近似重复页面只在同一客户端的任务之间复用
+            await engine.process_files(list(by_path), on_result, on_image_done, on_partial,
+                                       dedup_groups={job.image_path: job.client for job in jobs})
+        except Exception as e:
+            logging.error(f"处理任务时出错: {str(e)}")
+            for job in jobs:
+                self.store.finish(job, FAILED, str(e))
+        finally:
+            for job in jobs:
+                self.running.pop(job.id, None)
+                self._remove_upload(job)
+        metrics.increment('service.jobs_finished', len(jobs))
+        logging.info(f"完成 {len(jobs)} 个任务，耗时 {time.perf_counter() - started:.1f} 秒")
+
+    def _cancel_timed_out(self):
+        """取消已超时的运行中任务尚未完成的页面处理"""
+        for job, engine in list(self.running.values()):
+            if job.status == TIMEOUT and job.image_path not in engine.cancelled:
+                engine.cancel(job.image_path)
+                metrics.increment('service.jobs_cancelled')
+
+    async def _sweep(self):
+        """定期标记超时任务、取消其处理并清理过期结果"""
+        while True:
+            await asyncio.sleep(1.0)
+            for job in self.store.expire():
+                self._remove_upload(job)
+            self._cancel_timed_out()
+
+    async def run(self):
+        """启动HTTP服务并运行到收到SIGINT/SIGTERM为止"""
+        self.loop = asyncio.get_running_loop()
+        self.wake = asyncio.Event()
+        stop = asyncio.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                self.loop.add_signal_handler(sig, stop.set)
+            except (NotImplementedError, RuntimeError):
+                pass
+
+        shutil.rmtree(self.upload_dir, ignore_errors=True)
+        os.makedirs(self.upload_dir, exist_ok=True)
+
+        async with AsyncEngine(self.note_ocr) as engine:
+            self.server = ThreadingHTTPServer((self.host, self.port), self._handler_class())
+            self.server.daemon_threads = True
+            threading.Thread(target=self.server.serve_forever, name='http-server', daemon=True).start()
+            logging.info(f"NoteOCR服务已启动: http://{self.host}:{self.server.server_address[1]}")
+
+            tasks = [asyncio.ensure_future(self._dispatch(engine)), asyncio.ensure_future(self._sweep())]
+            try:
+                await stop.wait()
+            finally:
+                logging.info("正在停止NoteOCR服务")
+                self.server.shutdown()
+                self.server.server_close()
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                shutil.rmtree(self.upload_dir, ignore_errors=True)
+                if self.search_index is not None:
+                    self.search_index.close()
+
+    def _handler_class(self):
+        service = self
+
+        class Handler(_RequestHandler):
+            pass
+
+        Handler.service = service
+        # 读写请求的套接字超时，避免慢速客户端长期占用处理线程
+        Handler.timeout = self.request_timeout
+        return Handler
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    """NoteOCR服务的HTTP接口
+
+    POST /jobs?filename=<图片名>     请求体为图片的原始字节，返回任务ID
+    GET  /jobs/<id>[?wait=秒]        查询任务状态，wait>0时长轮询等待状态变化
+    GET  /jobs/<id>/events           以Server-Sent Events推送任务状态和流式识别的部分结果，直到任务结束
+    GET  /jobs/<id>/markdown[?wait=秒] 获取Markdown结果，任务未结束时返回202
+    GET  /health                     队列状态
+    GET  /metrics                    Prometheus格式的性能指标
+
+    客户端以 X-Client-Id 请求头标识，未提供时使用来源IP，排队按客户端轮转。
+    """
+
+    service: NoteOCRService = None
+    server_version = 'NoteOCR'
+
+    def log_message(self, format, *args):
+        logging.debug(f"{self.address_string()} {format % args}")
+
+    def _send(self, status: int, body: bytes, content_type: str, headers: Optional[Dict[str, str]] = None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status: int, payload: Dict[str, Any], headers: Optional[Dict[str, str]] = None):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self._send(status, body, 'application/json; charset=utf-8', headers)
+
+    def _error(self, status: int, message: str, headers: Optional[Dict[str, str]] = None):
+        self._send_json(status, {'error': message}, headers)
+
+    def _client(self) -> str:
+        return self.headers.get('X-Client-Id') or self.client_address[0]
+
+    def _wait_seconds(self, query: Dict[str, List[str]]) -> float:
+        try:
+            wait = float(query.get('wait', ['0'])[0])
+        except ValueError:
+            wait = 0.0
+        return min(max(wait, 0.0), self.service.request_timeout)
+
+    def _wait_finished(self, job: Job, timeout: float):
+        """等待任务结束，最多timeout秒"""
+        deadline = time.monotonic() + timeout
+        while not job.finished:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            self.service.store.wait(job, job.version, remaining)
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        if url.path != '/jobs':
+            self._error(404, "未知的接口")
+            return
+
+        query = parse_qs(url.query)
+        filename = Path(query.get('filename', [''])[0] or self.headers.get('X-Filename', '') or 'upload.jpg').name
+        if not filename.lower().endswith(self.service.extensions):
+            self._error(415, f"不支持的图片格式: {filename}")
+            return
+        try:
+            length = int(self.headers.get('Content-Length', ''))
+        except ValueError:
+            self._error(411, "缺少Content-Length")
+            return
+        if length <= 0:
+            self._error(400, "图片内容为空")
+            return
+        if length > self.service.max_upload_bytes:
+            self._error(413, "图片过大")
+            return
+
+        client = self._client()
+        try:
+            self.service.store.check_capacity(client)
+            data = self.rfile.read(length)
+            if len(data) < length:
+                self._error(400, "图片内容不完整")
+                return
+            job = self.service.submit(client, filename, data)
+        except QueueFullError as e:
+            metrics.increment('service.jobs_rejected')
+            self._error(429, str(e), {'Retry-After': str(e.retry_after)})
+            return
+
+        self._send_json(202, job.to_dict(self.service.store.position(job)),
+                        {'Location': f"/jobs/{job.id}"})
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        parts = [part for part in url.path.split('/') if part]
+
+        if parts == ['health']:
+            self._send_json(200, {'status': 'ok', 'jobs': self.service.store.stats()})
+            return
+        if parts == ['metrics']:
+            self._send(200, metrics.prometheus_text().encode('utf-8'), 'text/plain; version=0.0.4')
+            return
+        if parts == ['search']:
+            self._search(query)
+            return
+        if len(parts) not in (2, 3) or parts[0] != 'jobs':
+            self._error(404, "未知的接口")
+            return
+
+        job = self.service.store.get(parts[1])
+        if job is None:
+            self._error(404, "任务不存在或结果已过期")
+            return
+
+        if len(parts) == 2:
+            wait = self._wait_seconds(query)
+            if wait:
+                self.service.store.wait(job, job.version, wait)
+            self._send_json(200, job.to_dict(self.service.store.position(job)))
+        elif parts[2] == 'markdown':
+            self._wait_finished(job, self._wait_seconds(query))
+            if not job.finished:
+                self._send_json(202, job.to_dict(self.service.store.position(job)))
+            elif job.status == DONE:
+                self._send(200, job.markdown.encode('utf-8'), 'text/markdown; charset=utf-8')
+            else:
+                self._send_json(409, job.to_dict())
+        elif parts[2] == 'events':
+            self._stream_events(job)
+        else:
+            self._error(404, "未知的接口")
+
+    def _search(self, query: Dict[str, List[str]]):
+        """在已输出的笔记中查询：GET /search?q=关键词&limit=20"""
+        search_index = self.service.search_index
+        if search_index is None:
+            self._error(404, "全文索引未启用")
+            return
+        text = query.get('q', [''])[0].strip()
+        if not text:
+            self._error(400, "缺少查询参数 q")
+            return
+        try:
+            limit = int(query.get('limit', [self.service.search_limit])[0])
+        except ValueError:
+            self._error(400, "limit 必须是整数")
+            return
+        started = time.perf_counter()
+        hits = search_index.search(text, max(min(limit, 200), 1))
+        metrics.observe('search.query', time.perf_counter() - started)
+        self._send_json(200, {
+            'query': text,
+            'took_ms': round((time.perf_counter() - started) * 1000, 2),
+            'hits': [hit.to_dict() for hit in hits],
+        })
+
+    def _stream_events(self, job: Job):
+        """以Server-Sent Events推送任务状态，任务结束后关闭连接
+
+        每次状态变化发送一条 status 事件；页面正在流式识别或优化时，另发送包含
+        目前为止全部文本的 partial 事件。
+        """
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream; charset=utf-8')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self.close_connection = True
+        keepalive = min(15.0, self.service.request_timeout)
+        try:
+            while True:
+                version = job.version
+                partial = job.partial
+                payload = json.dumps(job.to_dict(self.service.store.position(job)), ensure_ascii=False)
+                self.wfile.write(f"event: status\ndata: {payload}\n\n".encode('utf-8'))
+                if partial is not None:
+                    payload = json.dumps(partial, ensure_ascii=False)
+                    self.wfile.write(f"event: partial\ndata: {payload}\n\n".encode('utf-8'))
+                self.wfile.flush()
+                if job.finished:
+                    return
+                while not self.service.store.wait(job, version, keepalive):
+                    self.wfile.write(b": keepalive\n\n")
+                    self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+def serve(note_ocr, host: Optional[str] = None, port: Optional[int] = None):
+    """按配置启动NoteOCR服务，阻塞直到收到SIGINT/SIGTERM"""
+    service_config = config.SERVICE_CONFIG
+    service = NoteOCRService(
+        note_ocr,
+        host=host or service_config['HOST'],
+        port=service_config['PORT'] if port is None else port,
+        batch_size=service_config['BATCH_SIZE'],
+        max_batches=service_config['MAX_BATCHES'],
+        max_queued=service_config['QUEUE_SIZE'],
+        max_per_client=service_config['CLIENT_QUEUE_SIZE'],
+        max_upload_mb=service_config['MAX_UPLOAD_MB'],
+        request_timeout=service_config['REQUEST_TIMEOUT'],
+        job_timeout=service_config['JOB_TIMEOUT'],
+        result_ttl=service_config['RESULT_TTL'],
+        search_index=note_ocr.create_search_index(),
+        search_limit=config.SEARCH_CONFIG['LIMIT']
+    )
+    asyncio.run(service.run())
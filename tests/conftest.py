@@ -0,0 +1,37 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# 配置在导入时读取环境变量：测试使用临时输出目录和占位的API密钥，不读取本机的 .env
+_OUTPUT_DIR = tempfile.mkdtemp(prefix='noteocr-test-')
+os.environ.update({
+    'DASHSCOPE_API_KEY': 'test',
+    'DEEPSEEK_API_KEY': 'test',
+    'DEEPSEEK_MODEL': 'test-model',
+    'INPUT_DIR': os.path.join(_OUTPUT_DIR, 'input'),
+    'OUTPUT_DIR': _OUTPUT_DIR,
+    'CPU_WORKERS': '0',
+    'API_RATE_LIMIT': '0',
+    'STREAM_ENABLED': 'false',
+    'TEXT_TRIAGE_ENABLED': 'false',
+    'SEARCH_ENABLED': 'false',
+})
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class Clock:
+    """可手动拨动的时钟，注入需要计时的组件"""
+
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock() -> Clock:
+    return Clock()
@@ -0,0 +1,149 @@
+import pytest
+
+from service.jobs import JobStore, QueueFullError, QUEUED, RUNNING, DONE, FAILED, TIMEOUT
+
+
+def make_store(clock, max_queued=16, max_per_client=8, job_timeout=60, result_ttl=300):
+    return JobStore(max_queued, max_per_client, job_timeout, result_ttl, clock=clock)
+
+
+def submit(store, client, name):
+    job = store.create(client, name)
+    store.submit(job)
+    return job
+
+
+def test_take_rotates_between_clients(clock):
+    store = make_store(clock)
+    a = [submit(store, 'a', f"a{i}") for i in range(3)]
+    b = [submit(store, 'b', f"b{i}") for i in range(2)]
+    c = submit(store, 'c', 'c0')
+
+    taken = store.take(10)
+
+    assert [job.image_path for job in taken] == ['a0', 'b0', 'c0', 'a1', 'b1', 'a2']
+    assert all(job.status == RUNNING for job in a + b + [c])
+    assert store.queued == 0
+    assert not store.queues
+
+
+def test_take_respects_limit_and_keeps_rotation(clock):
+    store = make_store(clock)
+    for i in range(3):
+        submit(store, 'a', f"a{i}")
+    submit(store, 'b', 'b0')
+
+    assert [job.image_path for job in store.take(2)] == ['a0', 'b0']
+    assert [job.image_path for job in store.take(2)] == ['a1', 'a2']
+    assert store.take(2) == []
+
+
+def test_position_follows_rotation(clock):
+    store = make_store(clock)
+    a = [submit(store, 'a', f"a{i}") for i in range(3)]
+    b = submit(store, 'b', 'b0')
+
+    # 出队顺序为 a0, b0, a1, a2
+    assert store.position(a[0]) == 0
+    assert store.position(b) == 1
+    assert store.position(a[1]) == 2
+    assert store.position(a[2]) == 3
+
+    store.take(1)
+    assert store.position(a[0]) is None
+
+
+def test_capacity_limits(clock):
+    store = make_store(clock, max_queued=3, max_per_client=2)
+    submit(store, 'a', 'a0')
+    submit(store, 'a', 'a1')
+
+    with pytest.raises(QueueFullError) as per_client:
+        submit(store, 'a', 'a2')
+    assert per_client.value.retry_after == 2
+
+    submit(store, 'b', 'b0')
+    with pytest.raises(QueueFullError) as total:
+        submit(store, 'c', 'c0')
+    assert total.value.retry_after == 5
+    assert store.queued == 3
+
+
+def test_take_times_out_jobs_past_deadline(clock):
+    store = make_store(clock, job_timeout=10)
+    stale = submit(store, 'a', 'stale')
+    clock.now += 5
+    fresh = submit(store, 'b', 'fresh')
+    clock.now += 6
+
+    assert store.take(10) == [fresh]
+    assert stale.status == TIMEOUT
+    assert stale.error == "任务排队超时"
+    assert store.queued == 0
+
+
+def test_expire_times_out_queued_and_running_jobs(clock):
+    store = make_store(clock, job_timeout=10)
+    running = submit(store, 'a', 'running')
+    store.take(1)
+    queued = submit(store, 'a', 'queued')
+    store.add_entry(running, '# page\n')
+    clock.now += 11
+
+    # 只有排队中的任务需要调用方删除上传文件
+    assert store.expire() == [queued]
+    assert queued.status == TIMEOUT
+    assert running.status == TIMEOUT
+    assert running.entries == []
+    assert store.queued == 0
+    assert not store.queues
+
+    # 超时后流水线才完成的任务保持超时状态，也不再追加结果
+    store.add_entry(running, '# late\n')
+    store.finish(running, DONE)
+    assert running.status == TIMEOUT
+    assert running.entries == []
+
+
+def test_expire_removes_finished_jobs_after_ttl(clock):
+    store = make_store(clock, result_ttl=30)
+    done = submit(store, 'a', 'done')
+    failed = submit(store, 'a', 'failed')
+    store.take(2)
+    store.add_entry(done, '# page\n')
+    store.finish(done, DONE)
+    store.finish(failed, FAILED, "未能识别任何页面")
+
+    assert done.markdown == '# page\n'
+    assert failed.entries == []
+    clock.now += 29
+    store.expire()
+    assert store.get(done.id) is done
+
+    clock.now += 1
+    store.expire()
+    assert store.get(done.id) is None
+    assert store.get(failed.id) is None
+
+
+def test_wait_returns_on_update(clock):
+    store = make_store(clock)
+    job = submit(store, 'a', 'a0')
+    version = job.version
+
+    assert not store.wait(job, version, 0.01)
+    store.take(1)
+    assert store.wait(job, version, 0.01)
+    assert job.status == RUNNING
+
+
+def test_stats(clock):
+    store = make_store(clock)
+    submit(store, 'a', 'a0')
+    submit(store, 'b', 'b0')
+    store.take(1)
+
+    stats = store.stats()
+    assert stats[QUEUED] == 1
+    assert stats[RUNNING] == 1
+    assert stats['clients'] == 1
@@ -0,0 +1,126 @@
+import os
+import json
+
+import pytest
+
+from utils.markdown_output import MarkdownOutput
+
+
+@pytest.fixture
+def images(tmp_path):
+    folder = tmp_path / 'input'
+    folder.mkdir()
+
+    def make(name: str, content: bytes = b'image') -> str:
+        path = folder / name
+        path.write_bytes(content)
+        return str(path)
+    return make
+
+
+def output_dir(tmp_path) -> str:
+    return str(tmp_path / 'output')
+
+
+def write_image(output, image_path, *texts):
+    for index, text in enumerate(texts):
+        output.write({'filename': f"{os.path.splitext(os.path.basename(image_path))[0]} (Page {index + 1})",
+                      'text': text, 'source': image_path})
+    output.finish_image(image_path)
+
+
+def read(tmp_path, rel_path='notes.md') -> str:
+    with open(os.path.join(output_dir(tmp_path), rel_path), encoding='utf-8') as f:
+        return f.read()
+
+
+def manifest(tmp_path):
+    with open(os.path.join(output_dir(tmp_path), '.index.jsonl'), encoding='utf-8') as f:
+        return [json.loads(line) for line in f]
+
+
+def test_blank_image_is_recorded(tmp_path, images):
+    blank = images('blank.jpg')
+    with MarkdownOutput(output_dir(tmp_path)) as output:
+        output.finish_image(blank)
+
+    [record] = manifest(tmp_path)
+    assert (record['source'], record['pages'], record['file']) == (blank, 0, None)
+    assert MarkdownOutput(output_dir(tmp_path)).is_done(blank)
+    assert 'blank' not in read(tmp_path, 'index.md')
+
+
+def test_failed_image_is_not_recorded(tmp_path, images):
+    image = images('a.jpg')
+    with MarkdownOutput(output_dir(tmp_path)) as output:
+        output.write({'filename': 'a (Page 1)', 'text': '第一页', 'source': image})
+        output.finish_image(image, failed=1)
+
+    assert not MarkdownOutput(output_dir(tmp_path)).is_done(image)
+    assert read(tmp_path) == ''
+
+
+def test_modified_image_replaces_its_old_section(tmp_path, images):
+    first, second, third = images('a.jpg'), images('b.jpg'), images('c.jpg')
+    with MarkdownOutput(output_dir(tmp_path)) as output:
+        write_image(output, first, '甲')
+        write_image(output, second, '乙一', '乙二')
+        write_image(output, third, '丙')
+
+    images('b.jpg', b'modified image')
+    output = MarkdownOutput(output_dir(tmp_path))
+    assert not output.is_done(second)
+    with output:
+        write_image(output, second, '新乙')
+
+    content = read(tmp_path)
+    assert '乙一' not in content and '乙二' not in content
+    assert [content.index(text) for text in ('甲', '丙', '新乙')] == sorted(content.index(text) for text in ('甲', '丙', '新乙'))
+
+    # 记录中的结束位置与删除后的文件一致，之后可以继续追加并重建索引
+    reopened = MarkdownOutput(output_dir(tmp_path))
+    assert all(reopened.is_done(path) for path in (first, second, third))
+    assert reopened.offsets['notes.md'] == len(content.encode('utf-8'))
+    pages = {source: [page['text'] for page in pages] for source, _, pages in reopened.iter_written_pages()}
+    assert pages == {first: ['甲'], second: ['新乙'], third: ['丙']}
+
+
+def test_image_that_became_blank_is_removed(tmp_path, images):
+    first, second = images('a.jpg'), images('b.jpg')
+    with MarkdownOutput(output_dir(tmp_path)) as output:
+        write_image(output, first, '甲')
+        write_image(output, second, '乙')
+
+    images('a.jpg', b'blank now')
+    with MarkdownOutput(output_dir(tmp_path)) as output:
+        output.finish_image(first)
+
+    content = read(tmp_path)
+    assert '甲' not in content and '乙' in content
+    reopened = MarkdownOutput(output_dir(tmp_path))
+    assert reopened.is_done(first) and reopened.is_done(second)
+    assert [source for source, _, _ in reopened.iter_written_pages()] == [second]
+
+
+def test_interrupted_removal_is_completed(tmp_path, images):
+    first, second = images('a.jpg'), images('b.jpg')
+    with MarkdownOutput(output_dir(tmp_path)) as output:
+        write_image(output, first, '甲')
+        write_image(output, second, '乙')
+    expected = read(tmp_path)
+    compact = os.path.join(output_dir(tmp_path), '.notes.md.compact')
+
+    # 输出记录尚未替换：临时文件作废
+    with open(compact, 'w', encoding='utf-8') as f:
+        f.write('不完整')
+    MarkdownOutput(output_dir(tmp_path))
+    assert not os.path.exists(compact)
+    assert read(tmp_path) == expected
+
+    # 输出记录已替换：按新的记录完成替换
+    with open(compact, 'w', encoding='utf-8') as f:
+        f.write(expected)
+    with open(os.path.join(output_dir(tmp_path), 'notes.md'), 'a', encoding='utf-8') as f:
+        f.write('旧内容')
+    MarkdownOutput(output_dir(tmp_path))
+    assert read(tmp_path) == expected
@@ -0,0 +1,98 @@
+import asyncio
+
+import httpx
+import openai
+
+from utils.rate_limiter import ApiGuard
+
+REQUEST = httpx.Request('POST', 'http://127.0.0.1/v1/chat/completions')
+
+
+def rate_limited() -> openai.RateLimitError:
+    return openai.RateLimitError("429", response=httpx.Response(429, request=REQUEST), body=None)
+
+
+def server_error() -> openai.InternalServerError:
+    return openai.InternalServerError("500", response=httpx.Response(500, request=REQUEST), body=None)
+
+
+def make_guard(**kwargs) -> ApiGuard:
+    options = dict(rate=0, max_attempts=3, base_delay=0, max_delay=0, failure_threshold=5, reset_timeout=0.05)
+    options.update(kwargs)
+    return ApiGuard('test', **options)
+
+
+def flaky(errors):
+    """依次抛出errors中的异常，之后返回'ok'"""
+    errors = list(errors)
+
+    async def func():
+        if errors:
+            raise errors.pop(0)
+        return 'ok'
+    return func
+
+
+def test_rate_limiting_does_not_open_breaker():
+    guard = make_guard()
+
+    async def run():
+        return await asyncio.gather(*(guard.acall(flaky([rate_limited()])) for _ in range(16)))
+
+    assert asyncio.run(run()) == ['ok'] * 16
+    assert guard.breaker.opened_at is None
+    assert guard.breaker.failures == 0
+    assert guard.bucket.rate == guard.bucket.max_rate
+
+
+def test_open_breaker_waits_instead_of_failing():
+    guard = make_guard(failure_threshold=2, max_attempts=1)
+
+    async def run():
+        # 两次5xx打开熔断器，之后的请求等待冷却结束，由试探请求恢复
+        failed = await asyncio.gather(guard.acall(flaky([server_error()])),
+                                      guard.acall(flaky([server_error()])), return_exceptions=True)
+        assert all(isinstance(error, openai.InternalServerError) for error in failed)
+        assert guard.breaker.opened_at is not None
+        return await asyncio.gather(*(guard.acall(flaky([])) for _ in range(4)))
+
+    assert asyncio.run(run()) == ['ok'] * 4
+    assert guard.breaker.opened_at is None
+
+
+def test_cancelled_trial_releases_breaker():
+    guard = make_guard(failure_threshold=1, max_attempts=1)
+
+    async def hang():
+        await asyncio.sleep(10)
+
+    async def run():
+        try:
+            await guard.acall(flaky([server_error()]))
+        except openai.InternalServerError:
+            pass
+        assert guard.breaker.opened_at is not None
+        trial = asyncio.ensure_future(guard.acall(hang))
+        await asyncio.sleep(0.1)
+        assert guard.breaker.trial_in_flight
+        trial.cancel()
+        await asyncio.gather(trial, return_exceptions=True)
+        assert not guard.breaker.trial_in_flight
+        return await asyncio.wait_for(guard.acall(flaky([])), 1)
+
+    assert asyncio.run(run()) == 'ok'
+
+
+def test_sync_call_retries_rate_limits():
+    guard = make_guard(failure_threshold=1)
+    calls = []
+
+    def func():
+        calls.append(1)
+        if len(calls) < 3:
+            raise rate_limited()
+        return 'ok'
+
+    assert guard.call(func) == 'ok'
+    assert guard.breaker.opened_at is None
+    assert guard.retries == 2
@@ -0,0 +1,183 @@
+import json
+import time
+import asyncio
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import cv2
+import httpx
+import pytest
+
+from benchmarks.synthetic import make_notebook_photo
+from config import config
+from service.server import NoteOCRService
+
+OCR_TEXT = "### 傅里叶变换\n1. 定义\n2. 性质"
+
+
+class OpenAIStub:
+    """本地的OpenAI兼容接口：视觉请求返回固定的OCR文本，文本请求返回带前缀的原文"""
+
+    def __init__(self):
+        self.requests = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                stub.requests.append(body)
+                content = body['messages'][-1]['content']
+                if isinstance(content, list):
+                    text = OCR_TEXT
+                else:
+                    text = "整理后：" + content.rsplit('笔记内容：', 1)[-1].strip()
+                payload = json.dumps({
+                    'id': 'stub', 'object': 'chat.completion', 'created': 0, 'model': body['model'],
+                    'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': text},
+                                 'finish_reason': 'stop'}],
+                    'usage': {'prompt_tokens': 1, 'completion_tokens': 1, 'total_tokens': 2},
+                }).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}/v1"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def count(self, vision: bool) -> int:
+        return sum(isinstance(body['messages'][-1]['content'], list) == vision for body in self.requests)
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture(scope='module')
+def api_stub():
+    stub = OpenAIStub()
+    yield stub
+    stub.close()
+
+
+@pytest.fixture(scope='module')
+def service(api_stub, tmp_path_factory):
+    import main
+
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setitem(config.OCR_API, 'BASE_URL', api_stub.base_url)
+        patch.setitem(config.TEXT_API, 'BASE_URL', api_stub.base_url)
+        note_ocr = main.NoteOCR(use_cache=False)
+
+    service = NoteOCRService(note_ocr, port=0, batch_size=2, max_queued=4, max_per_client=2,
+                             request_timeout=10, upload_dir=str(tmp_path_factory.mktemp('uploads')))
+    loop = asyncio.new_event_loop()
+    task = loop.create_task(service.run())
+
+    def run():
+        try:
+            loop.run_until_complete(task)
+        except asyncio.CancelledError:
+            pass
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    deadline = time.monotonic() + 10
+    while service.server is None:
+        assert time.monotonic() < deadline, "服务未能启动"
+        time.sleep(0.01)
+    yield service
+
+    loop.call_soon_threadsafe(task.cancel)
+    thread.join(10)
+    loop.close()
+
+
+@pytest.fixture
+def client(service):
+    with httpx.Client(base_url=f"http://127.0.0.1:{service.server.server_address[1]}", timeout=30) as client:
+        yield client
+
+
+def photo(seed: int) -> bytes:
+    image = make_notebook_photo((1200, 900), pages=2, seed=seed)
+    return cv2.imencode('.jpg', image)[1].tobytes()
+
+
+def test_job_returns_markdown(client, api_stub):
+    response = client.post('/jobs', params={'filename': 'lecture.jpg'}, content=photo(1),
+                           headers={'X-Client-Id': 'alice'})
+    assert response.status_code == 202
+    job = response.json()
+    assert response.headers['Location'] == f"/jobs/{job['id']}"
+    assert job['status'] in ('queued', 'running')
+
+    response = client.get(f"/jobs/{job['id']}/markdown", params={'wait': 10})
+    assert response.status_code == 200
+    markdown = response.text
+    assert markdown.startswith('# lecture (Page 1/')
+    assert '整理后：' in markdown
+    assert '## 傅里叶变换' in markdown
+
+    status = client.get(f"/jobs/{job['id']}").json()
+    assert status['status'] == 'done'
+    assert status['pages'] == markdown.count('\n---\n')
+    assert api_stub.count(vision=True) >= status['pages']
+    assert api_stub.count(vision=False) >= 1
+
+
+def test_events_stream_until_finished(client):
+    job = client.post('/jobs', params={'filename': 'events.jpg'}, content=photo(2)).json()
+
+    statuses = []
+    with client.stream('GET', f"/jobs/{job['id']}/events") as response:
+        assert response.headers['Content-Type'].startswith('text/event-stream')
+        event = None
+        for line in response.iter_lines():
+            if line.startswith('event: '):
+                event = line[len('event: '):]
+            elif line.startswith('data: ') and event == 'status':
+                statuses.append(json.loads(line[len('data: '):])['status'])
+    assert statuses[-1] == 'done'
+
+
+def test_rejects_invalid_uploads(client):
+    response = client.post('/jobs', params={'filename': 'notes.txt'}, content=b'text')
+    assert response.status_code == 415
+
+    response = client.post('/jobs', params={'filename': 'empty.jpg'}, content=b'')
+    assert response.status_code == 400
+
+
+def test_unknown_paths(client):
+    assert client.get('/jobs/missing').status_code == 404
+    assert client.get('/jobs/missing/markdown').status_code == 404
+    assert client.get('/nothing').status_code == 404
+    # 未提供全文索引
+    assert client.get('/search', params={'q': '傅里叶'}).status_code == 404
+
+
+def test_health(client):
+    response = client.get('/health')
+    assert response.status_code == 200
+    assert response.json()['status'] == 'ok'
+
+
+def test_dedup_is_scoped_to_client(client, api_stub):
+    def run(client_id: str) -> int:
+        before = api_stub.count(vision=True)
+        job = client.post('/jobs', params={'filename': 'dup.jpg'}, content=photo(7),
+                          headers={'X-Client-Id': client_id}).json()
+        response = client.get(f"/jobs/{job['id']}/markdown", params={'wait': 10})
+        assert response.status_code == 200
+        return api_stub.count(vision=True) - before
+
+    assert run('carol') > 0
+    # 同一客户端重复上传的页面复用已有结果，其他客户端的相同页面重新识别
+    assert run('carol') == 0
+    assert run('dave') > 0
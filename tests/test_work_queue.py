@@ -0,0 +1,161 @@
+import pytest
+
+from cluster.reducer import reduce_shards
+from cluster.work_queue import WorkQueue, PENDING, LEASED, DONE, FAILED
+from cluster.worker import ShardWorker
+from utils.journal import RunJournal
+from utils.markdown_output import MarkdownOutput
+
+
+@pytest.fixture
+def queue(tmp_path, clock):
+    queue = WorkQueue(str(tmp_path / 'queue.db'), lease_seconds=60, max_attempts=2, clock=clock)
+    queue.enqueue({'a.jpg': 'sig-a', 'b.jpg': 'sig-b', 'c.jpg': 'sig-c'})
+    yield queue
+    queue.close()
+
+
+def status(queue, path):
+    return next(item for item in queue.items() if item['path'] == path)
+
+
+def test_claim_in_enqueue_order(queue):
+    first = queue.claim('w1', 2)
+    second = queue.claim('w2', 2)
+
+    assert [(item.path, item.seq, item.attempt) for item in first] == [('a.jpg', 1, 1), ('b.jpg', 2, 1)]
+    assert [item.path for item in second] == ['c.jpg']
+    assert queue.claim('w3', 2) == []
+    assert status(queue, 'a.jpg')['worker'] == 'w1'
+    assert queue.stats()[LEASED] == 3
+
+
+def test_enqueue_keeps_state_unless_signature_changes(queue):
+    [item] = queue.claim('w1', 1)
+    queue.complete(item, 'a.json')
+
+    assert queue.enqueue({'a.jpg': 'sig-a', 'd.jpg': 'sig-d'}) == 1
+    assert status(queue, 'a.jpg')['status'] == DONE
+    assert status(queue, 'd.jpg')['seq'] == 4
+
+    assert queue.enqueue({'a.jpg': 'sig-a2'}) == 1
+    row = status(queue, 'a.jpg')
+    assert (row['status'], row['attempt'], row['shard']) == (PENDING, 0, None)
+
+
+def test_complete_requires_current_lease(queue, clock):
+    [item] = queue.claim('w1', 1)
+    assert queue.complete(item, 'a-1.json')
+    row = status(queue, 'a.jpg')
+    assert (row['status'], row['shard']) == (DONE, 'a-1.json')
+    # 重复提交同一租约不会改变结果
+    assert not queue.complete(item, 'other.json')
+    assert status(queue, 'a.jpg')['shard'] == 'a-1.json'
+
+
+def test_expired_lease_is_reclaimed(queue, clock):
+    [stale] = queue.claim('w1', 1)
+    clock.now += 61
+
+    assert queue.stats()['expired'] == 1
+    reclaimed = queue.claim('w2', 1)
+    assert [(item.path, item.attempt) for item in reclaimed] == [('a.jpg', 2)]
+    assert status(queue, 'a.jpg')['worker'] == 'w2'
+
+    # 原进程的租约已失效：续约、提交和失败都不再生效
+    assert queue.renew([stale]) == 0
+    assert not queue.complete(stale, 'a-1.json')
+    assert not queue.fail(stale, "迟到的失败")
+    assert status(queue, 'a.jpg')['status'] == LEASED
+
+    assert queue.complete(reclaimed[0], 'a-2.json')
+    assert status(queue, 'a.jpg')['shard'] == 'a-2.json'
+
+
+def test_renew_extends_lease(queue, clock):
+    items = queue.claim('w1', 2)
+    clock.now += 50
+    assert queue.renew(items) == 2
+
+    clock.now += 50
+    assert queue.stats()['expired'] == 0
+    assert [item.path for item in queue.claim('w2', 3)] == ['c.jpg']
+
+    clock.now += 11
+    assert queue.stats()['expired'] == 2
+
+
+def test_lease_expiring_past_max_attempts_fails(queue, clock):
+    queue.claim('w1', 1)
+    clock.now += 61
+    [second] = queue.claim('w2', 1)
+    assert second.attempt == 2
+    clock.now += 61
+
+    # a.jpg 已领取 max_attempts 次，不再重试
+    assert [item.path for item in queue.claim('w3', 1)] == ['b.jpg']
+    row = status(queue, 'a.jpg')
+    assert (row['status'], row['error']) == (FAILED, "租约多次过期")
+    assert not queue.complete(second, 'a-2.json')
+
+
+def test_fail_requeues_until_max_attempts(queue):
+    [first] = queue.claim('w1', 1)
+    assert queue.fail(first, "OCR失败")
+    row = status(queue, 'a.jpg')
+    assert (row['status'], row['error'], row['worker']) == (PENDING, "OCR失败", None)
+
+    [second] = queue.claim('w1', 1)
+    assert second.path == 'a.jpg' and second.attempt == 2
+    assert queue.fail(second, "OCR失败")
+    assert status(queue, 'a.jpg')['status'] == FAILED
+
+    assert queue.reset_failed() == 1
+    row = status(queue, 'a.jpg')
+    assert (row['status'], row['attempt'], row['error']) == (PENDING, 0, None)
+
+
+def test_release_does_not_count_an_attempt(queue):
+    items = queue.claim('w1', 2)
+    queue.release(items)
+
+    assert queue.stats()[PENDING] == 3
+    assert [(item.path, item.attempt) for item in queue.claim('w2', 1)] == [('a.jpg', 1)]
+
+
+def test_queue_is_shared_between_connections(queue, tmp_path, clock):
+    other = WorkQueue(str(tmp_path / 'queue.db'), lease_seconds=60, max_attempts=2, clock=clock)
+    try:
+        mine = queue.claim('w1', 2)
+        theirs = other.claim('w2', 2)
+        assert {item.path for item in mine}.isdisjoint(item.path for item in theirs)
+        assert [item.path for item in theirs] == ['c.jpg']
+        assert other.complete(theirs[0], 'c.json')
+        assert queue.stats()[DONE] == 1
+    finally:
+        other.close()
+
+
+def test_blank_image_completes_with_empty_shard(queue, tmp_path):
+    input_dir = tmp_path / 'input'
+    input_dir.mkdir()
+    (input_dir / 'a.jpg').write_bytes(b'blank page')
+    shard_dir = tmp_path / 'shards'
+    shard_dir.mkdir()
+    queue.enqueue({'a.jpg': RunJournal.file_signature(str(input_dir / 'a.jpg'))})
+    worker = ShardWorker(None, queue, str(input_dir), str(shard_dir), 'w1')
+
+    [blank, failed] = queue.claim('w1', 2)
+    worker._finish_item(blank, [], 0)
+    worker._finish_item(failed, [], 1)
+    assert status(queue, 'a.jpg')['status'] == DONE
+    assert status(queue, 'b.jpg')['status'] == PENDING
+    assert (worker.images, worker.failed) == (1, 1)
+
+    # 空分片合并为0页的输出记录，之后不再重复处理
+    output = MarkdownOutput(str(tmp_path / 'output'))
+    with output:
+        result = reduce_shards(queue, output, str(input_dir), str(shard_dir))
+    assert result['merged'] == 1
+    assert output.is_done(str(input_dir / 'a.jpg'))
+    assert output.entries[str(input_dir / 'a.jpg')]['pages'] == 0
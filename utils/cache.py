@@ -0,0 +1,155 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from typing import Optional, Dict, Any
+
+import numpy as np
+
+from utils.metrics import metrics
+
+
+class ResultCache:
+    """基于内容哈希的持久化结果缓存
+
+    缓存按层存储：
+    - preprocess: 原始页面像素摘要 + 预处理档位 -> 预处理后像素摘要
+    - ocr: 预处理后像素摘要 + OCR模型/提示词/参数 -> 原始OCR文本
+    - enhance: 原始OCR文本 + 文本模型/提示词/参数 -> 优化后文本
+    """
+
+    LAYERS = ('preprocess', 'ocr', 'enhance')
+
+    def __init__(self, db_path: str, max_size_mb: float = 1024, max_age_days: float = 30,
+                 enabled: bool = True, refresh: bool = False):
+        """初始化缓存
+
+        Args:
+            db_path: SQLite数据库路径
+            max_size_mb: 缓存总大小上限（MB），超出后按最近访问时间淘汰
+            max_age_days: 缓存条目最长保留天数
+            enabled: 是否启用缓存（--no-cache 时为False）
+            refresh: 是否跳过读取、强制重新计算并覆盖缓存（--refresh）
+        """
+        self.db_path = db_path
+        self.max_size_bytes = int(max_size_mb * 1024 * 1024)
+        self.max_age_seconds = max_age_days * 24 * 3600
+        self.enabled = enabled
+        self.refresh = refresh
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = None
+
+        if not self.enabled:
+            return
+
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS results (
+                layer TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                PRIMARY KEY (layer, key)
+            )
+        """)
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_results_accessed ON results (accessed_at)')
+        self._conn.commit()
+
+    @staticmethod
+    def image_digest(image: np.ndarray) -> str:
+        """计算图片像素内容的摘要"""
+        h = hashlib.sha256()
+        h.update(f"{image.shape}|{image.dtype}".encode('utf-8'))
+        h.update(np.ascontiguousarray(image).data)
+        return h.hexdigest()
+
+    @staticmethod
+    def make_key(digest: str, params: Dict[str, Any]) -> str:
+        """将内容摘要与模型/提示词/参数组合为缓存键"""
+        h = hashlib.sha256()
+        h.update(digest.encode('utf-8'))
+        h.update(json.dumps(params, sort_keys=True, ensure_ascii=False).encode('utf-8'))
+        return h.hexdigest()
+
+    @staticmethod
+    def text_digest(text: str) -> str:
+        """计算文本内容的摘要"""
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def get(self, layer: str, key: str) -> Optional[str]:
+        """读取缓存，未命中或处于刷新模式时返回None"""
+        if not self.enabled or self.refresh:
+            return None
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT value, created_at FROM results WHERE layer = ? AND key = ?',
+                (layer, key)
+            ).fetchone()
+            now = time.time()
+            if row is None or now - row[1] > self.max_age_seconds:
+                self.misses += 1
+                metrics.increment(f"cache.{layer}.misses")
+                return None
+            self._conn.execute(
+                'UPDATE results SET accessed_at = ? WHERE layer = ? AND key = ?',
+                (now, layer, key)
+            )
+            self._conn.commit()
+            self.hits += 1
+            metrics.increment(f"cache.{layer}.hits")
+            return row[0]
+
+    def set(self, layer: str, key: str, value: str):
+        """写入缓存"""
+        if not self.enabled or value is None:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO results (layer, key, value, size, created_at, accessed_at) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (layer, key, value, len(value.encode('utf-8')), now, now)
+            )
+            self._conn.commit()
+
+    def evict(self):
+        """按时间和大小淘汰过期条目"""
+        if not self.enabled:
+            return
+        with self._lock:
+            cutoff = time.time() - self.max_age_seconds
+            expired = self._conn.execute('DELETE FROM results WHERE created_at < ?', (cutoff,)).rowcount
+
+            total = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+            removed = 0
+            if total > self.max_size_bytes:
+                rows = self._conn.execute('SELECT layer, key, size FROM results ORDER BY accessed_at ASC')
+                stale = []
+                for layer, key, size in rows:
+                    if total <= self.max_size_bytes:
+                        break
+                    stale.append((layer, key))
+                    total -= size
+                self._conn.executemany('DELETE FROM results WHERE layer = ? AND key = ?', stale)
+                removed = len(stale)
+            self._conn.commit()
+
+        if expired or removed:
+            logging.info(f"缓存淘汰：过期 {expired} 条，超出容量 {removed} 条")
+
+    def close(self):
+        """关闭缓存数据库"""
+        if self._conn is not None:
+            with self._lock:
+                self._conn.close()
+                self._conn = None
@@ -0,0 +1,142 @@
+import math
+import threading
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import cv2
+import numpy as np
+from PIL import Image
+
+try:
+    import pypdfium2 as pdfium
+except ImportError:
+    pdfium = None
+
+# 按文档逐页处理的文件格式
+DOCUMENT_EXTENSIONS = ('.pdf', '.tif', '.tiff')
+
+# PDFium不是线程安全的，进程内线程池中同一时刻只渲染一页
+_PDFIUM_LOCK = threading.Lock()
+
+
+def is_document(path: str) -> bool:
+    """是否为按文档逐页处理的文件（PDF、多页TIFF）"""
+    return Path(path).suffix.lower() in DOCUMENT_EXTENSIONS
+
+
+def _open_pdf(path: str):
+    if pdfium is None:
+        raise ImportError("处理PDF需要安装 pypdfium2：pip install pypdfium2")
+    return pdfium.PdfDocument(path)
+
+
+class DocumentSheet:
+    """文档中的一页（PDF页面或TIFF帧），与 ImageSource 提供相同的接口
+
+    只保存路径、页码和渲染参数，read() 时才打开文档渲染或解码这一页，
+    可以直接传给进程池中的工作进程；同一时刻只有正在处理的页面占用内存。
+    """
+
+    def __init__(self, path: str, index: int, size: Tuple[int, int], scale: float):
+        """初始化
+
+        Args:
+            path: 文档路径
+            index: 页码（从0开始）
+            size: 渲染或解码后的尺寸 (宽, 高)
+            scale: PDF为渲染比例（1对应72 DPI），TIFF为整数缩小倍数
+        """
+        self.path = path
+        self.index = index
+        self.size = size
+        self.scale = scale
+
+    def estimated_bytes(self) -> Optional[int]:
+        """渲染后图片占用的内存（字节）"""
+        width, height = self.size
+        return width * height * 3
+
+    def read(self) -> np.ndarray:
+        """渲染或解码这一页（BGR）"""
+        if Path(self.path).suffix.lower() == '.pdf':
+            with _PDFIUM_LOCK:
+                document = _open_pdf(self.path)
+                try:
+                    page = document[self.index]
+                    image = page.render(scale=self.scale).to_numpy().copy()
+                    page.close()
+                finally:
+                    document.close()
+            # 渲染结果通常已是BGR，个别页面为灰度或带透明通道
+            if image.ndim == 2:
+                return cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+            if image.shape[2] == 4:
+                return cv2.cvtColor(image, cv2.COLOR_BGRA2BGR)
+            return image
+
+        with Image.open(self.path) as document:
+            document.seek(self.index)
+            frame = document.convert('RGB')
+        if self.scale > 1:
+            frame = frame.reduce(int(self.scale))
+        return cv2.cvtColor(np.asarray(frame), cv2.COLOR_RGB2BGR)
+
+
+class DocumentSource:
+    """多页文档（PDF、多页TIFF）
+
+    创建时不读取文件；sheets() 只读取各页的尺寸，不渲染像素。
+    PDF按像素预算选择渲染DPI：页面渲染后的像素数接近 max_pixels，且DPI不超过 max_dpi；
+    TIFF按与 ImageSource 相同的规则以1/2、1/4、1/8缩小。
+    """
+
+    def __init__(self, path: str, max_pixels: int = 0, max_dpi: int = 300):
+        """初始化
+
+        Args:
+            path: 文档路径
+            max_pixels: 每页渲染后的目标像素数，0表示按 max_dpi 渲染（TIFF按原尺寸解码）
+            max_dpi: PDF渲染的最高DPI
+        """
+        self.path = str(path)
+        self.max_pixels = max_pixels
+        self.max_dpi = max_dpi
+
+    def _pdf_scale(self, width: float, height: float) -> float:
+        """按像素预算计算PDF页面的渲染比例（页面尺寸单位为1/72英寸）"""
+        scale = self.max_dpi / 72
+        if self.max_pixels > 0 and width * height > 0:
+            scale = min(scale, math.sqrt(self.max_pixels / (width * height)))
+        return scale
+
+    def _tiff_reduction(self, width: int, height: int) -> int:
+        if self.max_pixels <= 0:
+            return 1
+        for factor in (8, 4, 2):
+            if (width // factor) * (height // factor) >= self.max_pixels:
+                return factor
+        return 1
+
+    def sheets(self) -> List[DocumentSheet]:
+        """列出文档的各页"""
+        sheets = []
+        if Path(self.path).suffix.lower() == '.pdf':
+            with _PDFIUM_LOCK:
+                document = _open_pdf(self.path)
+                try:
+                    for index in range(len(document)):
+                        width, height = document.get_page_size(index)
+                        scale = self._pdf_scale(width, height)
+                        size = (max(round(width * scale), 1), max(round(height * scale), 1))
+                        sheets.append(DocumentSheet(self.path, index, size, scale))
+                finally:
+                    document.close()
+            return sheets
+
+        with Image.open(self.path) as document:
+            for index in range(getattr(document, 'n_frames', 1)):
+                document.seek(index)
+                width, height = document.size
+                factor = self._tiff_reduction(width, height)
+                sheets.append(DocumentSheet(self.path, index, (width // factor, height // factor), factor))
+        return sheets
@@ -0,0 +1,73 @@
+import logging
+from typing import Optional, Tuple
+
+import cv2
+import numpy as np
+from PIL import Image
+
+
+class ImageSource:
+    """按需解码的图片来源
+
+    创建时只读取文件头获取尺寸，不解码像素；read() 时才解码。
+    图片像素数远超后续处理所需时，借助 IMREAD_REDUCED_* 直接以 1/2、1/4 或 1/8
+    分辨率解码（JPEG可在解码阶段完成缩放，不会先生成全尺寸图片）。
+    对象只包含路径和参数，可以直接传给进程池中的工作进程。
+    """
+
+    REDUCED_FLAGS = {
+        1: cv2.IMREAD_COLOR,
+        2: cv2.IMREAD_REDUCED_COLOR_2,
+        4: cv2.IMREAD_REDUCED_COLOR_4,
+        8: cv2.IMREAD_REDUCED_COLOR_8,
+    }
+
+    def __init__(self, path: str, max_pixels: int = 0):
+        """初始化
+
+        Args:
+            path: 图片路径
+            max_pixels: 解码后图片的目标像素数，缩小解码后仍不低于该值；0表示始终按原尺寸解码
+        """
+        self.path = str(path)
+        self.max_pixels = max_pixels
+        self._size = None
+        self._size_read = False
+
+    @property
+    def size(self) -> Optional[Tuple[int, int]]:
+        """原图尺寸 (宽, 高)，只读取文件头；无法识别时返回None"""
+        if not self._size_read:
+            self._size_read = True
+            try:
+                with Image.open(self.path) as image:
+                    self._size = image.size
+            except Exception as e:
+                logging.debug(f"无法读取图片尺寸 {self.path}: {str(e)}")
+        return self._size
+
+    @property
+    def reduction(self) -> int:
+        """解码时的缩小倍数"""
+        if self.max_pixels <= 0 or self.size is None:
+            return 1
+        width, height = self.size
+        for factor in (8, 4, 2):
+            if (width // factor) * (height // factor) >= self.max_pixels:
+                return factor
+        return 1
+
+    def estimated_bytes(self) -> Optional[int]:
+        """解码后图片占用的内存（字节），尺寸未知时返回None"""
+        if self.size is None:
+            return None
+        factor = self.reduction
+        width, height = self.size
+        return (width // factor) * (height // factor) * 3
+
+    def read(self) -> np.ndarray:
+        """解码图片（BGR）"""
+        image = cv2.imread(self.path, self.REDUCED_FLAGS[self.reduction])
+        if image is None:
+            raise ValueError(f"无法读取图片: {self.path}")
+        return image
@@ -0,0 +1,149 @@
+import os
+import json
+import logging
+from typing import Dict, List, Any, Optional
+
+
+class RunJournal:
+    """批处理运行的检查点日志（仅追加的JSONL）
+
+    按图片、按页面记录各阶段的完成情况：
+    - detected: 图片已完成页面检测，记录页面数；PDF等多页文档逐页渲染，
+      开始处理时先记录未知的页面数，全部页面检测完成后再记录页面数和各页面的标题
+    - ocr: 页面已完成OCR，记录原始文本
+    - enhanced: 页面已完成文本优化，记录优化后文本
+    - written: 页面已写入输出文件
+
+    程序中断后重新运行时，已完成的页面直接复用日志中的结果，只重做未完成的页面。
+    图片文件的大小或修改时间变化后，该图片的记录将被忽略。
+    """
+
+    def __init__(self, journal_path: str, resume: bool = True):
+        """初始化检查点日志
+
+        Args:
+            journal_path: 日志文件路径
+            resume: 是否从已有日志恢复，为False时清空已有日志
+        """
+        self.journal_path = journal_path
+        self.images: Dict[str, Dict[str, Any]] = {}
+
+        os.makedirs(os.path.dirname(journal_path) or '.', exist_ok=True)
+        if resume:
+            self._replay()
+        elif os.path.exists(journal_path):
+            os.remove(journal_path)
+
+        self._file = open(journal_path, 'a', encoding='utf-8')
+        if self.images:
+            finished = sum(
+                1 for state in self.images.values()
+                for page in state['pages'].values() if 'text' in page
+            )
+            logging.info(f"从检查点恢复：{len(self.images)} 张图片，{finished} 个页面已完成")
+
+    @staticmethod
+    def file_signature(image_path: str) -> str:
+        """图片文件的签名（大小+修改时间），用于判断文件是否被修改"""
+        stat = os.stat(image_path)
+        return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+    def _replay(self):
+        """重放日志，恢复各图片的处理状态"""
+        if not os.path.exists(self.journal_path):
+            return
+        with open(self.journal_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # 中断时最后一行可能不完整
+                    continue
+                self._apply(record)
+
+    def _apply(self, record: Dict[str, Any]):
+        """将单条记录应用到内存状态"""
+        image = record['image']
+        if record['event'] == 'detected':
+            state = self.images.get(image)
+            # 文档检测完成：保留检测期间已记录的页面进度
+            if state is None or state['total_pages'] is not None or state['signature'] != record['signature']:
+                state = {'pages': {}}
+            state.update(signature=record['signature'], total_pages=record['pages'],
+                         labels=record.get('labels'))
+            self.images[image] = state
+            return
+
+        state = self.images.get(image)
+        if state is None:
+            return
+        page = state['pages'].setdefault(record['page'], {})
+        if record['event'] == 'ocr':
+            page['raw_text'] = record['raw_text']
+        elif record['event'] == 'enhanced':
+            page['text'] = record['text']
+        elif record['event'] == 'written':
+            page['written'] = True
+
+    def _append(self, record: Dict[str, Any]):
+        """追加一条记录并立即刷新"""
+        self._apply(record)
+        self._file.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self._file.flush()
+
+    def image_state(self, image_path: str) -> Optional[Dict[str, Any]]:
+        """返回图片的已记录状态，文件已被修改或没有记录时返回None"""
+        state = self.images.get(image_path)
+        if state is None:
+            return None
+        try:
+            if state['signature'] != self.file_signature(image_path):
+                return None
+        except OSError:
+            return None
+        return state
+
+    @staticmethod
+    def is_complete(state: Optional[Dict[str, Any]]) -> bool:
+        """图片的所有页面是否都已完成文本优化"""
+        if state is None or state['total_pages'] is None:
+            return False
+        return all(
+            'text' in state['pages'].get(page_index, {})
+            for page_index in range(state['total_pages'])
+        )
+
+    def record_detected(self, image_path: str, total_pages: Optional[int], labels: Optional[List[str]] = None):
+        """记录页面数，None表示文档仍在逐页检测中；labels 为文档各页面的标题"""
+        record = {
+            'event': 'detected',
+            'image': image_path,
+            'signature': self.file_signature(image_path),
+            'pages': total_pages,
+        }
+        if labels is not None:
+            record['labels'] = labels
+        self._append(record)
+
+    def record_ocr(self, image_path: str, page_index: int, raw_text: str):
+        self._append({'event': 'ocr', 'image': image_path, 'page': page_index, 'raw_text': raw_text})
+
+    def record_enhanced(self, image_path: str, page_index: int, text: str):
+        self._append({'event': 'enhanced', 'image': image_path, 'page': page_index, 'text': text})
+
+    def record_written(self, image_path: str, page_index: int):
+        self._append({'event': 'written', 'image': image_path, 'page': page_index})
+
+    def close(self):
+        """关闭日志文件"""
+        if self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            self._file = None
+
+    def finish(self):
+        """整批处理全部成功后删除日志，下次运行重新开始"""
+        self.close()
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
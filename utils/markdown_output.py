@@ -0,0 +1,451 @@
+import os
+import json
+import time
+import queue
+import logging
+import threading
+from pathlib import Path
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+
+from utils.file_handler import FileHandler
+from utils.text_formatter import MarkdownNormalizer
+from utils.journal import RunJournal
+from utils.metrics import metrics
+from utils.search_index import NoteSearchIndex
+
+_CLOSE = object()
+
+
+class MarkdownOutput:
+    """增量Markdown输出
+
+    页面结果按输入顺序逐页追加写入，支持三种布局：
+    - single: 所有图片写入 notes.md
+    - per_source: 每张图片一个文件 notes/<图片名>.md，先写入临时文件，图片完成后原子重命名
+    - per_day: 按图片的修改日期写入 notes/<YYYY-MM-DD>.md
+
+    已完整输出的图片记录在 .index.jsonl 中（仅追加），追加模式下重新运行只处理新增或修改过的图片。
+    追加写入的文件会记录最后一张完整图片的结束位置，中断后再次运行时截掉之后不完整的内容；
+    修改过的图片重新输出前，先从追加文件中删除它的旧内容（见 _drop_stale）。
+    有页面失败的图片不会写入，重新运行时由检查点补齐；全部为空白页的图片记录为0页。
+    index.md 目录由输出记录生成，通过临时文件+重命名原子更新。
+    提供全文索引时，每张图片完整输出后把它的页面写入索引。
+    所有磁盘写入都在后台线程中完成，与图片处理重叠进行。
+    """
+
+    LAYOUTS = ('single', 'per_source', 'per_day')
+
+    def __init__(self, output_dir: str, layout: str = 'single', append: bool = True,
+                 index: bool = True, index_interval: float = 5.0, queue_size: int = 256,
+                 search_index: Optional[NoteSearchIndex] = None):
+        """初始化
+
+        Args:
+            output_dir: 输出目录
+            layout: 输出布局，见 LAYOUTS
+            append: 是否在已有输出之后追加；为False时重新生成全部输出
+            index: 是否生成 index.md 目录
+            index_interval: 两次更新目录之间的最短间隔（秒），运行结束时总会更新
+            queue_size: 等待后台线程写入的最大条目数
+            search_index: 全文索引，关闭输出时一并关闭
+        """
+        if layout not in self.LAYOUTS:
+            raise ValueError(f"未知的输出布局: {layout}")
+        self.output_dir = output_dir
+        self.layout = layout
+        self.append = append
+        self.index_enabled = index
+        self.index_interval = index_interval
+        self.manifest_path = os.path.join(output_dir, '.index.jsonl')
+        self.index_path = os.path.join(output_dir, 'index.md')
+        self.search_index = search_index
+
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        # 追加写入的文件（相对路径） -> 最后一张完整图片的结束位置（字节）
+        self.offsets: Dict[str, int] = {}
+        self.count = 0
+        self.images = 0
+
+        self._files = {}
+        self._current = None
+        self._manifest = None
+        self._index_dirty = False
+        self._index_written_at = 0.0
+        self._queue = queue.Queue(queue_size)
+        self._thread = None
+        self._error = None
+
+        os.makedirs(output_dir, exist_ok=True)
+        if append:
+            self._load_manifest()
+
+    def _load_manifest(self):
+        """读取已输出图片的记录"""
+        if not os.path.exists(self.manifest_path):
+            return
+        with open(self.manifest_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                self.entries[record['source']] = record
+                if record.get('offset') is not None:
+                    self.offsets[record['file']] = record['offset']
+        # 删除旧内容时在替换输出记录之后、替换文件之前中断：按新的记录完成替换
+        for rel_path, offset in self.offsets.items():
+            tmp = self._compact_path(rel_path)
+            if not os.path.exists(tmp):
+                continue
+            if os.path.getsize(tmp) == offset:
+                os.replace(tmp, os.path.join(self.output_dir, rel_path))
+            else:
+                os.remove(tmp)
+
+    def is_done(self, image_path: str) -> bool:
+        """图片是否已按当前布局完整输出且之后未被修改"""
+        entry = self.entries.get(str(image_path))
+        if entry is None or entry.get('layout') != self.layout:
+            return False
+        try:
+            return entry['signature'] == RunJournal.file_signature(str(image_path))
+        except OSError:
+            return False
+
+    def __enter__(self):
+        self._manifest = open(self.manifest_path, 'a' if self.append else 'w', encoding='utf-8')
+        if self.search_index is not None and not self.append:
+            self.search_index.clear()
+        self._thread = threading.Thread(target=self._run, name='markdown-writer', daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def write(self, content: Dict[str, str]):
+        """提交单个页面的结果（需包含 source 图片路径）"""
+        self._raise_error()
+        self._queue.put(('page', content))
+
+    def finish_image(self, image_path: str, failed: int = 0):
+        """图片的全部页面已提交
+
+        Args:
+            image_path: 图片路径
+            failed: 该图片处理失败的页面数
+        """
+        self._raise_error()
+        self._queue.put(('image', str(image_path), failed))
+
+    def close(self):
+        """等待后台写入完成并关闭所有文件"""
+        if self._thread is not None:
+            self._queue.put(_CLOSE)
+            self._thread.join()
+            self._thread = None
+
+        if self._current is not None:
+            # 未完成的图片：临时文件直接丢弃，追加文件中的内容在下次运行时截掉
+            if self._current.get('tmp'):
+                self._current['handle'].close()
+                os.remove(self._current['tmp'])
+            self._current = None
+        for handle in self._files.values():
+            handle.close()
+        self._files = {}
+
+        if self._manifest is not None:
+            self._manifest.close()
+            self._manifest = None
+            if self._index_dirty and self._error is None:
+                self._write_index()
+            logging.info(f"Markdown输出完成：{self.images} 张图片，{self.count} 个页面")
+        if self.search_index is not None:
+            self.search_index.close()
+            self.search_index = None
+        self._raise_error()
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise self._error
+
+    def _run(self):
+        """后台写入线程"""
+        while True:
+            op = self._queue.get()
+            if op is _CLOSE:
+                return
+            if self._error is not None:
+                continue
+            try:
+                if op[0] == 'page':
+                    self._write_page(op[1])
+                else:
+                    self._finish_image(op[1], op[2])
+            except Exception as e:
+                logging.error(f"写入Markdown时出错: {str(e)}")
+                self._error = e
+
+    def _target(self, image_path: str) -> str:
+        """图片对应的输出文件（相对输出目录）"""
+        if self.layout == 'single':
+            return 'notes.md'
+        if self.layout == 'per_source':
+            return f"notes/{Path(image_path).stem}.md"
+        mtime = os.path.getmtime(image_path)
+        return f"notes/{time.strftime('%Y-%m-%d', time.localtime(mtime))}.md"
+
+    def _open_append(self, rel_path: str):
+        """打开追加写入的文件：已知文件截掉不完整的尾部，未知文件重新生成"""
+        handle = self._files.get(rel_path)
+        if handle is not None:
+            return handle
+        path = os.path.join(self.output_dir, rel_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        offset = self.offsets.get(rel_path)
+        if offset is not None and os.path.exists(path):
+            handle = open(path, 'r+b')
+            size = handle.seek(0, os.SEEK_END)
+            if size > offset:
+                logging.warning(f"{rel_path} 末尾有 {size - offset} 字节未完成的内容，已截除")
+                handle.truncate(offset)
+            handle.seek(offset)
+        else:
+            handle = open(path, 'wb')
+        self._files[rel_path] = handle
+        return handle
+
+    def _compact_path(self, rel_path: str) -> str:
+        path = os.path.join(self.output_dir, rel_path)
+        return os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.compact")
+
+    def _drop_stale(self, image_path: str):
+        """删除修改过的图片在之前的输出中的内容，避免重新输出后重复
+
+        追加文件中每张图片的内容从前一条记录的结束位置到它自己的结束位置。
+        删除后文件经临时文件替换，之后各图片的结束位置前移，输出记录整体重写（按结束位置排序，
+        每个文件的最后一条记录即文件末尾）。先替换输出记录再替换文件，中断时由 _load_manifest 完成替换。
+        """
+        entry = self.entries.get(image_path)
+        if entry is None or entry.get('layout') != self.layout or entry.get('offset') is None:
+            # 每张图片一个文件的布局重新输出时整体替换，不需要删除
+            return
+        del self.entries[image_path]
+        self._index_dirty = True
+        rel_path = entry['file']
+        path = os.path.join(self.output_dir, rel_path)
+
+        end = entry['offset']
+        start = max((e['offset'] for e in self.entries.values()
+                     if e.get('layout') == self.layout and e.get('file') == rel_path
+                     and e.get('offset') is not None and e['offset'] < end), default=0)
+        handle = self._files.pop(rel_path, None)
+        if handle is not None:
+            handle.close()
+        if not os.path.exists(path):
+            return
+        with open(path, 'rb') as f:
+            data = f.read(self.offsets.get(rel_path, end))
+        shift = end - start
+        tmp = self._compact_path(rel_path)
+        with open(tmp, 'wb') as f:
+            f.write(data[:start] + data[end:])
+            f.flush()
+            os.fsync(f.fileno())
+
+        for other in self.entries.values():
+            if (other.get('layout') == self.layout and other.get('file') == rel_path
+                    and other.get('offset') is not None and other['offset'] > end):
+                other['offset'] -= shift
+        self.offsets[rel_path] = len(data) - shift
+        self._rewrite_manifest()
+        os.replace(tmp, path)
+        if self.search_index is not None:
+            self.search_index.replace_source(image_path, rel_path, [])
+        logging.info(f"已从 {rel_path} 中删除 {Path(image_path).name} 的旧内容（{shift} 字节）")
+
+    def _rewrite_manifest(self):
+        """按当前记录重写 .index.jsonl（临时文件+重命名）"""
+        self._manifest.close()
+        tmp = self.manifest_path + '.tmp'
+        records = sorted(self.entries.values(), key=lambda record: record.get('offset') or 0)
+        with open(tmp, 'w', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.manifest_path)
+        self._manifest = open(self.manifest_path, 'a', encoding='utf-8')
+
+    def _start_image(self, image_path: str):
+        self._drop_stale(image_path)
+        rel_path = self._target(image_path)
+        if self.layout == 'per_source':
+            path = os.path.join(self.output_dir, rel_path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.tmp")
+            self._current = {'source': image_path, 'file': rel_path, 'tmp': tmp,
+                             'handle': open(tmp, 'wb'), 'pages': 0, 'contents': []}
+        else:
+            handle = self._open_append(rel_path)
+            self._current = {'source': image_path, 'file': rel_path, 'handle': handle,
+                             'start': handle.tell(), 'pages': 0, 'contents': []}
+
+    def _write_page(self, content: Dict[str, str]):
+        with metrics.timer('write'):
+            source = str(content['source'])
+            if self._current is None or self._current['source'] != source:
+                self._start_image(source)
+            entry = FileHandler.format_markdown_entry(content).encode('utf-8')
+            handle = self._current['handle']
+            handle.write(entry)
+            handle.flush()
+        self._current['pages'] += 1
+        if self.search_index is not None:
+            # 索引与输出文件中相同的规范化文本
+            self._current['contents'].append({'filename': content['filename'],
+                                              'text': MarkdownNormalizer.normalize(content['text'])})
+        self.count += 1
+        metrics.increment('output.chars', len(entry))
+
+    def _finish_image(self, image_path: str, failed: int):
+        current = self._current
+        if current is None or current['source'] != image_path:
+            if not failed:
+                # 所有页面都是空白页：没有输出内容，但同样记录为已完成，之后不再重复识别
+                self._drop_stale(image_path)
+                entry = self.entries.get(image_path)
+                if entry is not None and entry.get('layout') == self.layout and entry.get('file'):
+                    path = os.path.join(self.output_dir, entry['file'])
+                    if os.path.exists(path):
+                        os.remove(path)
+                self._record_image(image_path, None, 0, None, [])
+            return
+        self._current = None
+        handle = current['handle']
+
+        if failed:
+            # 丢弃部分完成的图片，重新运行时由检查点补齐
+            if current.get('tmp'):
+                handle.close()
+                os.remove(current['tmp'])
+            else:
+                handle.truncate(current['start'])
+                handle.seek(current['start'])
+            self.count -= current['pages']
+            logging.warning(f"{Path(image_path).name} 有 {failed} 个页面处理失败，暂不写入输出")
+            return
+
+        offset = None
+        if current.get('tmp'):
+            handle.close()
+            os.replace(current['tmp'], os.path.join(self.output_dir, current['file']))
+        else:
+            os.fsync(handle.fileno())
+            offset = handle.tell()
+            self.offsets[current['file']] = offset
+
+        self._record_image(image_path, current['file'], current['pages'], offset, current['contents'])
+
+    def _record_image(self, image_path: str, rel_path: Optional[str], pages: int, offset: Optional[int],
+                      contents: List[Dict[str, str]]):
+        """在输出记录中登记一张完整输出的图片，并更新全文索引与目录"""
+        record = {
+            'source': image_path,
+            'signature': RunJournal.file_signature(image_path),
+            'layout': self.layout,
+            'file': rel_path,
+            'title': Path(image_path).stem,
+            'pages': pages,
+            'offset': offset,
+            'written_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+        }
+        self.entries[image_path] = record
+        self._manifest.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self._manifest.flush()
+        self.images += 1
+        if self.search_index is not None:
+            with metrics.timer('search.index'):
+                self.search_index.replace_source(image_path, rel_path, contents)
+
+        self._index_dirty = True
+        if time.monotonic() - self._index_written_at >= self.index_interval:
+            self._write_index()
+
+    def iter_written_pages(self) -> Iterator[Tuple[str, str, List[Dict[str, str]]]]:
+        """解析已输出的Markdown文件，产出 (图片路径, 输出文件, 页面列表)，用于重建全文索引
+
+        追加写入的文件按输出记录中各图片的结束位置划分，之后被重新输出的旧内容跳过；
+        每个页面以“# 图片名 (”开头的标题行起始、以分隔线结束。
+        """
+        separator = '\n\n---\n\n'
+        ranges: Dict[str, List[Tuple[int, Dict[str, Any]]]] = {}
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    if record.get('layout') == self.layout and record.get('file'):
+                        ranges.setdefault(record['file'], []).append((record.get('offset') or 0, record))
+
+        for rel_path, records in ranges.items():
+            path = os.path.join(self.output_dir, rel_path)
+            if not os.path.exists(path):
+                continue
+            with open(path, 'rb') as f:
+                data = f.read()
+            records.sort(key=lambda item: item[0])
+            start = 0
+            for offset, record in records:
+                if record.get('offset') is None:
+                    # 每张图片一个文件，重新输出时整体替换，文件内容属于最后写入的图片
+                    if record is not records[-1][1]:
+                        continue
+                    chunk = data
+                else:
+                    chunk, start = data[start:offset], offset
+                # 之后被重新输出的图片，这里是过期的内容
+                if self.entries.get(record['source']) != record:
+                    continue
+                chunk = chunk.decode('utf-8', errors='replace')
+                head = f"# {record['title']} ("
+                if not chunk.startswith(head) or not chunk.endswith(separator):
+                    logging.warning(f"{rel_path} 中 {record['title']} 的内容无法解析，已跳过")
+                    continue
+                pages = []
+                for part in chunk[len(head):-len(separator)].split(separator + head):
+                    label, _, text = part.partition('\n\n')
+                    pages.append({'filename': f"{record['title']} ({label}", 'text': text})
+                yield record['source'], rel_path, pages
+
+    def _write_index(self):
+        """重新生成 index.md（临时文件+重命名）"""
+        if not self.index_enabled:
+            return
+        groups: Dict[str, list] = {}
+        for entry in self.entries.values():
+            # 全部为空白页的图片没有输出文件
+            if entry.get('layout') == self.layout and entry.get('file'):
+                groups.setdefault(entry['file'], []).append(entry)
+
+        lines = ['# 笔记索引', '']
+        for rel_path, entries in groups.items():
+            if self.layout == 'per_source':
+                entry = entries[-1]
+                lines.append(f"- [{entry['title']}]({rel_path})（{entry['pages']} 页，{entry['written_at']}）")
+                continue
+            lines.append(f"## [{rel_path}]({rel_path})")
+            lines.append('')
+            for entry in entries:
+                lines.append(f"- {entry['title']}（{entry['pages']} 页，{entry['written_at']}）")
+            lines.append('')
+
+        tmp = self.index_path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(tmp, self.index_path)
+        self._index_dirty = False
+        self._index_written_at = time.monotonic()
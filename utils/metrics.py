@@ -0,0 +1,210 @@
+import os
+import re
+import json
+import time
+import logging
+import threading
+from collections import deque, defaultdict
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Dict, Any, List
+
+import numpy as np
+
+
+class Metrics:
+    """进程内的性能指标记录器
+
+    - 耗时（observe/timer）：按阶段记录每次耗时，用于计算 p50/p95/p99
+    - 计数（increment）：上传字节数、token用量、重试次数等累加值
+
+    进程池中的工作进程通过 drain() 导出新增样本，由主进程 merge() 合并。
+    """
+
+    QUANTILES = (0.5, 0.95, 0.99)
+
+    def __init__(self, max_samples: int = 10000):
+        """初始化
+
+        Args:
+            max_samples: 每个阶段保留用于计算分位数的最近样本数
+        """
+        self.max_samples = max_samples
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+        self._samples = defaultdict(lambda: deque(maxlen=self.max_samples))
+        self._totals = defaultdict(float)
+        self._counts = defaultdict(int)
+        self._counters = defaultdict(float)
+        self._pending = []
+        self._track_pending = False
+        self._server = None
+
+    def reset(self):
+        """清空所有指标，开始新的一次运行"""
+        with self._lock:
+            self.started_at = time.time()
+            self._samples.clear()
+            self._totals.clear()
+            self._counts.clear()
+            self._counters.clear()
+            self._pending = []
+
+    def observe(self, stage: str, seconds: float):
+        """记录一次阶段耗时"""
+        with self._lock:
+            self._samples[stage].append(seconds)
+            self._totals[stage] += seconds
+            self._counts[stage] += 1
+            if self._track_pending:
+                self._pending.append(('observe', stage, seconds))
+
+    def increment(self, name: str, value: float = 1):
+        """累加计数"""
+        if not value:
+            return
+        with self._lock:
+            self._counters[name] += value
+            if self._track_pending:
+                self._pending.append(('increment', name, value))
+
+    @contextmanager
+    def timer(self, stage: str):
+        """记录代码块耗时"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def enable_export(self):
+        """在工作进程中调用：记录新增样本以便通过drain()导出"""
+        self._track_pending = True
+
+    def drain(self) -> List[tuple]:
+        """导出并清空自上次调用以来的新增样本"""
+        with self._lock:
+            pending, self._pending = self._pending, []
+        return pending
+
+    def merge(self, samples: List[tuple]):
+        """合并工作进程导出的样本"""
+        for kind, name, value in samples:
+            if kind == 'observe':
+                self.observe(name, value)
+            else:
+                self.increment(name, value)
+
+    def counter(self, name: str) -> float:
+        with self._lock:
+            return self._counters.get(name, 0)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """当前指标的快照"""
+        with self._lock:
+            elapsed = time.time() - self.started_at
+            stages = {}
+            for stage, samples in self._samples.items():
+                values = np.fromiter(samples, dtype=float)
+                stages[stage] = {
+                    'count': self._counts[stage],
+                    'total_seconds': self._totals[stage],
+                    'mean_seconds': self._totals[stage] / max(self._counts[stage], 1),
+                    **{
+                        f"p{int(q * 100)}_seconds": float(np.quantile(values, q)) if len(values) else 0.0
+                        for q in self.QUANTILES
+                    },
+                }
+            counters = dict(self._counters)
+
+        pages = counters.get('pages.written', 0)
+        return {
+            'started_at': self.started_at,
+            'elapsed_seconds': elapsed,
+            'pages_per_minute': pages / elapsed * 60 if elapsed > 0 else 0.0,
+            'stages': stages,
+            'counters': counters,
+        }
+
+    def summary_table(self) -> str:
+        """生成各阶段耗时的文本汇总表"""
+        snapshot = self.snapshot()
+        header = f"{'stage':<24}{'count':>8}{'total(s)':>10}{'mean(s)':>10}{'p50(s)':>10}{'p95(s)':>10}{'p99(s)':>10}"
+        rows = [header, '-' * len(header)]
+        for stage, stats in sorted(snapshot['stages'].items()):
+            rows.append(
+                f"{stage:<24}{stats['count']:>8}{stats['total_seconds']:>10.2f}{stats['mean_seconds']:>10.3f}"
+                f"{stats['p50_seconds']:>10.3f}{stats['p95_seconds']:>10.3f}{stats['p99_seconds']:>10.3f}"
+            )
+        rows.append('-' * len(header))
+        for name, value in sorted(snapshot['counters'].items()):
+            rows.append(f"{name:<40}{value:>16,.0f}")
+        rows.append(f"总耗时 {snapshot['elapsed_seconds']:.1f} 秒，吞吐量 {snapshot['pages_per_minute']:.1f} 页/分钟")
+        return '\n'.join(rows)
+
+    def write_report(self, output_dir: str) -> str:
+        """将指标写入JSON报告，返回报告路径"""
+        os.makedirs(output_dir, exist_ok=True)
+        report_path = os.path.join(
+            output_dir, time.strftime('run-%Y%m%d-%H%M%S.json', time.localtime(self.started_at))
+        )
+        with open(report_path, 'w', encoding='utf-8') as f:
+            json.dump(self.snapshot(), f, ensure_ascii=False, indent=2)
+        return report_path
+
+    @staticmethod
+    def _metric_name(name: str) -> str:
+        return re.sub(r'[^a-zA-Z0-9_]', '_', name)
+
+    def prometheus_text(self) -> str:
+        """以Prometheus文本格式导出指标"""
+        snapshot = self.snapshot()
+        lines = [
+            '# TYPE noteocr_stage_seconds summary',
+        ]
+        for stage, stats in sorted(snapshot['stages'].items()):
+            for q in self.QUANTILES:
+                lines.append(
+                    f'noteocr_stage_seconds{{stage="{stage}",quantile="{q}"}} {stats[f"p{int(q * 100)}_seconds"]}'
+                )
+            lines.append(f'noteocr_stage_seconds_sum{{stage="{stage}"}} {stats["total_seconds"]}')
+            lines.append(f'noteocr_stage_seconds_count{{stage="{stage}"}} {stats["count"]}')
+        for name, value in sorted(snapshot['counters'].items()):
+            metric = f"noteocr_{self._metric_name(name)}_total"
+            lines.append(f'# TYPE {metric} counter')
+            lines.append(f'{metric} {value}')
+        lines.append('# TYPE noteocr_pages_per_minute gauge')
+        lines.append(f"noteocr_pages_per_minute {snapshot['pages_per_minute']}")
+        return '\n'.join(lines) + '\n'
+
+    def start_http_server(self, port: int, host: str = '127.0.0.1'):
+        """在后台线程中提供 /metrics 接口，默认只监听本机"""
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != '/metrics':
+                    self.send_error(404)
+                    return
+                body = registry.prometheus_text().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        logging.info(f"指标接口已启动: http://{host}:{port}/metrics")
+
+    def stop_http_server(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+metrics = Metrics()
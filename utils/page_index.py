@@ -0,0 +1,140 @@
+import os
+import time
+import sqlite3
+import threading
+from dataclasses import dataclass
+from typing import List, Optional
+
+import numpy as np
+
+from utils.metrics import metrics
+
+# 每个字节中1的个数，用于按字节查表计算汉明距离
+_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint16)
+
+
+@dataclass(eq=False)
+class IndexedPage:
+    """索引中的一个页面"""
+    page_info: str
+    source: str
+    hash: bytes
+    # 页面的最终文本；页面仍在处理中时 done 为False，处理失败时 text 为None，空白页面为空字符串
+    text: Optional[str] = None
+    done: bool = False
+    # 去重分组（如服务模式下的客户端），只与同一分组的页面匹配；为None时不分组
+    group: Optional[str] = None
+
+    @property
+    def failed(self) -> bool:
+        return self.done and self.text is None
+
+
+class PageHashIndex:
+    """页面感知哈希的索引，按汉明距离查找近似重复的页面
+
+    哈希按行存放在一个按需扩容的 uint8 矩阵中，查找时对所有行做一次向量化的异或与查表计数，
+    十万个页面的查找在毫秒级完成。处理中的页面也会加入索引，同一批中重复拍摄的页面
+    等待先到的页面完成后复用其结果，而不是各自调用API。
+
+    提供 db_path 时，完成的页面写入SQLite，之后的运行可以复用；
+    scope 应包含影响页面文本的全部参数（预处理档位、模型、提示词等），参数变化后不再复用旧结果。
+    分组的页面只在本次运行中与同一分组的页面去重，不写入SQLite。
+    """
+
+    def __init__(self, max_distance: int = 48, db_path: Optional[str] = None, scope: str = '',
+                 refresh: bool = False):
+        """初始化
+
+        Args:
+            max_distance: 视为重复页面的最大汉明距离
+            db_path: 持久化的SQLite数据库路径，为None时只在本次运行中去重
+            scope: 结果适用的参数范围
+            refresh: 是否忽略已持久化的页面（仍会写入新的页面）
+        """
+        self.max_distance = max_distance
+        self.scope = scope
+        self.pages: List[IndexedPage] = []
+        self._matrix: Optional[np.ndarray] = None
+        self._lock = threading.Lock()
+        self._conn = None
+
+        if db_path is None:
+            return
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS pages (
+                scope TEXT NOT NULL,
+                hash BLOB NOT NULL,
+                page_info TEXT NOT NULL,
+                source TEXT NOT NULL,
+                text TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_pages_scope ON pages (scope)')
+        self._conn.commit()
+        if refresh:
+            return
+        rows = self._conn.execute(
+            'SELECT hash, page_info, source, text FROM pages WHERE scope = ?', (scope,)
+        ).fetchall()
+        for page_hash, page_info, source, text in rows:
+            self._append(IndexedPage(page_info, source, page_hash, text, done=True))
+
+    def __len__(self) -> int:
+        return len(self.pages)
+
+    def _append(self, page: IndexedPage):
+        row = np.frombuffer(page.hash, dtype=np.uint8)
+        count = len(self.pages)
+        if self._matrix is None:
+            self._matrix = np.empty((64, row.size), dtype=np.uint8)
+        elif count == len(self._matrix):
+            # 容量翻倍，加入页面的均摊开销为常数
+            self._matrix = np.concatenate([self._matrix, np.empty_like(self._matrix)])
+        self._matrix[count] = row
+        self.pages.append(page)
+
+    def lookup(self, page_hash: bytes, group: Optional[str] = None) -> Optional[IndexedPage]:
+        """查找同一分组中汉明距离不超过 max_distance 的最近页面，跳过处理失败的页面"""
+        with self._lock:
+            if not self.pages:
+                return None
+            query = np.frombuffer(page_hash, dtype=np.uint8)
+            distances = _POPCOUNT[np.bitwise_xor(self._matrix[:len(self.pages)], query)].sum(axis=1)
+            candidates = np.flatnonzero(distances <= self.max_distance)
+            for index in candidates[np.argsort(distances[candidates])]:
+                page = self.pages[index]
+                if not page.failed and page.group == group:
+                    # 汉明距离不是耗时，累加为计数，除以 dedup.pages 即为平均距离
+                    metrics.increment('dedup.distance_sum', int(distances[index]))
+                    return page
+            return None
+
+    def add(self, page_hash: bytes, page_info: str, source: str, group: Optional[str] = None) -> IndexedPage:
+        """加入一个处理中的页面"""
+        page = IndexedPage(page_info, source, page_hash, group=group)
+        with self._lock:
+            self._append(page)
+        return page
+
+    def resolve(self, page: IndexedPage, text: Optional[str]):
+        """页面处理完成，处理失败时 text 为None"""
+        page.text = text
+        page.done = True
+        if self._conn is None or not text or page.group is not None:
+            return
+        with self._lock:
+            self._conn.execute(
+                'INSERT INTO pages (scope, hash, page_info, source, text, created_at) VALUES (?, ?, ?, ?, ?, ?)',
+                (self.scope, page.hash, page.page_info, page.source, text, time.time())
+            )
+            self._conn.commit()
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
@@ -0,0 +1,265 @@
+import time
+import random
+import asyncio
+import logging
+import threading
+from typing import Callable, Optional, Any, Tuple
+
+import openai
+
+from utils.metrics import metrics
+
+
+class TokenBucket:
+    """自适应令牌桶限流器
+
+    以预约方式发放令牌：reserve() 返回调用方需要等待的秒数，
+    因此同一个实例可以同时服务线程（time.sleep）和协程（asyncio.sleep）。
+    收到429时速率减半并在Retry-After期间暂停发放，之后每次成功逐步恢复到配置的速率。
+    """
+
+    def __init__(self, rate: float, burst: Optional[float] = None, min_rate: float = 0.05):
+        """初始化令牌桶
+
+        Args:
+            rate: 每秒允许的请求数，0表示不限流
+            burst: 桶容量（允许的突发请求数），默认与rate相同
+            min_rate: 自适应降速时的最低速率
+        """
+        self.max_rate = rate
+        self.rate = rate
+        self.min_rate = min(min_rate, rate) if rate > 0 else 0
+        self.capacity = max(burst or rate, 1)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """预约一个令牌，返回需要等待的秒数"""
+        if self.max_rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            self.tokens -= 1
+            wait = 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+            return max(wait, self.blocked_until - now)
+
+    def penalize(self, retry_after: Optional[float] = None):
+        """收到限流响应：降低速率，并在retry_after秒内暂停发放令牌"""
+        if self.max_rate <= 0:
+            return
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            if retry_after:
+                self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+            logging.warning(f"触发限流，速率降至 {self.rate:.2f} 次/秒")
+
+    def reward(self):
+        """请求成功：逐步恢复速率"""
+        if self.max_rate <= 0 or self.rate >= self.max_rate:
+            return
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+
+class CircuitBreaker:
+    """熔断器：连续失败达到阈值后打开，冷却期内请求排队等待，之后放行一个试探请求"""
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def acquire(self) -> Tuple[float, bool]:
+        """请求前检查
+
+        Returns:
+            (需要等待的秒数, 是否为试探请求)；等待时间为0时可以发送请求，
+            否则等待后需要重新检查。试探请求结束时必须调用end_trial()。
+        """
+        with self._lock:
+            if self.opened_at is None:
+                return 0.0, False
+            remaining = self.reset_timeout - (time.monotonic() - self.opened_at)
+            if remaining > 0:
+                return remaining, False
+            if self.trial_in_flight:
+                # 半开状态：等待试探请求的结果
+                return min(self.reset_timeout, 1.0), False
+            self.trial_in_flight = True
+            return 0.0, True
+
+    def end_trial(self):
+        """试探请求结束（包括被取消或被限流），释放试探名额"""
+        with self._lock:
+            self.trial_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self.trial_in_flight = False
+            if self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    logging.error(f"连续失败 {self.failures} 次，熔断 {self.reset_timeout} 秒")
+                self.opened_at = time.monotonic()
+
+
+class ApiGuard:
+    """单个API服务商的限流、重试与熔断
+
+    可重试的错误（429、超时、连接错误、5xx）按带抖动的指数退避重试，
+    并优先遵循服务端返回的Retry-After；其他错误直接抛出。
+    429只降低速率，不计入熔断；熔断打开期间请求等待冷却结束，不直接失败。
+    """
+
+    RETRYABLE_ERRORS = (
+        openai.RateLimitError,
+        openai.APITimeoutError,
+        openai.APIConnectionError,
+        openai.InternalServerError,
+    )
+
+    def __init__(self, name: str, rate: float, max_attempts: int = 3, base_delay: float = 2,
+                 max_delay: float = 60, failure_threshold: int = 5, reset_timeout: float = 30):
+        """初始化
+
+        Args:
+            name: 服务商名称，用于日志
+            rate: 每秒请求数上限，0表示不限流
+            max_attempts: 最大尝试次数（含首次请求）
+            base_delay: 指数退避的基础延迟（秒）
+            max_delay: 单次退避的最大延迟（秒）
+            failure_threshold: 触发熔断的连续失败次数
+            reset_timeout: 熔断冷却时间（秒）
+        """
+        self.name = name
+        self.bucket = TokenBucket(rate)
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.max_attempts = max(max_attempts, 1)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retries = 0
+
+    @staticmethod
+    def retry_after(error: Exception) -> Optional[float]:
+        """从错误响应中解析Retry-After（秒）"""
+        response = getattr(error, 'response', None)
+        if response is None:
+            return None
+        value = response.headers.get('retry-after-ms')
+        if value:
+            try:
+                return float(value) / 1000
+            except ValueError:
+                pass
+        value = response.headers.get('retry-after')
+        try:
+            return float(value) if value else None
+        except ValueError:
+            return None
+
+    def _backoff(self, attempt: int, retry_after: Optional[float]) -> float:
+        """计算第attempt次失败后的等待时间"""
+        # 全抖动指数退避
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+        return max(delay, retry_after or 0)
+
+    def _on_error(self, attempt: int, error: Exception) -> float:
+        """处理一次失败，返回重试前的等待时间；不可重试时重新抛出"""
+        if not isinstance(error, self.RETRYABLE_ERRORS):
+            # 服务可达但请求本身有误，不计入熔断
+            self.breaker.record_success()
+            raise error
+        retry_after = self.retry_after(error)
+        if isinstance(error, openai.RateLimitError):
+            # 限流说明服务可用，只降低速率而不计入熔断；
+            # 最后一次尝试被限流时同样降速，其他并发请求随之放缓
+            metrics.increment(f"rate_limited.{self.name}")
+            self.bucket.penalize(retry_after)
+        else:
+            self.breaker.record_failure()
+        if attempt + 1 >= self.max_attempts:
+            raise error
+        delay = self._backoff(attempt, retry_after)
+        self.retries += 1
+        metrics.increment(f"retries.{self.name}")
+        logging.warning(f"{self.name} 请求失败（第 {attempt + 1} 次）：{str(error)}，{delay:.1f} 秒后重试")
+        return delay
+
+    def _wait_for_breaker(self) -> bool:
+        """熔断打开时等待冷却结束，返回本次请求是否为试探请求"""
+        while True:
+            delay, trial = self.breaker.acquire()
+            if delay <= 0:
+                return trial
+            time.sleep(delay)
+
+    async def _await_breaker(self) -> bool:
+        """_wait_for_breaker的异步版本"""
+        while True:
+            delay, trial = self.breaker.acquire()
+            if delay <= 0:
+                return trial
+            await asyncio.sleep(delay)
+
+    def call(self, func: Callable[[], Any]) -> Any:
+        """同步调用func，带限流、重试和熔断"""
+        for attempt in range(self.max_attempts):
+            trial = self._wait_for_breaker()
+            try:
+                time.sleep(self.bucket.reserve())
+                result = func()
+            except Exception as e:
+                delay = self._on_error(attempt, e)
+            else:
+                self.breaker.record_success()
+                self.bucket.reward()
+                return result
+            finally:
+                if trial:
+                    self.breaker.end_trial()
+            time.sleep(delay)
+
+    async def acall(self, func: Callable[[], Any]) -> Any:
+        """异步调用func（返回协程），带限流、重试和熔断"""
+        for attempt in range(self.max_attempts):
+            trial = await self._await_breaker()
+            try:
+                await asyncio.sleep(self.bucket.reserve())
+                result = await func()
+            except Exception as e:
+                delay = self._on_error(attempt, e)
+            else:
+                self.breaker.record_success()
+                self.bucket.reward()
+                return result
+            finally:
+                # 试探请求被取消或被限流时同样释放名额，否则熔断器无法恢复
+                if trial:
+                    self.breaker.end_trial()
+            await asyncio.sleep(delay)
+
+    @classmethod
+    def from_config(cls, name: str, rate: float, config) -> 'ApiGuard':
+        """根据全局配置创建"""
+        return cls(
+            name,
+            rate,
+            max_attempts=config.MAX_RETRY_ATTEMPTS,
+            base_delay=config.RETRY_DELAY,
+            max_delay=config.RATE_LIMIT_CONFIG['MAX_RETRY_DELAY'],
+            failure_threshold=config.RATE_LIMIT_CONFIG['CIRCUIT_FAILURE_THRESHOLD'],
+            reset_timeout=config.RATE_LIMIT_CONFIG['CIRCUIT_RESET_TIMEOUT']
+        )
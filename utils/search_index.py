@@ -0,0 +1,233 @@
+import os
+import re
+import time
+import sqlite3
+import threading
+from dataclasses import dataclass, asdict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# 中日韩文字：按相邻两字切分建立索引
+_CJK = '\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af'
+_CJK_RE = re.compile(f"[{_CJK}]")
+_TOKEN_RE = re.compile(f"[{_CJK}]+|[^\\W{_CJK}]+")
+# 页面标题：“图片名 (Page i/n)”，文档页面为“文档名 (Page i/n, k/m)”
+_TITLE_RE = re.compile(r'^(?P<stem>.*) \((?P<label>Page (?P<page>\d+)(?:/(?P<total>\d+))?[^)]*)\)$')
+
+# 分词方式变化时递增，打开旧索引时自动按新方式重建全文索引
+_TOKENIZER_VERSION = 1
+
+
+def _index_tokens(text: str) -> str:
+    """建立索引用的词序列：中日韩文字切分为相邻两字（每段最后一个字单独成词），其余按单词切分"""
+    tokens = []
+    for match in _TOKEN_RE.finditer(text):
+        run = match.group()
+        if _CJK_RE.match(run):
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+            tokens.append(run[-1])
+        else:
+            tokens.append(run)
+    return ' '.join(tokens)
+
+
+def _quote(tokens: List[str]) -> str:
+    return '"' + ' '.join(tokens).replace('"', '""') + '"'
+
+
+def build_match_query(query: str) -> str:
+    """把用户输入转换为FTS5查询：以空白分隔的各个词都需出现
+
+    中日韩文字转换为相邻两字组成的短语，与索引的切分方式一致，匹配原文中连续出现的字串；
+    单个汉字按前缀匹配以该字开头的两字词。
+    """
+    clauses = []
+    for term in query.split():
+        phrase = []
+        for match in _TOKEN_RE.finditer(term):
+            run = match.group()
+            if not _CJK_RE.match(run):
+                phrase.append(run)
+            elif len(run) > 1:
+                phrase.extend(run[i:i + 2] for i in range(len(run) - 1))
+            else:
+                # 单字只能按前缀匹配，不能与相邻的词组成短语
+                if phrase:
+                    clauses.append(_quote(phrase))
+                    phrase = []
+                clauses.append(_quote([run]) + ' *')
+        if phrase:
+            clauses.append(_quote(phrase))
+    return ' AND '.join(clauses)
+
+
+def parse_title(title: str) -> Tuple[str, Optional[int], Optional[int]]:
+    """从页面标题中解析 (图片名, 页码, 页数)，无法解析时页码与页数为None"""
+    match = _TITLE_RE.match(title)
+    if match is None:
+        return title, None, None
+    total = match.group('total')
+    return match.group('stem'), int(match.group('page')), int(total) if total else None
+
+
+@dataclass
+class SearchHit:
+    """一个匹配的页面"""
+    title: str
+    source: str
+    file: str
+    page: Optional[int]
+    score: float
+    snippet: str
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+class NoteSearchIndex:
+    """笔记的全文索引（SQLite FTS5）
+
+    页面原文保存在普通表中，FTS5 表不保存内容（contentless），只保存由 _index_tokens
+    切分的词：中文按相邻两字切分，不依赖词典，任意连续字串都能检索。
+    每张图片完整输出后整体替换该图片的页面，重新处理过的图片不会留下旧内容。
+    单字查询按前缀匹配，由单字前缀索引加速。
+    查询按 BM25 排序（标题的权重高于正文），摘要在匹配的页面上截取。
+    """
+
+    SNIPPET_CHARS = 40
+
+    def __init__(self, db_path: str):
+        """初始化
+
+        Args:
+            db_path: SQLite数据库路径
+        """
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS pages (
+                id INTEGER PRIMARY KEY,
+                source TEXT NOT NULL,
+                file TEXT NOT NULL,
+                title TEXT NOT NULL,
+                stem TEXT NOT NULL,
+                page INTEGER,
+                total INTEGER,
+                text TEXT NOT NULL,
+                written_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_pages_source ON pages (source)')
+        version = self._conn.execute('PRAGMA user_version').fetchone()[0]
+        if version != _TOKENIZER_VERSION:
+            self._conn.execute('DROP TABLE IF EXISTS pages_fts')
+        self._conn.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS pages_fts USING fts5("
+            "title, body, content='', prefix='1', tokenize='unicode61 remove_diacritics 2')"
+        )
+        if version != _TOKENIZER_VERSION:
+            rows = self._conn.execute('SELECT id, title, text FROM pages').fetchall()
+            self._conn.executemany(
+                'INSERT INTO pages_fts (rowid, title, body) VALUES (?, ?, ?)',
+                ((row_id, _index_tokens(title), _index_tokens(text)) for row_id, title, text in rows)
+            )
+            self._conn.execute(f'PRAGMA user_version = {_TOKENIZER_VERSION}')
+        self._conn.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM pages').fetchone()[0]
+
+    def _delete_source(self, source: str):
+        rows = self._conn.execute('SELECT id, title, text FROM pages WHERE source = ?', (source,)).fetchall()
+        # 不保存内容的FTS5表需要提供原先写入的词才能删除
+        self._conn.executemany(
+            "INSERT INTO pages_fts (pages_fts, rowid, title, body) VALUES ('delete', ?, ?, ?)",
+            ((row_id, _index_tokens(title), _index_tokens(text)) for row_id, title, text in rows)
+        )
+        self._conn.execute('DELETE FROM pages WHERE source = ?', (source,))
+
+    def _insert(self, source: str, file: str, pages: Iterable[Dict[str, str]], written_at: float):
+        for content in pages:
+            title, text = content['filename'], content['text']
+            stem, page, total = parse_title(title)
+            cursor = self._conn.execute(
+                'INSERT INTO pages (source, file, title, stem, page, total, text, written_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (source, file, title, stem, page, total, text, written_at)
+            )
+            self._conn.execute(
+                'INSERT INTO pages_fts (rowid, title, body) VALUES (?, ?, ?)',
+                (cursor.lastrowid, _index_tokens(title), _index_tokens(text))
+            )
+
+    def replace_source(self, source: str, file: str, pages: List[Dict[str, str]]):
+        """用一张图片的全部页面替换其在索引中的内容
+
+        Args:
+            source: 图片路径
+            file: 页面所在的输出文件（相对输出目录）
+            pages: 页面结果，包含 filename 与 text
+        """
+        with self._lock:
+            with self._conn:
+                self._delete_source(source)
+                self._insert(source, file, pages, time.time())
+
+    def clear(self):
+        with self._lock:
+            with self._conn:
+                self._conn.execute('DELETE FROM pages')
+                self._conn.execute("INSERT INTO pages_fts (pages_fts) VALUES ('delete-all')")
+
+    def search(self, query: str, limit: int = 20, source: Optional[str] = None) -> List[SearchHit]:
+        """查询包含所有关键词的页面，按相关度排序
+
+        Args:
+            query: 以空白分隔的关键词
+            limit: 返回的最大页面数
+            source: 只在该图片的页面中查询
+        """
+        match = build_match_query(query)
+        if not match:
+            return []
+        sql = ('SELECT p.title, p.source, p.file, p.page, p.text, bm25(pages_fts, 5.0, 1.0) AS score '
+               'FROM pages_fts JOIN pages p ON p.id = pages_fts.rowid WHERE pages_fts MATCH ?')
+        params: List[Any] = [match]
+        if source is not None:
+            sql += ' AND p.source = ?'
+            params.append(source)
+        sql += ' ORDER BY score LIMIT ?'
+        params.append(limit)
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        terms = query.split()
+        return [
+            SearchHit(title, source, file, page, round(-score, 4), self._snippet(text, terms))
+            for title, source, file, page, text, score in rows
+        ]
+
+    def _snippet(self, text: str, terms: List[str]) -> str:
+        """截取第一个关键词附近的原文，关键词以 ** 标出"""
+        lowered = text.lower()
+        position, length = -1, 0
+        for term in terms:
+            found = lowered.find(term.lower())
+            if found >= 0 and (position < 0 or found < position):
+                position, length = found, len(term)
+        if position < 0:
+            return ' '.join(text[:self.SNIPPET_CHARS * 2].split())
+        start = max(position - self.SNIPPET_CHARS, 0)
+        end = position + length + self.SNIPPET_CHARS
+        snippet = (text[start:position] + '**' + text[position:position + length] + '**'
+                   + text[position + length:end])
+        snippet = ' '.join(snippet.split())
+        return ('…' if start > 0 else '') + snippet + ('…' if end < len(text) else '')
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
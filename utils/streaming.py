@@ -0,0 +1,77 @@
+import time
+from types import SimpleNamespace
+from typing import Any, Callable, Optional, List
+
+from utils.metrics import metrics
+
+# 流式输出的回调，参数为目前为止收到的全部文本
+PartialCallback = Callable[[str], None]
+
+
+class StreamedCompletion:
+    """流式响应汇总后的结果，choices 和 usage 与非流式响应的字段一致，调用方无需区分"""
+
+    def __init__(self, content: str, finish_reason: Optional[str], usage: Any):
+        self.content = content
+        self.finish_reason = finish_reason
+        self.usage = usage
+        self.choices = [SimpleNamespace(message=SimpleNamespace(content=content), finish_reason=finish_reason)]
+
+
+class _Collector:
+    """累积流式响应的文本片段，并按间隔回调部分结果"""
+
+    def __init__(self, stage: str, on_partial: Optional[PartialCallback], interval: float):
+        self.stage = stage
+        self.on_partial = on_partial
+        self.interval = interval
+        self.parts: List[str] = []
+        self.finish_reason = None
+        self.usage = None
+        self.started = time.perf_counter()
+        self.emitted = 0.0
+
+    def add(self, chunk):
+        if getattr(chunk, 'usage', None):
+            self.usage = chunk.usage
+        for choice in chunk.choices:
+            if choice.finish_reason:
+                self.finish_reason = choice.finish_reason
+            content = choice.delta.content if choice.delta else None
+            if not content:
+                continue
+            if not self.parts:
+                metrics.observe(f'{self.stage}.first_token', time.perf_counter() - self.started)
+            self.parts.append(content)
+            now = time.perf_counter()
+            if self.on_partial and now - self.emitted >= self.interval:
+                self.emitted = now
+                self.on_partial(''.join(self.parts))
+
+    def result(self) -> StreamedCompletion:
+        return StreamedCompletion(''.join(self.parts), self.finish_reason, self.usage)
+
+
+def collect_stream(stream, stage: str, on_partial: Optional[PartialCallback] = None,
+                   interval: float = 0.5) -> StreamedCompletion:
+    """读取同步的流式响应
+
+    Args:
+        stream: chat.completions.create(stream=True) 返回的流
+        stage: 阶段名称，用于记录首个token的延迟（<stage>.first_token）
+        on_partial: 部分结果回调，参数为目前为止的全部文本
+        interval: 两次回调之间的最短间隔（秒）
+    """
+    collector = _Collector(stage, on_partial, interval)
+    for chunk in stream:
+        collector.add(chunk)
+    return collector.result()
+
+
+async def acollect_stream(stream, stage: str, on_partial: Optional[PartialCallback] = None,
+                          interval: float = 0.5) -> StreamedCompletion:
+    """读取异步的流式响应，参数同 collect_stream"""
+    collector = _Collector(stage, on_partial, interval)
+    async for chunk in stream:
+        collector.add(chunk)
+    return collector.result()
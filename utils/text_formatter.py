@@ -0,0 +1,124 @@
+import json
+from typing import Dict, Iterable, Iterator, TextIO
+
+
+class MarkdownNormalizer:
+    """页面文本的Markdown规范化
+
+    单遍扫描的状态机，只保存“是否处于列表中”一个状态，每行按首字符分派，
+    不使用正则表达式，也不缓存整段列表：
+    - 空行原样保留，结束列表时额外空一行
+    - 以 ### 开头的行改为前后空行的二级标题
+    - 以 - 开头的行作为列表项原样保留，以“数字.”开头的行规范为“1. ”
+    - 其余行去掉首尾空白
+    """
+
+    @staticmethod
+    def _number_prefix(line: str) -> int:
+        """“数字.”前缀的长度，不是编号列表项时返回0"""
+        end = 0
+        length = len(line)
+        while end < length and line[end].isdecimal():
+            end += 1
+        if end and end < length and line[end] == '.':
+            return end + 1
+        return 0
+
+    @staticmethod
+    def iter_lines(text: str) -> Iterator[str]:
+        """逐行产出规范化后的行（不含换行符）"""
+        number_prefix = MarkdownNormalizer._number_prefix
+        in_list = False
+        for line in text.split('\n'):
+            line = line.strip()
+            if not line:
+                piece = '\n' if in_list else ''
+                in_list = False
+            else:
+                first = line[0]
+                prefix = number_prefix(line) if first.isdecimal() else 0
+                if first == '#' and line.startswith('###'):
+                    piece = f"\n## {line.lstrip('#').strip()}\n"
+                    in_list = False
+                elif first == '-':
+                    piece = line
+                    in_list = True
+                elif prefix:
+                    piece = f"1. {line[prefix:].strip()}"
+                    in_list = True
+                else:
+                    piece = line
+                    in_list = False
+            yield piece
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        return '\n'.join(MarkdownNormalizer.iter_lines(text))
+
+
+class EntryFormatter:
+    """页面结果的输出格式：每个页面由 header、规范化后的正文和 footer 组成"""
+
+    name = ''
+
+    def header(self, content: Dict[str, str]) -> str:
+        return ''
+
+    def footer(self, content: Dict[str, str]) -> str:
+        return ''
+
+    def format_entry(self, content: Dict[str, str]) -> str:
+        return self.header(content) + MarkdownNormalizer.normalize(content['text']) + self.footer(content)
+
+    def write(self, f: TextIO, text_contents: Iterable[Dict[str, str]]):
+        """把页面结果逐页写入文件，不在内存中拼接整个输出"""
+        for content in text_contents:
+            f.write(self.format_entry(content))
+
+
+class MarkdownFormatter(EntryFormatter):
+    """Markdown：页面标题为一级标题，页面之间以分隔线隔开"""
+
+    name = 'markdown'
+
+    def header(self, content: Dict[str, str]) -> str:
+        return f"# {content['filename']}\n\n"
+
+    def footer(self, content: Dict[str, str]) -> str:
+        return '\n\n---\n\n'
+
+
+class TextFormatter(EntryFormatter):
+    """纯文本：页面之前是来源标题框"""
+
+    name = 'txt'
+
+    def header(self, content: Dict[str, str]) -> str:
+        rule = '=' * 50
+        return f"\n{rule}\nSource: {content['filename']}\n{rule}\n\n"
+
+    def footer(self, content: Dict[str, str]) -> str:
+        return '\n\n'
+
+
+class JsonLinesFormatter(EntryFormatter):
+    """JSON Lines：每个页面一行，包含标题、来源和规范化后的正文"""
+
+    name = 'json'
+
+    def format_entry(self, content: Dict[str, str]) -> str:
+        record = {'filename': content['filename'], 'text': MarkdownNormalizer.normalize(content['text'])}
+        if 'source' in content:
+            record['source'] = str(content['source'])
+        return json.dumps(record, ensure_ascii=False) + '\n'
+
+
+FORMATTERS = {formatter.name: formatter for formatter in (MarkdownFormatter(), TextFormatter(), JsonLinesFormatter())}
+
+
+def get_formatter(name: str) -> EntryFormatter:
+    """按名称获取输出格式：markdown / txt / json"""
+    try:
+        return FORMATTERS[name]
+    except KeyError:
+        raise ValueError(f"未知的输出格式: {name}")
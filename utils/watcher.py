@@ -0,0 +1,125 @@
+import os
+import time
+import asyncio
+import logging
+from typing import Dict, List, Tuple, Optional, AsyncIterator
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
+    FileSystemEventHandler = object
+
+
+class _WakeHandler(FileSystemEventHandler):
+    """收到文件系统事件时唤醒事件循环中的监视器"""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, wake: asyncio.Event):
+        self.loop = loop
+        self.wake = wake
+
+    def on_any_event(self, event):
+        self.loop.call_soon_threadsafe(self.wake.set)
+
+
+class DirectoryWatcher:
+    """监视输入目录，分批返回已写入完成的新图片或被修改的图片
+
+    安装了 watchdog 时使用系统文件事件（Linux上为inotify）及时唤醒，否则定期扫描目录。
+    文件大小非零且最后修改时间距今超过 debounce 秒才视为写入完成，
+    避免处理扫描仪或同步工具尚未写完的文件。
+    """
+
+    def __init__(self, directory: str, extensions: List[str], poll_interval: float = 2.0,
+                 debounce: float = 2.0):
+        """初始化
+
+        Args:
+            directory: 监视的目录
+            extensions: 图片扩展名列表
+            poll_interval: 没有文件事件时的扫描间隔（秒）
+            debounce: 文件停止变化多久后视为写入完成（秒）
+        """
+        self.directory = directory
+        self.extensions = tuple(ext.lower() for ext in extensions)
+        self.poll_interval = poll_interval
+        self.debounce = debounce
+        self.seen: Dict[str, Tuple[int, int]] = {}
+
+    def scan(self) -> Dict[str, Tuple[int, int]]:
+        """扫描目录，返回 图片路径 -> (大小, 修改时间ns)"""
+        files = {}
+        try:
+            entries = list(os.scandir(self.directory))
+        except FileNotFoundError:
+            return files
+        for entry in entries:
+            if not entry.name.lower().endswith(self.extensions) or entry.name.startswith('.'):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            if entry.is_file():
+                files[entry.path] = (stat.st_size, stat.st_mtime_ns)
+        return files
+
+    def _ready(self, files: Dict[str, Tuple[int, int]]) -> Tuple[List[str], Optional[float]]:
+        """挑出写入完成且尚未返回过的文件
+
+        Returns:
+            (就绪的文件, 距离下一个文件就绪还需等待的秒数；没有待定文件时为None)
+        """
+        now = time.time()
+        ready = []
+        next_wait = None
+        for path, signature in files.items():
+            if self.seen.get(path) == signature:
+                continue
+            size, mtime_ns = signature
+            age = now - mtime_ns / 1e9
+            if size > 0 and age >= self.debounce:
+                ready.append(path)
+                self.seen[path] = signature
+            else:
+                wait = max(self.debounce - age, 0.1)
+                next_wait = wait if next_wait is None else min(next_wait, wait)
+        # 被删除的文件重新出现时视为新文件
+        for path in list(self.seen):
+            if path not in files:
+                del self.seen[path]
+        return sorted(ready), next_wait
+
+    async def batches(self, stop: asyncio.Event) -> AsyncIterator[List[str]]:
+        """持续返回就绪的图片批次，直到stop被设置"""
+        loop = asyncio.get_running_loop()
+        wake = asyncio.Event()
+        observer = None
+        if Observer is not None:
+            observer = Observer()
+            observer.schedule(_WakeHandler(loop, wake), self.directory, recursive=False)
+            observer.start()
+            logging.info(f"使用文件系统事件监视目录: {self.directory}")
+        else:
+            logging.info(f"未安装watchdog，每 {self.poll_interval} 秒扫描一次目录: {self.directory}")
+
+        try:
+            while not stop.is_set():
+                files = await loop.run_in_executor(None, self.scan)
+                ready, next_wait = self._ready(files)
+                if ready:
+                    yield ready
+
+                timeout = self.poll_interval if next_wait is None else min(self.poll_interval, next_wait)
+                wake.clear()
+                waiters = [asyncio.ensure_future(stop.wait()), asyncio.ensure_future(wake.wait())]
+                try:
+                    await asyncio.wait(waiters, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                finally:
+                    for waiter in waiters:
+                        waiter.cancel()
+        finally:
+            if observer is not None:
+                observer.stop()
+                observer.join()